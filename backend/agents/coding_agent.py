@@ -1,28 +1,54 @@
-from langchain_groq import ChatGroq
 from langchain.prompts import ChatPromptTemplate
-from utils.helpers import print_verbose
-from langfuse.decorators import observe
+from utils.helpers import print_verbose, estimate_tokens
+from utils.cache import get_cache, content_hash, normalize_text
+from utils.llm_registry import get_llm
+from langfuse.decorators import observe, langfuse_context
 
 class CodingAgent:
     def __init__(self):
-        self.llm = ChatGroq(
-            model='llama-3.1-70b-versatile',
-            temperature=0,
-            max_tokens=None,
-            timeout=None,
-            max_retries=2
-        )
+        self.llm = get_llm("coder")
+        self.cache = get_cache("llm")
 
     @observe(as_type="generation")
-    def generate_code(self, instructions):
+    async def generate_code(self, instructions, on_token=None, temperature=None):
         print_verbose(f"CodingAgent: Generating code for instructions: {instructions}")
         
         prompt = ChatPromptTemplate.from_messages([
-            ("system", "You are a Python coding assistant. Generate executable Python code based on the given instructions and if applicable, error messages. If additional packages need to be installed, provide shell code. Use shell blocks, respectively, for shell commands and python code. Only provide the code blocks, no other text."),
+            ("system", "You are a Python coding assistant. Generate executable Python code based on the given instructions and if applicable, error messages. If additional packages need to be installed, provide shell code. Use shell blocks, respectively, for shell commands and python code. Code runs in a persistent session, so variables listed as live are still defined: build on them and only write the new steps. To show a DataFrame or a matplotlib or Plotly figure, end the code with it or call display(obj) instead of printing it. Only provide the code blocks, no other text."),
             ("human", "{instructions}")
         ])
 
-        response = self.llm.invoke(prompt.format_messages(instructions=instructions))
+        messages = prompt.format_messages(instructions=instructions)
+        prompt_text = "".join(message.content for message in messages)
+        prompt_tokens = estimate_tokens(prompt_text)
+        print_verbose(f"CodingAgent: Prompt size: {len(prompt_text)} chars, ~{prompt_tokens} tokens")
+        langfuse_context.update_current_observation(
+            metadata={'prompt_chars': len(prompt_text), 'prompt_tokens_estimate': prompt_tokens}
+        )
+        # Keyed by model, temperature and whitespace-normalised prompt; sampled (non-zero temperature) answers are not cached
+        temperature = self.llm.temperature if temperature is None else temperature
+        cacheable = self.cache is not None and not temperature
+        cache_key = content_hash(self.llm.provider, self.llm.model_name, temperature,
+                                 [(message.type, normalize_text(message.content)) for message in messages])
+        content = await self.cache.get(cache_key) if cacheable else None
+        if content is not None:
+            print_verbose("CodingAgent: Using cached response")
+            if on_token is not None:
+                await on_token(content)
+            return content
+
+        options = {} if temperature == self.llm.temperature else {'temperature': temperature}
+        if on_token is None:
+            content = (await self.llm.ainvoke(messages, **options)).content
+        else:
+            chunks = []
+            async for chunk in self.llm.astream(messages, **options):
+                if chunk.content:
+                    chunks.append(chunk.content)
+                    await on_token(chunk.content)
+            content = "".join(chunks)
+        if cacheable:
+            await self.cache.set(cache_key, content)
 
-        print_verbose(f"CodingAgent: Generated code:\n{response.content}")
-        return response.content
+        print_verbose(f"CodingAgent: Generated code:\n{content}")
+        return content
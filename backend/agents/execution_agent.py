@@ -1,6 +1,16 @@
+import shutil
 import uuid
 from pathlib import Path
-from utils.helpers import print_verbose, install_packages, run_in_venv
+from utils.helpers import print_verbose, run_in_venv, run_blocking, venv_fingerprint, safe_path_name
+from utils.environment import environment_manager, parse_pip_install
+from utils.cache import get_cache, content_hash
+from utils.scheduler import execution_scheduler
+from utils.kernel_pool import get_kernel_pool
+from utils.metrics import span
+from utils.artifacts import artifact_store
+from utils import rich_output
+from utils.sandbox import ExecutionResult, default_limits
+from chat_workflow.config import use_kernel_pool
 from langfuse.decorators import observe
 
 class ExecutionAgent:
@@ -8,31 +18,160 @@ class ExecutionAgent:
         self.max_attempts = max_attempts
         self.coding_agent_dir = Path("coding_agent").absolute()
         self.coding_agent_dir.mkdir(exist_ok=True)
+        self.kernel_pool = get_kernel_pool(self.coding_agent_dir) if use_kernel_pool else None
+        self.cache = get_cache("execution")
+        self.limits = default_limits
 
     @observe()
-    async def execute_shell_commands(self, shell_commands: str):
+    async def execute_shell_commands(self, shell_commands: str, user_id: str = None):
         print_verbose(f"ExecutionAgent: Executing shell commands")
-        
-        results = []
-        for cmd in shell_commands.split('\n'):
-            if cmd.startswith('pip install'):
-                packages = cmd.split('pip install ')[1].split()
-                install_result = install_packages(packages)
-                results.append(install_result)
-        
-        return "\n".join(results)
+        await environment_manager.ensure()
+
+        packages = parse_pip_install(shell_commands)
+        if not packages:
+            return ""
+        return await execution_scheduler.submit(user_id or "anonymous", lambda: self._install(packages))
+
+    async def _install(self, packages):
+        with span("pip_install"):
+            return await environment_manager.install(packages)
 
     @observe()
-    async def execute_python_code(self, python_code: str):
+    async def execute_python_code(self, python_code: str, conversation_id: str = None, on_output=None, user_id: str = None):
         print_verbose(f"ExecutionAgent: Executing Python code")
-        
-        script_file = self.coding_agent_dir / f"script_{uuid.uuid4()}.py"
-        script_file.write_text(python_code)
+        await environment_manager.ensure()
+        return await execution_scheduler.submit(
+            user_id or "anonymous", lambda: self._execute_python_code(python_code, conversation_id, on_output))
+
+    @observe()
+    async def execute_in_sandbox(self, python_code: str, sandbox_id: str, user_id: str = None, priority: int = 0):
+        """Runs code in a fresh interpreter with its own working directory; returns an ExecutionResult."""
+        await environment_manager.ensure()
+        return await execution_scheduler.submit(
+            user_id or "anonymous", lambda: self._execute_in_sandbox(python_code, sandbox_id), priority)
+
+    def sandbox_dir(self, sandbox_id: str) -> Path:
+        return self.coding_agent_dir / "sandboxes" / sandbox_id
+
+    def conversation_dir(self, conversation_id: str) -> Path:
+        # Every conversation reads and writes files in a directory of its own, so the files found
+        # after a run are that run's, never those of another conversation running at the same time
+        return self.coding_agent_dir / "conversations" / safe_path_name(conversation_id)
+
+    async def _execute_in_sandbox(self, python_code: str, sandbox_id: str):
+        sandbox = self.sandbox_dir(sandbox_id)
+        await run_blocking(sandbox.mkdir, parents=True, exist_ok=True)
+        with span("script_run"):
+            outputs = []
+            if self.kernel_pool is not None:
+                result, outputs = await self._execute_cell(sandbox_id, python_code, None, sandbox)
+                success, stdout, stderr = result.success, result.stdout, result.stderr
+            else:
+                result = await self._run_in_scratch(python_code, sandbox, None)
+                success, stdout, stderr = result.returncode == 0 and result.limit is None, result.stdout, result.stderr
+            output = self._with_outputs(stdout if success else self.limits.failure(stderr, result.limit), outputs)
+            return ExecutionResult(success, output, await artifact_store.collect(sandbox, {}), result.limit, outputs)
+
+    async def _run_in_scratch(self, python_code: str, working_dir: Path, on_output):
+        # The script and its temporary files live in a directory of their own, removed after the run
+        run_dir = self.coding_agent_dir / "runs" / uuid.uuid4().hex
+        await run_blocking(run_dir.mkdir, parents=True)
+        try:
+            script_file = run_dir / "script.py"
+            await run_blocking(script_file.write_text, python_code)
+            return await run_in_venv(str(script_file), working_dir, on_output, limits=self.limits, scratch_dir=run_dir)
+        finally:
+            await run_blocking(shutil.rmtree, run_dir, ignore_errors=True)
 
-        result = run_in_venv(str(script_file), self.coding_agent_dir)
-        success = result.returncode == 0
+    async def adopt_sandbox(self, sandbox_id: str, conversation_id: str):
+        # The sandbox becomes the conversation's state: its kernel and the files it wrote
+        working_dir = self.conversation_dir(conversation_id)
+        if self.kernel_pool is not None:
+            await self.kernel_pool.adopt(sandbox_id, conversation_id, working_dir)
+        sandbox = self.sandbox_dir(sandbox_id)
+        if await run_blocking(sandbox.is_dir):
+            await run_blocking(shutil.copytree, sandbox, working_dir, dirs_exist_ok=True)
+            await run_blocking(shutil.rmtree, sandbox, ignore_errors=True)
+
+    async def discard_sandbox(self, sandbox_id: str):
+        if self.kernel_pool is not None:
+            await self.kernel_pool.release(sandbox_id)
+        await run_blocking(shutil.rmtree, self.sandbox_dir(sandbox_id), ignore_errors=True)
+
+    async def describe_namespace(self, conversation_id: str = None):
+        if self.kernel_pool is None or conversation_id is None:
+            return None
+        return await self.kernel_pool.describe(conversation_id)
+
+    async def _execute_python_code(self, python_code: str, conversation_id: str, on_output):
+        # Files the code creates or changes in the conversation's directory are captured as artifacts
+        with span("script_run"):
+            if self.kernel_pool is not None and conversation_id is not None:
+                working_dir = self.conversation_dir(conversation_id)
+                await run_blocking(working_dir.mkdir, parents=True, exist_ok=True)
+                before = await artifact_store.snapshot(working_dir)
+                result = await self._run_in_kernel(python_code, conversation_id, on_output, working_dir)
+                result.artifacts = await artifact_store.collect(working_dir, before)
+                return result
+            if conversation_id is not None:
+                return await self._run_script(python_code, on_output, self.conversation_dir(conversation_id))
+            # Without a conversation there is no state to keep, so the run gets a directory that is removed after it
+            working_dir = self.conversation_dir(f"anonymous-{uuid.uuid4().hex}")
+            try:
+                return await self._run_script(python_code, on_output, working_dir)
+            finally:
+                await run_blocking(shutil.rmtree, working_dir, ignore_errors=True)
+
+    async def _execute_cell(self, key: str, python_code: str, on_output, working_dir: Path):
+        # The cell writes its rich outputs to a directory of its own, emptied into the artifact store afterwards
+        display_dir = self.coding_agent_dir / "runs" / uuid.uuid4().hex
+        try:
+            result = await self.kernel_pool.execute(key, python_code, on_output, display_dir, working_dir)
+            return result, await rich_output.collect(display_dir, result.displays)
+        finally:
+            await run_blocking(shutil.rmtree, display_dir, ignore_errors=True)
+
+    def _with_outputs(self, output: str, outputs: list):
+        # The summary and retry prompts only see text, so they are told what was displayed
+        if not outputs:
+            return output
+        return "\n".join(text for text in (output.rstrip("\n"), rich_output.describe(outputs)) if text)
+
+    async def _run_in_kernel(self, python_code: str, conversation_id: str, on_output, working_dir: Path):
+        result, outputs = await self._execute_cell(conversation_id, python_code, on_output, working_dir)
+        print_verbose(f"ExecutionAgent: Execution result: {'Success' if result.success else 'Failure'}"
+                      + (f" ({result.limit} limit)" if result.limit else ""))
+        print_verbose(f"ExecutionAgent: Output: {result.stdout if result.success else result.stderr}")
+        output = result.stdout if result.success else self.limits.failure(result.stderr, result.limit)
+        return ExecutionResult(result.success, self._with_outputs(output, outputs), limit=result.limit, outputs=outputs)
+
+    async def _run_script(self, python_code: str, on_output, working_dir: Path):
+        await run_blocking(working_dir.mkdir, parents=True, exist_ok=True)
+        before = await artifact_store.snapshot(working_dir)
+        # Only stateless runs are cached: a kernel's result also depends on its live namespace. A script's
+        # result still depends on the files it can read, so the directory and what is in it are part of the key
+        cache_key = content_hash(python_code, await run_blocking(venv_fingerprint), str(working_dir),
+                                 sorted(before.items())) if self.cache else None
+        cached = await self.cache.get_json(cache_key) if cache_key else None
+        if cached is not None:
+            print_verbose("ExecutionAgent: Using cached execution result")
+            success, output, *artifacts = cached
+            if on_output is not None and output:
+                await on_output("stdout" if success else "stderr", output)
+            # Entries cached before artifacts were captured have none recorded
+            return ExecutionResult(success, output, artifacts[0] if artifacts else [])
+
+        result = await self._run_in_scratch(python_code, working_dir, on_output)
+        success = result.returncode == 0 and result.limit is None
         
-        print_verbose(f"ExecutionAgent: Execution result: {'Success' if success else 'Failure'}")
+        print_verbose(f"ExecutionAgent: Execution result: {'Success' if success else 'Failure'}"
+                      + (f" ({result.limit} limit)" if result.limit else ""))
         print_verbose(f"ExecutionAgent: Output: {result.stdout if success else result.stderr}")
-        
-        return success, result.stdout if success else f"Execution failed. Error: {result.stderr}"
+
+        output = result.stdout if success else self.limits.failure(result.stderr, result.limit)
+        artifacts = await artifact_store.collect(working_dir, before)
+        # Runs stopped by a limit are not cached: whether a timeout is hit depends on the machine's load.
+        # Nor are runs that changed files, since a cache hit would not change them again
+        if cache_key and result.limit is None and await artifact_store.snapshot(working_dir) == before:
+            await self.cache.set_json(cache_key, [success, output, artifacts])
+        return ExecutionResult(success, output, artifacts, result.limit)
@@ -0,0 +1,60 @@
+import asyncio
+import json
+import os
+import socket
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def prepare_environment(database_url=None):
+    # The backend creates its venv, scratch dir and SQLite file relative to the cwd,
+    # so run each benchmark in a throwaway directory.
+    workdir = Path(tempfile.mkdtemp(prefix="bench_"))
+    os.chdir(workdir)
+    os.environ.setdefault("DATABASE_URL", database_url or f"sqlite:///{workdir / 'bench.db'}")
+    os.environ.setdefault("GROQ_API_KEY", "offline")
+    sys.path.insert(0, str(BACKEND_DIR))
+    return workdir
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def start_server(app, port):
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+async def receive_messages(ws):
+    """The backend's messages on a websocket, with batch frames unpacked in order."""
+    while True:
+        data = json.loads(await ws.recv())
+        for message in data['messages'] if data.get('type') == 'batch' else [data]:
+            yield message
+
+
+def rss_mb(pid="self"):
+    """Resident memory of a process in MB, read from /proc; 0 once it has exited."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (FileNotFoundError, ProcessLookupError):
+        return 0.0
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
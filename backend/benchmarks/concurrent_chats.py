@@ -0,0 +1,57 @@
+"""N simultaneous websocket chats should finish in roughly the time of one.
+
+Usage: python -m benchmarks.concurrent_chats [--clients 8] [--llm-latency 0.5]
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from benchmarks.common import prepare_environment, free_port, start_server, receive_messages
+
+
+async def run_chat(url: str, instructions: str):
+    import websockets
+    async with websockets.connect(url, max_size=None) as ws:
+        await ws.send(json.dumps({'type': 'message', 'message': instructions, 'conversation_id': str(uuid.uuid4())}))
+        start = time.perf_counter()
+        async for data in receive_messages(ws):
+            if data.get('type') == 'chat_message' and data['message']['content'].startswith('Execution Summary'):
+                return time.perf_counter() - start
+
+
+async def main(clients: int, llm_latency: float):
+    prepare_environment()
+    import main as backend
+    from benchmarks.fake_llm import patch_llm
+    patch_llm(latency=llm_latency)
+    await backend.create_db_and_tables()
+
+    port = free_port()
+    server, task = await start_server(backend.app, port)
+    url = f"ws://127.0.0.1:{port}/ws"
+    try:
+        # Warm up so kernel start-up does not dominate the single-client baseline
+        await run_chat(url, "warm up")
+
+        start = time.perf_counter()
+        await run_chat(url, "single chat")
+        single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        await asyncio.gather(*(run_chat(url, f"chat {i}") for i in range(clients)))
+        concurrent = time.perf_counter() - start
+    finally:
+        server.should_exit = True
+        await task
+
+    print(f"1 chat:        {single:.2f}s")
+    print(f"{clients} concurrent: {concurrent:.2f}s ({concurrent / single:.2f}x of one chat)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    args = parser.parse_args()
+    asyncio.run(main(args.clients, args.llm_latency))
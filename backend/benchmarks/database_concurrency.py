@@ -0,0 +1,130 @@
+"""Concurrent conversations against the database: sync session on the event loop versus the async layer.
+
+Each conversation runs turns that load a history page, write the turn's messages and update the
+summary, with a short pause between turns for the LLM. Reports turns/sec, DB time per turn and the
+event-loop lag the other users on the worker would see.
+
+Usage: python -m benchmarks.database_concurrency [--database-url postgresql://...] [--conversations 50] [--turns 10]
+Defaults to a temporary SQLite file.
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from datetime import datetime
+from benchmarks.common import prepare_environment, percentile
+
+MESSAGES_PER_TURN = 6
+HISTORY_PAGE = 50
+
+
+def sample_message(i):
+    return {'type': 'chat_message', 'message': {'role': 'system', 'content': f"Python Execution Result:\n\n```\n{'x' * 200} {i}\n```"}}
+
+
+def sync_turn(session, conversation_id):
+    # The previous layer: one Session held for the whole connection, every query blocking the event loop
+    from sqlalchemy import update
+    from sqlmodel import select
+    from database.models import Conversation, Message
+
+    session.exec(select(Message).where(Message.conversation_id == conversation_id)
+                 .order_by(Message.message_number.desc()).limit(HISTORY_PAGE + 1)).all()
+    last_number = session.execute(
+        update(Conversation).where(Conversation.conversation_id == conversation_id)
+        .values(message_count=Conversation.message_count + MESSAGES_PER_TURN, updated_at=datetime.utcnow())
+        .returning(Conversation.message_count)
+    ).scalar()
+    if last_number is None:
+        session.add(Conversation(conversation_id=conversation_id, user_id="bench", message_count=MESSAGES_PER_TURN))
+        last_number = MESSAGES_PER_TURN
+    session.add_all([Message(conversation_id=conversation_id, user_id="bench", message_number=last_number - MESSAGES_PER_TURN + 1 + i,
+                             message_data=json.dumps(sample_message(i))) for i in range(MESSAGES_PER_TURN)])
+    session.commit()
+    conversation = session.get(Conversation, conversation_id)
+    conversation.summary = "benchmark"
+    session.commit()
+
+
+async def async_turn(conversation_id):
+    from database.ConversationMemory import ConversationMemory, MessageBatch
+
+    await ConversationMemory.get_history_page(conversation_id, "bench", limit=HISTORY_PAGE)
+    batch = MessageBatch("bench", conversation_id)
+    for i in range(MESSAGES_PER_TURN):
+        batch.add(sample_message(i))
+    await batch.flush()
+    await ConversationMemory.update_summary(conversation_id, "bench", "benchmark")
+
+
+async def run_mode(mode, conversations, turns, think):
+    durations, lags = [], []
+    running = True
+
+    async def watch_loop():
+        # How late a 5ms timer fires is how long the loop was blocked for everyone else
+        while running:
+            start = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append(time.perf_counter() - start - 0.005)
+
+    async def conversation():
+        conversation_id = str(uuid.uuid4())
+        session = None
+        if mode == "sync":
+            from sqlmodel import Session
+            session = Session(sync_engine)
+        try:
+            for _ in range(turns):
+                start = time.perf_counter()
+                if session is not None:
+                    sync_turn(session, conversation_id)
+                else:
+                    await async_turn(conversation_id)
+                durations.append(time.perf_counter() - start)
+                await asyncio.sleep(think)
+        finally:
+            if session is not None:
+                session.close()
+
+    watcher = asyncio.create_task(watch_loop())
+    start = time.perf_counter()
+    await asyncio.gather(*(conversation() for _ in range(conversations)))
+    elapsed = time.perf_counter() - start
+    running = False
+    await watcher
+    return conversations * turns / elapsed, durations, lags
+
+
+async def main(database_url, conversations, turns, think):
+    global sync_engine
+    prepare_environment(database_url)
+    import main as backend  # noqa: F401  (resolves the backend's import order)
+    from sqlmodel import SQLModel, create_engine
+    from database.ConversationMemory import DATABASE_URL, create_db_and_tables, engine
+
+    # The sync baseline runs first, before the async engine switches an SQLite file to WAL
+    sync_engine = create_engine(DATABASE_URL)
+    SQLModel.metadata.create_all(sync_engine)
+    results = {'sync session': await run_mode("sync", conversations, turns, think)}
+    sync_engine.dispose()
+    await create_db_and_tables()
+    results['async, session per op'] = await run_mode("async", conversations, turns, think)
+    await engine.dispose()
+
+    print(f"Backend: {engine.url.get_backend_name()}, {conversations} conversations x {turns} turns")
+    for mode, (rate, durations, lags) in results.items():
+        print(f"  {mode:<22} {rate:>8.0f} turns/sec   DB time per turn p50 {percentile(durations, 50) * 1000:>6.1f}ms"
+              f" p99 {percentile(durations, 99) * 1000:>6.1f}ms   loop lag p99 {percentile(lags, 99) * 1000:>6.1f}ms"
+              f" max {max(lags) * 1000:>6.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--think", type=float, default=0.01, help="pause between turns, standing in for the LLM")
+    args = parser.parse_args()
+    asyncio.run(main(args.database_url, args.conversations, args.turns, args.think))
@@ -0,0 +1,10 @@
+def patch_llm(response: str = None, latency: float = 0.5, rules=None):
+    # Point every role at the registry's offline provider; import after main to avoid the import cycle
+    from utils.llm_registry import llm_registry
+    options = {'latency': latency}
+    if response is not None:
+        options['response'] = response
+    if rules:
+        options['rules'] = rules
+    for role in list(llm_registry.roles):
+        llm_registry.configure(role, provider="fake", **options)
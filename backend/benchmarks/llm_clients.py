@@ -0,0 +1,74 @@
+"""Per-turn LLM client overhead, shared registry versus a new ChatGroq per call, and the concurrency cap.
+
+Usage: python -m benchmarks.llm_clients [--turns 200] [--calls 64] [--llm-latency 0.05]
+"""
+import argparse
+import asyncio
+import time
+from benchmarks.common import prepare_environment
+
+
+def per_turn_construction(turns: int):
+    from langchain_groq import ChatGroq
+    from chat_workflow.chat_manager import ChatManager
+
+    start = time.perf_counter()
+    for _ in range(turns):
+        # What a turn used to build: one coder, one summarizer and one title client
+        for _ in range(3):
+            ChatGroq(model='llama-3.1-70b-versatile', temperature=0, max_retries=2)
+    per_call = (time.perf_counter() - start) / turns
+
+    start = time.perf_counter()
+    for _ in range(turns):
+        ChatManager(asyncio.Queue())
+    registry = (time.perf_counter() - start) / turns
+    return per_call, registry
+
+
+async def concurrency(calls: int, llm_latency: float):
+    from langchain_core.messages import HumanMessage
+    from utils.llm_registry import llm_registry
+
+    llm_registry.configure("benchmark", provider="fake", latency=llm_latency)
+    client = llm_registry.get("benchmark")
+    peak = 0
+
+    async def call():
+        await client.ainvoke([HumanMessage(content="hello")])
+
+    async def watch():
+        nonlocal peak
+        while True:
+            peak = max(peak, llm_registry.in_flight.get("fake", 0))
+            await asyncio.sleep(0.001)
+
+    watcher = asyncio.create_task(watch())
+    start = time.perf_counter()
+    await asyncio.gather(*(call() for _ in range(calls)))
+    elapsed = time.perf_counter() - start
+    watcher.cancel()
+    return elapsed, peak, llm_registry.max_concurrent
+
+
+def main(turns: int, calls: int, llm_latency: float):
+    prepare_environment()
+    import main as backend  # noqa: F401  (resolves the import order between agents and chat_workflow)
+    from benchmarks.fake_llm import patch_llm
+    patch_llm(latency=llm_latency)
+
+    per_call, registry = per_turn_construction(turns)
+    print(f"Client setup per turn, new ChatGroq per call: {per_call * 1000:.2f}ms")
+    print(f"Client setup per turn, shared registry:       {registry * 1000:.2f}ms")
+
+    elapsed, peak, limit = asyncio.run(concurrency(calls, llm_latency))
+    print(f"{calls} concurrent calls: {elapsed:.2f}s, peak in flight {peak} (limit {limit})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--calls", type=int, default=64)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    args = parser.parse_args()
+    main(args.turns, args.calls, args.llm_latency)
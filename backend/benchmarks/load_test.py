@@ -0,0 +1,293 @@
+"""Offline load test of the websocket workflow, to catch ChatManager and ConversationMemory regressions before a deploy.
+
+Simulated clients speak the frontend's message/meta protocol to the real server, with every LLM role
+answered by the registry's deterministic fake provider. Scenarios:
+  chats    many clients running chat turns at once
+  history  clients opening long conversations and paging back through all of their history
+  output   turns whose code prints a large amount of output
+  retries  turns whose first program fails, so the retry loop runs
+Each reports p50/p99 latency, throughput and memory (the server process plus its kernels). Response and
+execution caches are off unless CACHE_ENABLED is set, so every turn takes the full path.
+
+Usage: python -m benchmarks.load_test [--scenarios chats,history,output,retries] [--clients 10] [--turns 3]
+       [--save results.json] [--compare baseline.json [--tolerance 0.2]]
+With --compare the exit status is 1 when a scenario's p99 latency or throughput is worse than the
+baseline by more than the tolerance.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+import time
+import uuid
+from benchmarks.common import prepare_environment, free_port, start_server, receive_messages, rss_mb, percentile
+
+FAIL_MARKER = "[bench:fail]"
+OUTPUT_MARKER = "[bench:output]"
+USER_ID = "test_user"  # the user the websocket endpoint serves
+
+
+def llm_rules(output_lines):
+    # Checked in order against the last prompt message; the retry prompt quotes the failed attempt
+    return [
+        ("Previous attempt:", "```python\nprint('fixed on retry')\n```"),
+        (FAIL_MARKER, "```python\nraise ValueError('first attempt fails')\n```"),
+        (OUTPUT_MARKER, f"```python\nfor i in range({output_lines}):\n    print(f'row {{i:>6}} ' + 'x' * 80)\n```"),
+    ]
+
+
+def tree_rss_mb():
+    # The server runs in this process; kernels and generated scripts are its descendants
+    total, pids = 0.0, [str(os.getpid())]
+    while pids:
+        pid = pids.pop()
+        total += rss_mb(pid)
+        for children in glob.glob(f"/proc/{pid}/task/*/children"):
+            try:
+                with open(children) as f:
+                    pids.extend(f.read().split())
+            except FileNotFoundError:
+                pass
+    return total
+
+
+class MemorySampler:
+    """Samples the process tree's RSS in the background while a scenario runs."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.start = self.peak = self.end = 0.0
+
+    async def _sample(self):
+        while True:
+            self.peak = max(self.peak, tree_rss_mb())
+            await asyncio.sleep(self.interval)
+
+    async def __aenter__(self):
+        self.start = self.peak = tree_rss_mb()
+        self.task = asyncio.create_task(self._sample())
+        return self
+
+    async def __aexit__(self, *exc):
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.end = tree_rss_mb()
+
+
+class Client:
+    """One simulated browser tab on a websocket."""
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.messages = receive_messages(ws)
+
+    async def send(self, message):
+        await self.ws.send(json.dumps(message))
+
+    async def until(self, action):
+        # Meta messages the scenario is not waiting for, such as the conversation list, are skipped
+        async for data in self.messages:
+            if data.get('type') == 'meta' and data.get('action') == action:
+                return data
+
+    async def chat(self, conversation_id, instructions):
+        """Runs one turn; returns its latency, time to the first response, attempts and streamed execution output size."""
+        start = time.perf_counter()
+        first = None
+        attempts = chars = 0
+        failed = False
+        await self.send({'type': 'message', 'message': instructions, 'conversation_id': conversation_id})
+        async for data in self.messages:
+            kind = data.get('type')
+            if kind in ('chat_delta', 'exec_stream', 'chat_message') and first is None:
+                first = time.perf_counter() - start
+            if kind == 'exec_stream':
+                chars += len(data['text'])
+            elif kind == 'chat_message' and not data.get('replace_last'):
+                # A streamed message is sent again complete with replace_last, so only the first copy counts
+                content = data['message']['content']
+                attempts += content.startswith("Generated Code")
+                failed |= content.startswith("Request failed")
+            elif kind == 'meta' and data.get('action') in ('turn_complete', 'turn_cancelled'):
+                failed |= data['action'] == 'turn_cancelled'
+                return {'latency': time.perf_counter() - start, 'first': first or 0.0,
+                        'attempts': attempts, 'chars': chars, 'failed': failed}
+
+
+async def connect(url):
+    import websockets
+    return Client(await websockets.connect(url, max_size=None))
+
+
+async def run_turns(url, clients, turns, instructions):
+    async def client(i):
+        client = await connect(url)
+        try:
+            conversation_id = str(uuid.uuid4())
+            # Unique instructions, so no two turns could share a response even with caching on
+            return [await client.chat(conversation_id, f"{instructions} (client {i}, turn {t}, {uuid.uuid4()})")
+                    for t in range(turns)]
+        finally:
+            await client.ws.close()
+
+    start = time.perf_counter()
+    results = [turn for turns in await asyncio.gather(*(client(i) for i in range(clients))) for turn in turns]
+    return results, time.perf_counter() - start
+
+
+def turn_report(results, elapsed, **extra):
+    latencies = [r['latency'] for r in results]
+    first = [r['first'] for r in results]
+    return dict(
+        p50=percentile(latencies, 50), p99=percentile(latencies, 99),
+        first_p50=percentile(first, 50), first_p99=percentile(first, 99),
+        throughput=len(results) / elapsed, unit="turns/s",
+        errors=sum(r['failed'] for r in results), **extra
+    )
+
+
+async def scenario_chats(url, args):
+    results, elapsed = await run_turns(url, args.clients, args.turns, "Compute some statistics")
+    return turn_report(results, elapsed)
+
+
+async def scenario_output(url, args):
+    results, elapsed = await run_turns(url, args.clients, 1, f"Print the whole table {OUTPUT_MARKER}")
+    streamed = sum(r['chars'] for r in results) / (1024 * 1024)
+    return turn_report(results, elapsed, streamed_mb=round(streamed, 1), mb_per_s=round(streamed / elapsed, 1))
+
+
+async def scenario_retries(url, args):
+    results, elapsed = await run_turns(url, args.clients, args.turns, f"Fit the model {FAIL_MARKER}")
+    attempts = sum(r['attempts'] for r in results) / max(1, len(results))
+    return turn_report(results, elapsed, attempts_per_turn=round(attempts, 2))
+
+
+async def seed_history(messages):
+    from database.ConversationMemory import ConversationMemory
+    conversation_id = str(uuid.uuid4())
+    for start in range(0, messages, 500):
+        await ConversationMemory.add_messages(USER_ID, conversation_id, [
+            {'type': 'chat_message', 'message': {'role': 'user' if i % 2 == 0 else 'system', 'content': f"Message {i}: " + 'y' * 200}}
+            for i in range(start, min(messages, start + 500))
+        ])
+    return conversation_id
+
+
+async def scenario_history(url, args):
+    conversation_ids = [await seed_history(args.history_messages) for _ in range(args.clients)]
+
+    async def load(conversation_id):
+        # Opens the conversation, then scrolls back page by page as the frontend does
+        client = await connect(url)
+        try:
+            pages, loaded = [], 0
+            start = time.perf_counter()
+            await client.send({'type': 'meta', 'action': 'load_conversation', 'conversation_id': conversation_id})
+            page = await client.until('history_page')
+            while True:
+                pages.append(time.perf_counter() - start)
+                loaded += len(page['data']['messages'])
+                if not page['data']['has_more']:
+                    return pages, loaded
+                start = time.perf_counter()
+                await client.send({'type': 'meta', 'action': 'load_more', 'conversation_id': conversation_id,
+                                   'cursor': page['data']['cursor']})
+                page = await client.until('history_page')
+        finally:
+            await client.ws.close()
+
+    start = time.perf_counter()
+    loads = await asyncio.gather(*(load(conversation_id) for conversation_id in conversation_ids))
+    elapsed = time.perf_counter() - start
+    pages = [latency for page_latencies, _ in loads for latency in page_latencies]
+    loaded = sum(count for _, count in loads)
+    return dict(p50=percentile(pages, 50), p99=percentile(pages, 99), throughput=loaded / elapsed, unit="messages/s",
+                errors=sum(count != args.history_messages for _, count in loads), pages=len(pages))
+
+
+SCENARIOS = {
+    'chats': scenario_chats,
+    'history': scenario_history,
+    'output': scenario_output,
+    'retries': scenario_retries,
+}
+
+
+def compare(results, baseline, tolerance):
+    # Latency regresses upwards and throughput downwards; scenarios missing from either run are skipped
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if current['p99'] > previous['p99'] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {previous['p99'] * 1000:.0f}ms -> {current['p99'] * 1000:.0f}ms")
+        if current['throughput'] < previous['throughput'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {previous['throughput']:.1f} -> {current['throughput']:.1f} {current['unit']}")
+    return regressions
+
+
+async def main(args):
+    prepare_environment()
+    os.environ.setdefault("CACHE_ENABLED", "false")
+    import main as backend
+    from benchmarks.fake_llm import patch_llm
+    patch_llm(latency=args.llm_latency, response="```python\nprint(sum(i * i for i in range(10 ** 5)))\n```",
+              rules=llm_rules(args.output_lines))
+    await backend.create_db_and_tables()
+
+    port = free_port()
+    server, task = await start_server(backend.app, port)
+    url = f"ws://127.0.0.1:{port}/ws"
+    results = {}
+    try:
+        await run_turns(url, 1, 1, "Warm up")  # so kernel start-up is not charged to the first scenario
+        for name in args.scenarios.split(","):
+            async with MemorySampler() as memory:
+                report = await SCENARIOS[name](url, args)
+            report.update(rss_start_mb=round(memory.start, 1), rss_peak_mb=round(memory.peak, 1), rss_end_mb=round(memory.end, 1))
+            results[name] = report
+    finally:
+        server.should_exit = True
+        await task
+
+    print(f"\n{args.clients} clients, LLM latency {args.llm_latency:g}s")
+    print(f"  {'scenario':<9} {'p50 ms':>8} {'p99 ms':>8} {'throughput':>18} {'errors':>6} {'RSS start/peak/end MB':>24}  details")
+    for name, r in results.items():
+        details = {k: v for k, v in r.items() if k not in ('p50', 'p99', 'throughput', 'unit', 'errors')
+                   and not k.startswith('rss_')}
+        details = ", ".join(f"{k}={v * 1000:.0f}ms" if k.startswith('first_') else f"{k}={v}" for k, v in details.items())
+        print(f"  {name:<9} {r['p50'] * 1000:>8.0f} {r['p99'] * 1000:>8.0f} {r['throughput']:>8.1f} {r['unit']:<9} {r['errors']:>6}"
+              f" {r['rss_start_mb']:>8.0f}/{r['rss_peak_mb']:.0f}/{r['rss_end_mb']:.0f}{'':>6}  {details}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=3, help="turns per client in the chats and retries scenarios")
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--history-messages", type=int, default=2000, help="messages per conversation in the history scenario")
+    parser.add_argument("--output-lines", type=int, default=10000, help="lines printed per turn in the output scenario")
+    parser.add_argument("--save", help="write the results as JSON, to compare later runs against")
+    parser.add_argument("--compare", help="results JSON of a baseline run")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative change counted as a regression")
+    args = parser.parse_args()
+    # Paths are resolved before prepare_environment moves into its scratch directory
+    args.save = args.save and os.path.abspath(args.save)
+    args.compare = args.compare and os.path.abspath(args.compare)
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,53 @@
+"""Messages/sec for ConversationMemory writes, one commit per message versus one per turn.
+
+Usage: python -m benchmarks.message_writes [--database-url postgresql://...] [--turns 200]
+Defaults to a temporary SQLite file.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from benchmarks.common import prepare_environment
+
+MESSAGES_PER_TURN = 10
+
+
+def sample_message(i):
+    return {'type': 'chat_message', 'message': {'role': 'system', 'content': f"Python Execution Result:\n\n```\n{'x' * 200} {i}\n```"}}
+
+
+async def run(database_url, turns):
+    prepare_environment(database_url)
+    import main  # noqa: F401  (resolves the backend's import order)
+    from database.ConversationMemory import ConversationMemory, MessageBatch, create_db_and_tables, engine
+    await create_db_and_tables()
+
+    results = {}
+    conversation_id = str(uuid.uuid4())
+    start = time.perf_counter()
+    for turn in range(turns):
+        for i in range(MESSAGES_PER_TURN):
+            await ConversationMemory.add_message("bench", conversation_id, sample_message(i))
+    results['per-message commit'] = turns * MESSAGES_PER_TURN / (time.perf_counter() - start)
+
+    conversation_id = str(uuid.uuid4())
+    start = time.perf_counter()
+    for turn in range(turns):
+        batch = MessageBatch("bench", conversation_id)
+        for i in range(MESSAGES_PER_TURN):
+            batch.add(sample_message(i))
+        await batch.flush()
+    results['batched per turn'] = turns * MESSAGES_PER_TURN / (time.perf_counter() - start)
+    await engine.dispose()
+
+    print(f"Backend: {engine.url.get_backend_name()}, {turns} turns x {MESSAGES_PER_TURN} messages")
+    for mode, rate in results.items():
+        print(f"  {mode:<20} {rate:>10.0f} messages/sec")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--turns", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args.database_url, args.turns))
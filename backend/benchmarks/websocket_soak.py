@@ -0,0 +1,100 @@
+"""Websocket soak: thousands of connect / list conversations / disconnect cycles should leave nothing behind.
+
+Samples the process RSS, the number of asyncio tasks and the connection manager's tables as the
+cycles run; all of them should stay flat. Then connects a client that stops reading while the server
+keeps sending, to show its queue stays bounded and the client is disconnected as stalled.
+
+Usage: python -m benchmarks.websocket_soak [--cycles 5000] [--concurrency 50]
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from benchmarks.common import prepare_environment, free_port, start_server, receive_messages, rss_mb
+
+
+async def cycle(url):
+    import websockets
+    async with websockets.connect(url) as ws:
+        await ws.send(json.dumps({'type': 'meta', 'action': 'get_conversations'}))
+        async for data in receive_messages(ws):
+            if data.get('action') == 'conversations':
+                return
+
+
+async def soak(url, cycles, concurrency, connection_manager):
+    samples = []
+    started = completed = 0
+
+    async def client():
+        nonlocal started, completed
+        while started < cycles:
+            started += 1
+            await cycle(url)
+            completed += 1
+            if completed % max(1, cycles // 10) == 0:
+                # Counts include the cycles still open on the other clients
+                samples.append((completed, rss_mb(), len(asyncio.all_tasks()),
+                                len(connection_manager.active_connections), len(connection_manager.outbound_queues)))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return samples, time.perf_counter() - start
+
+
+async def stalled_client(url, connection_manager, messages):
+    import websockets
+    # max_queue=1 and no reads: the client's socket buffers fill and the server's sends block
+    async with websockets.connect(url, max_queue=1, max_size=None) as ws:
+        while not connection_manager.outbound_queues:
+            await asyncio.sleep(0.01)
+        client_id, queue = next(iter(connection_manager.outbound_queues.items()))
+        payload = os.urandom(32 * 1024).hex()  # incompressible, so deflate cannot hide the backlog
+        max_depth, start = 0, time.perf_counter()
+        for i in range(messages):
+            await connection_manager.send_message_to_client({'type': 'meta', 'action': 'soak', 'data': payload}, client_id)
+            max_depth = max(max_depth, queue.qsize())
+            if queue.closed:
+                break
+        disconnected = client_id not in connection_manager.outbound_queues
+        return i + 1, max_depth, disconnected, time.perf_counter() - start
+
+
+async def main(cycles, concurrency):
+    prepare_environment()
+    os.environ.setdefault("WS_QUEUE_MAX_MESSAGES", "200")
+    os.environ.setdefault("WS_SEND_TIMEOUT", "2")
+    import main as backend
+    from utils.connection_manager import connection_manager
+    from chat_workflow.config import ws_queue_max_messages
+    await backend.create_db_and_tables()
+
+    port = free_port()
+    server, task = await start_server(backend.app, port)
+    url = f"ws://127.0.0.1:{port}/ws"
+    try:
+        await cycle(url)  # warm up
+        samples, elapsed = await soak(url, cycles, concurrency, connection_manager)
+        await asyncio.sleep(0.5)  # let the last closing handshakes finish
+        samples.append((cycles, rss_mb(), len(asyncio.all_tasks()),
+                        len(connection_manager.active_connections), len(connection_manager.outbound_queues)))
+        sent, max_depth, disconnected, stall_time = await stalled_client(url, connection_manager, 5000)
+    finally:
+        server.should_exit = True
+        await task
+
+    print(f"{cycles} connect/disconnect cycles, {concurrency} at a time: {cycles / elapsed:.0f} cycles/sec")
+    print(f"  {'cycles':>7} {'RSS MB':>8} {'tasks':>6} {'sockets':>8} {'queues':>7}")
+    for done, rss, tasks, sockets, queues in samples:
+        print(f"  {done:>7} {rss:>8.1f} {tasks:>6} {sockets:>8} {queues:>7}")
+    print(f"Stalled client: {sent} messages of 64 KB offered, queue depth peaked at {max_depth} "
+          f"(limit {ws_queue_max_messages}), disconnected: {disconnected} after {stall_time:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cycles", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.cycles, args.concurrency))
@@ -0,0 +1,128 @@
+"""Chat throughput with distributed chat jobs as the number of server processes grows.
+
+Each round starts that many uvicorn processes sharing one Redis broker and one database, and
+spreads the chats over their sockets as a load balancer would. Every chat is submitted through
+the broker job queue, may run on any process, and its messages are routed back to the socket's
+process through the connection registry.
+
+Without --broker-url a local redis-server is started when one is on the PATH, otherwise an
+in-process fakeredis TCP server stands in; that one is a single Python thread pool, so its
+numbers show whether the processes cooperate, not what Redis itself would sustain.
+
+Usage: python -m benchmarks.worker_scaling [--processes 1 2 4] [--workers 4] [--chats 16] [--broker-url redis://...]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+from benchmarks.common import BACKEND_DIR, prepare_environment, free_port
+from benchmarks.concurrent_chats import run_chat
+
+
+def start_broker(broker_url):
+    """Returns the broker URL and a function stopping whatever was started for it."""
+    if broker_url:
+        return broker_url, lambda: None
+    port = free_port()
+    if shutil.which("redis-server"):
+        process = subprocess.Popen(["redis-server", "--port", str(port), "--save", "", "--appendonly", "no"],
+                                   stdout=subprocess.DEVNULL)
+        wait_for_port(port)
+        return f"redis://127.0.0.1:{port}", process.terminate
+    from fakeredis import TcpFakeServer
+    print("redis-server not found; using an in-process fakeredis server (not representative of Redis throughput)")
+    server = TcpFakeServer(("127.0.0.1", port))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"redis://127.0.0.1:{port}", server.shutdown
+
+
+def wait_for_port(port, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def start_servers(count, env):
+    servers = []
+    for _ in range(count):
+        port = free_port()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+            env=env)
+        servers.append((process, port))
+    for _, port in servers:
+        wait_for_port(port)
+    return servers
+
+
+def stop_servers(servers):
+    for process, _ in servers:
+        process.terminate()
+    for process, _ in servers:
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def prepare_shared_state():
+    # Tables and the execution venv are created once here, not raced by every process's startup
+    import main as backend
+    from utils.environment import environment_manager
+    await backend.create_db_and_tables()
+    await environment_manager.ensure()
+
+
+async def run_round(urls, chats, tag):
+    # Warm every process so kernel and connection start-up is not charged to the round
+    await asyncio.gather(*(run_chat(url, f"warm up {tag}") for url in urls))
+    start = time.perf_counter()
+    await asyncio.gather(*(run_chat(urls[i % len(urls)], f"chat {tag}-{i}") for i in range(chats)))
+    return chats / (time.perf_counter() - start)
+
+
+def main(process_counts, workers, chats, llm_latency, broker_url):
+    workdir = prepare_environment()
+    asyncio.run(prepare_shared_state())
+    broker_url, stop_broker = start_broker(broker_url)
+    env = dict(os.environ, BROKER_URL=broker_url, CHAT_JOBS_DISTRIBUTED="true", CHAT_JOB_WORKERS=str(workers),
+               LLM_PROVIDER="fake", LLM_FAKE_LATENCY=str(llm_latency), KERNEL_MAX_KERNELS=str(chats),
+               PYTHONPATH=os.pathsep.join(filter(None, [str(BACKEND_DIR), os.environ.get("PYTHONPATH")])))
+    results = []
+    try:
+        for count in process_counts:
+            servers = start_servers(count, env)
+            try:
+                urls = [f"ws://127.0.0.1:{port}/ws" for _, port in servers]
+                results.append((count, asyncio.run(run_round(urls, chats, count))))
+            finally:
+                stop_servers(servers)
+    finally:
+        stop_broker()
+
+    baseline = results[0][1] / results[0][0]
+    print(f"{chats} chats per round, {workers} job workers per process, broker {broker_url}, state in {workdir}")
+    for count, throughput in results:
+        print(f"  {count:>3} processes: {throughput:6.2f} chats/s  (scaling efficiency {throughput / (baseline * count):.0%})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--workers", type=int, default=4, help="chat job workers in each process")
+    parser.add_argument("--chats", type=int, default=16)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--broker-url", default=None)
+    args = parser.parse_args()
+    main(args.processes, args.workers, args.chats, args.llm_latency, args.broker_url)
@@ -1,31 +1,66 @@
 import asyncio
 import uuid
 import json
-from langchain_groq import ChatGroq
 from langchain.prompts import ChatPromptTemplate
-from utils.helpers import print_verbose
+from utils.helpers import print_verbose, truncate_middle
+from utils.llm_registry import get_llm
+from utils.metrics import profile_turn
+from utils.artifacts import artifact_store
+from utils.sandbox import LIMIT_HINTS
 from agents.coding_agent import CodingAgent
 from agents.execution_agent import ExecutionAgent
-from database.ConversationMemory import ConversationMemory
+from database.ConversationMemory import ConversationMemory, MessageBatch
+from chat_workflow.config import streaming_enabled, context_max_message_chars
+from chat_workflow.context_manager import ContextManager
+from chat_workflow.speculation import SpeculativeExecutor
 from langfuse.decorators import observe, langfuse_context
 
 class ChatManager:
-    def __init__(self, message_queue: asyncio.Queue):
+    def __init__(self, message_queue: asyncio.Queue, conversation_id: str = None, quota_key: str = None):
         self.message_queue = message_queue
+        # Stamped on every message of the turn, so a client showing another conversation can drop them
+        self.conversation_id = conversation_id
+        # Whose execution quota the turn's runs count against; the user's unless the caller knows better
+        self.quota_key = quota_key
         
         self.coding_agent = CodingAgent()
         self.execution_agent = ExecutionAgent()
-        self.llm = ChatGroq(
-            model='llama-3.1-70b-versatile',
-            temperature=0,
-            max_tokens=None,
-            timeout=None,
-            max_retries=2
-        )
+        self.llm = get_llm("summarizer")
+        self.context_manager = ContextManager(self.llm)
+        self.speculative = SpeculativeExecutor(self)
 
     async def send(self, message: dict):
+        if self.conversation_id is not None:
+            message = {**message, 'conversation_id': self.conversation_id}
         await self.message_queue.put(message)
 
+    async def send_delta(self, delta: str):
+        await self.send({'type': 'chat_delta', 'delta': delta})
+
+    async def send_exec_stream(self, stream: str, text: str):
+        await self.send({'type': 'exec_stream', 'stream': stream, 'text': text})
+
+    async def start_stream(self, role: str, content: str):
+        # Opens a message on the client that subsequent deltas are appended to
+        await self.send({'type': 'chat_message', 'message': {'role': role, 'content': content}})
+
+    async def send_final(self, message: dict):
+        # When streaming, the complete message replaces the one built up from deltas
+        await self.send({**message, 'replace_last': True} if streaming_enabled else message)
+
+    async def result_message(self, title: str, output: str, files: list = (), outputs: list = ()):
+        # Long output goes to the artifact store; the message keeps a preview and references
+        content, artifacts = await artifact_store.externalize(output, f"{title.lower().replace(' ', '_')}.txt")
+        content = f"{title}:\n\n```\n{content}\n```"
+        if files:
+            content += "\n\nGenerated files: " + ", ".join(artifact['name'] for artifact in files)
+        message = {'role': 'system', 'content': content}
+        if artifacts or files:
+            message['artifacts'] = artifacts + list(files)
+        if outputs:
+            message['outputs'] = list(outputs)
+        return {'type': 'chat_message', 'message': message}
+
     def extract_code_blocks(self, content, block_type):
         import re
         pattern = rf"```{block_type}\n(.*?)```"
@@ -33,9 +68,40 @@ class ChatManager:
         return '\n'.join(block.strip() for block in blocks)
 
     @observe()
-    async def chat(self, instructions: str, history: list, conversation_id: str, user_id: str, session):
+    async def chat(self, instructions: str, history: list, conversation_id: str, user_id: str):
         print_verbose(f"Starting agent conversation for instructions: {instructions}")
-        
+
+        async with profile_turn(conversation_id):
+            context_summary, context_summary_upto = await ConversationMemory.get_context_summary(conversation_id, user_id)
+
+            # Messages of the turn are written behind in one transaction, even if the turn fails part-way
+            batch = MessageBatch(user_id, conversation_id)
+            try:
+                summary = await self.run_turn(instructions, history, conversation_id, self.quota_key or user_id, batch,
+                                              context_summary, context_summary_upto)
+            finally:
+                await asyncio.shield(batch.flush())  # written even when the turn is cancelled
+
+            if summary:
+                await ConversationMemory.update_summary(conversation_id, user_id, summary)
+                print_verbose(f"Generated and stored summary: {summary}")
+
+            # Done after the results are sent, so the next turn starts from an up-to-date rolling summary.
+            # Best effort: the turn has already succeeded, and the next one folds whatever this one did not
+            if isinstance(history, list):
+                try:
+                    # The history holds only the latest messages; the ones before it are read in chunks
+                    folded = await self.context_manager.fold_summary(
+                        history, context_summary, context_summary_upto,
+                        lambda after, limit: ConversationMemory.get_messages_after(conversation_id, user_id, after, limit))
+                    if folded:
+                        await ConversationMemory.update_context_summary(conversation_id, user_id, *folded)
+                        print_verbose(f"Folded context summary up to message {folded[1]}")
+                except Exception as e:
+                    print_verbose(f"Could not fold the context summary: {e}")
+
+    async def run_turn(self, instructions: str, history: list, conversation_id: str, quota_key: str, batch: MessageBatch,
+                       context_summary: str = None, context_summary_upto: int = 0):
         user_message = {
             'type': 'chat_message',
             'message': {
@@ -43,30 +109,50 @@ class ChatManager:
                 'content': instructions,
             }
         }
-        ConversationMemory.add_message(session, user_id, conversation_id, user_message)
+        batch.add(user_message)
 
-        # ToDo: figure out right history content - we should not use the whole history, but summarise it in some way
         if isinstance(history, list):
-            context = "\n".join([f"[{h[1]['message']['role']}]: {h[1]['message']['content']}" for h in history])
+            context = self.context_manager.build_context(history, context_summary, context_summary_upto)
         else:
             print_verbose("Warning: history is not in the expected format. Treating as empty.")
             context = ""
 
+        conversation_summary = None
         if len(history) < 1:
-            summary = self.generate_summary(instructions)
-            ConversationMemory.update_summary(session, conversation_id, user_id, summary)
-            print_verbose(f"Generated and stored summary: {summary}")
+            conversation_summary = await self.generate_summary(instructions)
         
+        request = instructions
         if context:
             instructions = f"Conversation history:\n{context}\n\nNew instructions: {instructions}"
+        prompt = instructions
 
         python_result = "No Python code was executed."
         generated_code = ""
 
-        for attempt in range(self.execution_agent.max_attempts):
+        first_attempt = 0
+        if self.speculative.enabled and await self.speculative.applicable(conversation_id):
+            winner, candidates = await self.speculative.run(prompt, conversation_id, quota_key)
+            if winner is not None:
+                await self.report_candidate(winner, request, batch)
+                return conversation_summary
+            # Every candidate failed; continue sequentially from the default-temperature candidate's error
+            baseline = candidates[0]
+            if baseline.finished:
+                prompt = self.retry_prompt(instructions, baseline.code, baseline.output, baseline.limit)
+            first_attempt = 1
+
+        for attempt in range(first_attempt, self.execution_agent.max_attempts):
             print_verbose(f"Attempt {attempt + 1}/{self.execution_agent.max_attempts}")
+
+            # Described afresh each attempt, since a failed attempt may still have defined variables
+            namespace = self.context_manager.format_namespace(await self.execution_agent.describe_namespace(conversation_id))
+            attempt_prompt = f"{namespace}\n\n{prompt}" if namespace else prompt
             
-            generated_code = self.coding_agent.generate_code(instructions)
+            if streaming_enabled:
+                await self.start_stream('assistant', "Generated Code:\n\n```python\n")
+                generated_code = await self.coding_agent.generate_code(attempt_prompt, on_token=self.send_delta)
+            else:
+                generated_code = await self.coding_agent.generate_code(attempt_prompt)
             generated_code_message = {
                 'type': 'chat_message',
                 'message': {
@@ -74,74 +160,94 @@ class ChatManager:
                     'content': f"Generated Code:\n\n```python\n{generated_code}\n```"
                 }
             }
-            ConversationMemory.add_message(session, user_id, conversation_id, generated_code_message)
+            batch.add(generated_code_message)
             
-            await self.send(generated_code_message)
+            await self.send_final(generated_code_message)
 
             shell_commands = self.extract_code_blocks(generated_code, 'shell')
             python_code = self.extract_code_blocks(generated_code, 'python')
 
             if shell_commands:
-                shell_result = await self.execution_agent.execute_shell_commands(shell_commands)
-                shell_result_message = {
-                    'type': 'chat_message',
-                    'message': {
-                        'role': 'system',
-                        'content': f"Shell Execution Result:\n\n```\n{shell_result}\n```"
-                    }
-                }
-                ConversationMemory.add_message(session, user_id, conversation_id, shell_result_message)
+                shell_result = await self.execution_agent.execute_shell_commands(shell_commands, quota_key)
+                shell_result_message = await self.result_message("Shell Execution Result", shell_result)
+                batch.add(shell_result_message)
 
             if python_code:
-                python_success, python_result = await self.execution_agent.execute_python_code(python_code)
-                python_result_message = {
-                    'type': 'chat_message',
-                    'message': {
-                        'role': 'system',
-                        'content': f"Python Execution Result:\n\n```\n{python_result}\n```"
-                    }
-                }
-                ConversationMemory.add_message(session, user_id, conversation_id, python_result_message)
+                if streaming_enabled:
+                    await self.start_stream('system', "Python Execution Result:\n\n```\n")
+                    execution = await self.execution_agent.execute_python_code(
+                        python_code, conversation_id, on_output=self.send_exec_stream, user_id=quota_key)
+                else:
+                    execution = await self.execution_agent.execute_python_code(python_code, conversation_id, user_id=quota_key)
+                python_result = execution.output
+                python_result_message = await self.result_message(
+                    "Python Execution Result", python_result, execution.artifacts, execution.outputs)
+                batch.add(python_result_message)
                 
-                await self.send(python_result_message)
-
-                if python_success:
-                    summary = await self.generate_execution_summary(instructions, python_result)
-                    summary_message = {
-                        'type': 'chat_message',
-                        'message': {
-                            'role': 'system',
-                            'content': f"Execution Summary:\n\n{summary}"
-                        }
-                    }
-                    ConversationMemory.add_message(session, user_id, conversation_id, summary_message)
-                    await self.send(summary_message)
+                await self.send_final(python_result_message)
+
+                if execution.success:
+                    await self.send_execution_summary(request, python_result, batch)
                 else:
                     if attempt < self.execution_agent.max_attempts - 1:
                         print_verbose(f"Execution failed. Retrying with updated instructions.")
-                        instructions = f"{instructions}\n\nExecution failed. Error: {python_result}\nPlease correct the code and try again."
+                        prompt = self.retry_prompt(instructions, generated_code, python_result, execution.limit)
                         continue
                     else:
                         print_verbose(f"Execution failed. Reached final iteration.")
 
             break
 
-        return
+        return conversation_summary
 
-    @observe(as_type="generation")
-    def generate_summary(self, instructions):
-        llm = ChatGroq(
-            model='llama-3.1-70b-versatile',
-            temperature=0,
-            max_tokens=None,
-            timeout=None,
-            max_retries=2
+    def retry_prompt(self, instructions: str, generated_code: str, python_result: str, limit: str = None):
+        # Only the latest attempt is fed back, so retries do not grow the prompt; an attempt stopped
+        # by a sandbox limit also gets the change that limit calls for
+        hint = f"\n{LIMIT_HINTS[limit]}" if limit else ""
+        return (
+            f"{instructions}\n\nPrevious attempt:\n{truncate_middle(generated_code, context_max_message_chars)}"
+            f"\n\n{truncate_middle(python_result, context_max_message_chars)}{hint}\nPlease correct the code and try again."
         )
+
+    async def send_execution_summary(self, request: str, python_result: str, batch: MessageBatch):
+        summary = await self.generate_execution_summary(request, truncate_middle(python_result, context_max_message_chars))
+        summary_message = {
+            'type': 'chat_message',
+            'message': {
+                'role': 'system',
+                'content': f"Execution Summary:\n\n{summary}"
+            }
+        }
+        batch.add(summary_message)
+        await self.send(summary_message)
+
+    async def report_candidate(self, candidate, request: str, batch: MessageBatch):
+        # A speculative winner arrives complete, so its messages are sent whole rather than streamed
+        generated_code_message = {
+            'type': 'chat_message',
+            'message': {
+                'role': 'assistant',
+                'content': f"Generated Code:\n\n```python\n{candidate.code}\n```"
+            }
+        }
+        batch.add(generated_code_message)
+        await self.send(generated_code_message)
+        if candidate.shell_result:
+            batch.add(await self.result_message("Shell Execution Result", candidate.shell_result))
+        if candidate.ran_python:
+            python_result_message = await self.result_message(
+                "Python Execution Result", candidate.output, candidate.artifacts, candidate.outputs)
+            batch.add(python_result_message)
+            await self.send(python_result_message)
+            await self.send_execution_summary(request, candidate.output, batch)
+
+    @observe(as_type="generation")
+    async def generate_summary(self, instructions):
         prompt = ChatPromptTemplate.from_messages([
             ("system", "Create a concise high-level summary what the following conversation is about. Use 10 words max. "),
             ("human", "{instructions}")
         ])
-        response = llm.invoke(prompt.format_messages(instructions=instructions))
+        response = await self.llm.ainvoke(prompt.format_messages(instructions=instructions))
         return response.content
 
     @observe(as_type="generation")
@@ -150,5 +256,5 @@ class ChatManager:
             ("system", "You are an AI assistant that summarizes code execution results. Provide a concise summary of the given instructions and execution results."),
             ("human", "Instructions: {instructions}\n\nExecution Result: {execution_result}\n\nPlease provide a brief summary of what was requested and the outcome of the execution.")
         ])
-        response = self.llm.invoke(prompt.format_messages(instructions=instructions, execution_result=execution_result))
+        response = await self.llm.ainvoke(prompt.format_messages(instructions=instructions, execution_result=execution_result))
         return response.content
@@ -8,6 +8,124 @@ load_dotenv()
 global verbose
 verbose = os.environ.get('VERBOSE', 'false').lower() == 'true'
 
+# Warm kernel pool used by the ExecutionAgent
+use_kernel_pool = os.environ.get('KERNEL_POOL_ENABLED', 'true').lower() == 'true'
+kernel_max_kernels = int(os.environ.get('KERNEL_MAX_KERNELS', '8'))
+kernel_idle_timeout = float(os.environ.get('KERNEL_IDLE_TIMEOUT', '900'))
+kernel_warm_spares = int(os.environ.get('KERNEL_WARM_SPARES', '1'))
+kernel_preimports = os.environ.get('KERNEL_PREIMPORTS', 'numpy,pandas,matplotlib,lifelines')
+
+# Upper bound on threads used for sync work that cannot run on the event loop
+blocking_executor_workers = int(os.environ.get('BLOCKING_EXECUTOR_WORKERS', '8'))
+
+# Stream LLM tokens and execution output to the client as they are produced
+streaming_enabled = os.environ.get('STREAMING_ENABLED', 'true').lower() == 'true'
+
+# Messages per history page sent to the client, and recent messages loaded as chat context
+history_page_size = int(os.environ.get('HISTORY_PAGE_SIZE', '50'))
+history_context_messages = int(os.environ.get('HISTORY_CONTEXT_MESSAGES', '50'))
+
+# Coding prompt context: token budget, recent turns kept verbatim, per-message truncation, and
+# messages merged into the rolling summary per LLM call
+context_token_budget = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '6000'))
+context_recent_turns = int(os.environ.get('CONTEXT_RECENT_TURNS', '3'))
+context_max_message_chars = int(os.environ.get('CONTEXT_MAX_MESSAGE_CHARS', '2000'))
+context_fold_messages = int(os.environ.get('CONTEXT_FOLD_MESSAGES', '20'))
+
+# Persistent cache for LLM responses and stateless execution results
+cache_enabled = os.environ.get('CACHE_ENABLED', 'true').lower() == 'true'
+cache_path = os.environ.get('CACHE_PATH', 'cache.db')
+cache_max_entries = int(os.environ.get('CACHE_MAX_ENTRIES', '10000'))
+cache_max_bytes = int(os.environ.get('CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+cache_ttl = float(os.environ.get('CACHE_TTL', str(7 * 24 * 3600)))
+
+# Execution venv: where generated code runs (never the server's own venv), packages baked into the base snapshot,
+# where snapshots live, and the local wheel cache
+exec_venv_path = os.environ.get('EXEC_VENV_PATH', 'exec_venv')
+base_requirements = os.environ.get('BASE_REQUIREMENTS', '').split()
+venv_snapshot_dir = os.environ.get('VENV_SNAPSHOT_DIR', 'venv_snapshots')
+pip_wheelhouse = os.environ.get('PIP_WHEELHOUSE', 'wheelhouse')
+
+# Broker shared by all workers (memory:// or redis://...); distributed mode runs chat turns as broker jobs
+broker_url = os.environ.get('BROKER_URL', 'memory://')
+chat_jobs_distributed = os.environ.get('CHAT_JOBS_DISTRIBUTED', 'false').lower() == 'true'
+chat_job_workers = int(os.environ.get('CHAT_JOB_WORKERS', '4'))
+
+# Execution scheduler: global concurrent runs and per-user share of them (per connection while every socket is
+# served as the same placeholder user); a turn's speculative candidates share its owner's quota
+execution_max_concurrent = int(os.environ.get('EXECUTION_MAX_CONCURRENT', str(kernel_max_kernels)))
+execution_user_quota = int(os.environ.get('EXECUTION_USER_QUOTA', '2'))
+
+# LLM clients: provider (groq or fake) and model per role, shared connection pool, concurrency and retries per provider
+llm_provider = os.environ.get('LLM_PROVIDER', 'groq')
+llm_model = os.environ.get('LLM_MODEL', 'llama-3.1-70b-versatile')
+llm_roles = {
+    role: {
+        'provider': os.environ.get(f'LLM_{role.upper()}_PROVIDER', llm_provider),
+        'model': os.environ.get(f'LLM_{role.upper()}_MODEL', llm_model),
+    }
+    for role in ('coder', 'summarizer')
+}
+llm_max_connections = int(os.environ.get('LLM_MAX_CONNECTIONS', '20'))
+llm_max_concurrent = int(os.environ.get('LLM_MAX_CONCURRENT', '8'))
+llm_max_retries = int(os.environ.get('LLM_MAX_RETRIES', '4'))
+llm_fake_latency = float(os.environ.get('LLM_FAKE_LATENCY', '0.5'))
+
+# Per-turn profiling: write folded-stack flame data for turns slower than the threshold
+profiling_enabled = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+profile_slow_turn_seconds = float(os.environ.get('PROFILE_SLOW_TURN_SECONDS', '10'))
+profile_dir = os.environ.get('PROFILE_DIR', 'profiles')
+
+# Artifact store: outputs longer than the inline limit and generated files are kept compressed on disk;
+# artifacts unused for the TTL are removed, then the least recently used ones past the size cap (0 disables either)
+artifact_dir = os.environ.get('ARTIFACT_DIR', 'artifacts')
+artifact_inline_limit = int(os.environ.get('ARTIFACT_INLINE_LIMIT', '8000'))
+artifact_max_file_bytes = int(os.environ.get('ARTIFACT_MAX_FILE_BYTES', str(50 * 1024 * 1024)))
+artifact_ttl = float(os.environ.get('ARTIFACT_TTL', str(30 * 24 * 3600)))
+artifact_max_bytes = int(os.environ.get('ARTIFACT_MAX_BYTES', str(10 * 1024 * 1024 * 1024)))
+
+# Kernel namespace checkpoints: when to save (off, evict, or cell to also save after each successful cell) and where;
+# and how many live variables are described to the CodingAgent
+kernel_checkpoint_mode = os.environ.get('KERNEL_CHECKPOINT_MODE', 'evict')
+kernel_checkpoint_dir = os.environ.get('KERNEL_CHECKPOINT_DIR', 'kernel_checkpoints')
+kernel_namespace_summary_limit = int(os.environ.get('KERNEL_NAMESPACE_SUMMARY_LIMIT', '40'))
+
+# Speculative generation: candidate programs generated and run in parallel per turn (1 disables), and their temperatures
+speculative_candidates = int(os.environ.get('SPECULATIVE_CANDIDATES', '1'))
+speculative_temperatures = [float(t) for t in os.environ.get('SPECULATIVE_TEMPERATURES', '0,0.5,0.9').split(',')]
+
+# Sandbox limits per run of generated code (0 disables a limit): wall-clock and CPU seconds,
+# address space, and output bytes after which the run is stopped
+sandbox_timeout = float(os.environ.get('SANDBOX_TIMEOUT', '300'))
+sandbox_cpu_seconds = int(os.environ.get('SANDBOX_CPU_SECONDS', '240'))
+sandbox_memory_mb = int(os.environ.get('SANDBOX_MEMORY_MB', '8192'))
+sandbox_max_output_bytes = int(os.environ.get('SANDBOX_MAX_OUTPUT_BYTES', str(2 * 1024 * 1024)))
+
+# Async database engine: connections kept open and allowed on top under load, seconds to wait for a free one,
+# and seconds an SQLite writer waits for the write lock
+db_pool_size = int(os.environ.get('DB_POOL_SIZE', '10'))
+db_max_overflow = int(os.environ.get('DB_MAX_OVERFLOW', '10'))
+db_pool_timeout = float(os.environ.get('DB_POOL_TIMEOUT', '30'))
+db_busy_timeout = float(os.environ.get('DB_BUSY_TIMEOUT', '15'))
+
+# Conversation sidebar: conversations per page, and the per-user cache of first pages (users kept, seconds valid)
+conversation_page_size = int(os.environ.get('CONVERSATION_PAGE_SIZE', '50'))
+conversation_cache_users = int(os.environ.get('CONVERSATION_CACHE_USERS', '1000'))
+conversation_cache_ttl = float(os.environ.get('CONVERSATION_CACHE_TTL', '60'))
+
+# Websocket send path: messages queued per socket, how long a producer waits on a full queue before the client
+# is disconnected as stalled, how long the sender lingers to batch messages into one frame, and deflate compression
+ws_queue_max_messages = int(os.environ.get('WS_QUEUE_MAX_MESSAGES', '1000'))
+ws_send_timeout = float(os.environ.get('WS_SEND_TIMEOUT', '30'))
+ws_batch_delay = float(os.environ.get('WS_BATCH_DELAY', '0.02'))
+ws_batch_max_messages = int(os.environ.get('WS_BATCH_MAX_MESSAGES', '200'))
+ws_per_message_deflate = os.environ.get('WS_PER_MESSAGE_DEFLATE', 'true').lower() == 'true'
+
+# Rich outputs of kernel cells: rows per table preview and per Arrow page, and the size up to which a Plotly
+# figure is sent inside the message rather than stored as an artifact
+rich_output_table_rows = int(os.environ.get('RICH_OUTPUT_TABLE_ROWS', '50'))
+rich_output_inline_bytes = int(os.environ.get('RICH_OUTPUT_INLINE_BYTES', str(256 * 1024)))
+
 def setup_app(app):
     app.add_middleware(
         CORSMiddleware,
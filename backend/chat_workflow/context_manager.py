@@ -0,0 +1,110 @@
+from langchain.prompts import ChatPromptTemplate
+from utils.helpers import print_verbose, estimate_tokens, truncate_middle
+from chat_workflow.config import (context_token_budget, context_recent_turns, context_max_message_chars, context_fold_messages,
+                                  kernel_namespace_summary_limit)
+
+class ContextManager:
+    """Builds the coding prompt context from a rolling summary plus the most recent turns."""
+
+    def __init__(self, llm, token_budget: int = context_token_budget, recent_turns: int = context_recent_turns,
+                 max_message_chars: int = context_max_message_chars, fold_messages: int = context_fold_messages):
+        self.llm = llm
+        self.token_budget = token_budget
+        self.recent_turns = recent_turns
+        self.max_message_chars = max_message_chars
+        self.fold_messages = fold_messages
+
+    def format_message(self, message_data: dict):
+        message = message_data['message']
+        return f"[{message['role']}]: {truncate_middle(message['content'], self.max_message_chars)}"
+
+    def format_namespace(self, namespace: dict, limit: int = kernel_namespace_summary_limit):
+        # Tells the CodingAgent what the persistent session already holds, so it writes only the next step
+        if not namespace or not (namespace['variables'] or namespace['modules']):
+            return ""
+        lines = ["Live variables in the Python session (still defined; reuse them instead of reloading or recomputing):"]
+        for variable in namespace['variables'][:limit]:
+            details = [variable['type'] + (f" = {variable['value']}" if 'value' in variable else "")]
+            if 'shape' in variable:
+                details.append(f"shape {tuple(variable['shape'])}")
+            elif 'len' in variable:
+                details.append(f"len {variable['len']}")
+            if 'dtype' in variable:
+                details.append(f"dtype {variable['dtype']}")
+            if 'columns' in variable:
+                details.append(f"columns: {', '.join(variable['columns'])}")
+            lines.append(f"- {variable['name']}: {', '.join(details)}")
+        if len(namespace['variables']) > limit:
+            lines.append(f"- ... {len(namespace['variables']) - limit} more")
+        if namespace['modules']:
+            lines.append("Imported modules: " + ", ".join(
+                module['name'] if module['name'] == module['module'] else f"{module['name']} ({module['module']})"
+                for module in namespace['modules']))
+        return "\n".join(lines)
+
+    def split_recent(self, history: list):
+        # A turn starts at a human message; everything before the last K turns is "older"
+        turn_starts = [i for i, (_, message_data) in enumerate(history) if message_data['message']['role'] == 'human']
+        if len(turn_starts) <= self.recent_turns:
+            return [], history
+        cut = turn_starts[-self.recent_turns] if self.recent_turns > 0 else len(history)
+        return history[:cut], history[cut:]
+
+    def build_context(self, history: list, summary: str = None, summary_upto: int = 0):
+        uncovered = [(number, message_data) for number, message_data in history if number > summary_upto]
+        lines = [self.format_message(message_data) for _, message_data in uncovered]
+
+        budget = self.token_budget - (estimate_tokens(summary) if summary else 0)
+        used = sum(estimate_tokens(line) for line in lines)
+        dropped = 0
+        while lines and used > budget:
+            used -= estimate_tokens(lines.pop(0))
+            dropped += 1
+
+        parts = []
+        if summary:
+            parts.append(f"Summary of earlier conversation:\n{summary}")
+        if dropped:
+            parts.append(f"[{dropped} older messages omitted]")
+        if lines:
+            parts.append("Recent messages:\n" + "\n".join(lines))
+        context = "\n\n".join(parts)
+        print_verbose(f"ContextManager: {len(lines)} messages kept, {dropped} dropped, ~{estimate_tokens(context)} tokens")
+        return context
+
+    async def fold_summary(self, history: list, summary: str = None, summary_upto: int = 0, load_messages=None):
+        """Folds messages that fell out of the verbatim window into the rolling summary.
+
+        `history` may hold only the latest messages, so the ones from summary_upto on are read with
+        load_messages(after, limit), oldest first, and merged a chunk at a time; without it only
+        `history` is folded. Returns (summary, upto) when the summary changed, otherwise None.
+        """
+        uncovered = [(number, message_data) for number, message_data in history if number > summary_upto]
+        older, recent = self.split_recent(uncovered)
+        if not older:
+            return None
+
+        # Messages numbered from the first verbatim one on stay out of the summary
+        end = recent[0][0] if recent else older[-1][0] + 1
+        upto = summary_upto
+        while True:
+            if load_messages is not None:
+                chunk = await load_messages(upto, self.fold_messages)
+            else:
+                chunk = [(number, message_data) for number, message_data in older if number > upto][:self.fold_messages]
+            chunk = [(number, message_data) for number, message_data in chunk if number < end]
+            if not chunk:
+                break
+            summary = await self.merge_summary(summary, chunk)
+            upto = chunk[-1][0]
+        return (summary, upto) if upto > summary_upto else None
+
+    async def merge_summary(self, summary: str, messages: list):
+        new_messages = "\n".join(self.format_message(message_data) for _, message_data in messages)
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", "You maintain a running summary of a data analysis conversation between a user and a coding assistant. Merge the new messages into the existing summary. Keep file names, datasets, variable names, results and unresolved errors. Use at most 200 words."),
+            ("human", "Existing summary:\n{summary}\n\nNew messages:\n{messages}")
+        ])
+        messages = prompt.format_messages(summary=summary or "(none)", messages=truncate_middle(new_messages, self.token_budget * 4))
+        response = await self.llm.ainvoke(messages)
+        return response.content
@@ -0,0 +1,170 @@
+import asyncio
+from typing import Dict, List, Optional, Set, Tuple
+from chat_workflow.chat_manager import ChatManager
+from chat_workflow.config import history_context_messages, chat_job_workers, chat_jobs_distributed
+from database.ConversationMemory import ConversationMemory
+from utils.broker import broker
+from utils.connection_manager import connection_manager
+from utils.helpers import print_verbose
+from utils.metrics import metrics, span
+
+CHAT_JOB_QUEUE = "chat_jobs"
+CANCEL_CHANNEL = "chat_cancel"
+# Seconds a conversation stays with a worker that stopped renewing its claim (e.g. because it died)
+OWNER_TTL = 30
+
+# Chat turns running or waiting on this worker, oldest first: conversation_id -> [(client_id, task)]
+running_jobs: Dict[str, List[Tuple[str, asyncio.Task]]] = {}
+# Conversations whose turns this worker runs, since their kernel namespaces and checkpoints are here
+owned_conversations: Set[str] = set()
+chat_turns = metrics.counter("chat_turns_total", "Finished chat turns by outcome")
+metrics.gauge("chat_turns_running", "Chat turns running or waiting on this worker", lambda: sum(map(len, running_jobs.values())))
+
+class ClientChannel:
+    """Queue-like sink that routes a job's messages to whichever worker holds the client's socket."""
+
+    def __init__(self, client_id: str):
+        self.client_id = client_id
+
+    async def put(self, message: dict):
+        await connection_manager.send_message_to_client(message, self.client_id)
+
+async def run_chat_job(job: dict, message_queue):
+    with span("history_load"):
+        history, _ = await ConversationMemory.get_history_page(
+            job['conversation_id'], job['user_id'], limit=history_context_messages)
+    chat_manager = ChatManager(message_queue, job['conversation_id'], job.get('quota_key'))
+    await chat_manager.chat(job['instructions'], history, job['conversation_id'], job['user_id'])
+
+async def execute_chat_job(job: dict, message_queue):
+    """Runs one turn as a cancellable task and reports how it ended.
+
+    Turns of the same conversation run one after another; different conversations run concurrently.
+    """
+    conversation_id = job['conversation_id']
+    tasks = running_jobs.setdefault(conversation_id, [])
+    previous = tasks[-1][1] if tasks else None
+
+    async def run_after_previous():
+        if previous is not None:
+            await asyncio.wait([previous])  # unlike gather, cancelling us leaves the previous turn alone
+        await run_chat_job(job, message_queue)
+
+    task = asyncio.create_task(run_after_previous())
+    entry = (job['client_id'], task)
+    tasks.append(entry)
+    status = 'turn_complete'
+    try:
+        await task
+    except asyncio.CancelledError:
+        task.cancel()
+        status = 'turn_cancelled'
+        if asyncio.current_task().cancelling():
+            raise
+    except Exception as e:
+        status = 'turn_failed'
+        print(f"Error in chat job for client {job['client_id']}: {e}")
+        await message_queue.put({
+            'type': 'chat_message',
+            'conversation_id': conversation_id,
+            'message': {'role': 'system', 'content': f"Request failed: {e}"}
+        })
+    finally:
+        tasks.remove(entry)
+        if not tasks and running_jobs.get(conversation_id) is tasks:
+            del running_jobs[conversation_id]
+        chat_turns.inc(status=status)
+    await message_queue.put({
+        'type': 'meta',
+        'action': 'turn_complete' if status == 'turn_failed' else status,
+        'data': {'conversation_id': conversation_id}
+    })
+
+def cancel_local(client_id: str, conversation_id: str = None) -> int:
+    cancelled = 0
+    for job_conversation_id, tasks in list(running_jobs.items()):
+        if conversation_id in (None, job_conversation_id):
+            for job_client_id, task in tasks:
+                if job_client_id == client_id:
+                    task.cancel()
+                    cancelled += 1
+    return cancelled
+
+async def cancel_chat(client_id: str, conversation_id: str = None):
+    cancelled = cancel_local(client_id, conversation_id)
+    if chat_jobs_distributed:
+        # The turn may be running on another worker
+        await broker.publish(CANCEL_CHANNEL, {'client_id': client_id, 'conversation_id': conversation_id})
+    print_verbose(f"Cancel requested for client {client_id}: {cancelled} local turn(s) cancelled")
+
+def worker_queue(worker_id: str) -> str:
+    return f"{CHAT_JOB_QUEUE}:{worker_id}"
+
+def owner_key(conversation_id: str) -> str:
+    return f"chat_owner:{conversation_id}"
+
+async def submit_chat_job(client_id: str, user_id: str, instructions: str, conversation_id: str, quota_key: str = None):
+    # A conversation's turns go to the worker that owns it; a conversation without a live owner to any worker
+    owner = await broker.get(owner_key(conversation_id))
+    await broker.enqueue(worker_queue(owner) if owner else CHAT_JOB_QUEUE, {
+        'client_id': client_id,
+        'user_id': user_id,
+        'quota_key': quota_key,
+        'instructions': instructions,
+        'conversation_id': conversation_id
+    })
+
+async def claim_conversation(conversation_id: str, worker_id: Optional[str] = None) -> str:
+    """Makes the worker the conversation's owner unless another live worker is; returns the owner."""
+    worker_id = worker_id or connection_manager.worker_id
+    key = owner_key(conversation_id)
+    while True:
+        if await broker.set_if_absent(key, worker_id, OWNER_TTL):
+            owned_conversations.add(conversation_id)
+            return worker_id
+        owner = await broker.get(key)
+        if owner is not None:
+            return owner
+        # The claim expired between the two calls; try again
+
+async def renew_ownership():
+    # Claims lapse OWNER_TTL after a worker stops renewing them, and the conversation moves on
+    while True:
+        await asyncio.sleep(OWNER_TTL / 3)
+        for conversation_id in list(owned_conversations):
+            key = owner_key(conversation_id)
+            if await broker.get(key) != connection_manager.worker_id or not await broker.expire(key, OWNER_TTL):
+                owned_conversations.discard(conversation_id)
+
+async def job_worker(worker_number: int):
+    worker_id = connection_manager.worker_id
+    while True:
+        # This worker's own queue first: those turns can only run here
+        job = await broker.dequeue([worker_queue(worker_id), CHAT_JOB_QUEUE])
+        if job is None:
+            continue
+        owner = await claim_conversation(job['conversation_id'], worker_id)
+        if owner != worker_id:
+            # Claimed by another worker since it was submitted; the turn must run next to that namespace
+            await broker.enqueue(worker_queue(owner), job)
+            continue
+        print_verbose(f"Job worker {worker_number}: Running chat job for client {job['client_id']}")
+        await execute_chat_job(job, ClientChannel(job['client_id']))
+
+async def cancel_listener():
+    async for request in broker.subscribe(CANCEL_CHANNEL):
+        cancel_local(request['client_id'], request.get('conversation_id'))
+
+_workers: List[asyncio.Task] = []
+
+def start_job_workers(count: int = chat_job_workers):
+    _workers.append(asyncio.create_task(cancel_listener()))
+    _workers.append(asyncio.create_task(renew_ownership()))
+    for worker_number in range(count):
+        _workers.append(asyncio.create_task(job_worker(worker_number)))
+
+async def stop_job_workers():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
@@ -0,0 +1,122 @@
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+from utils.helpers import print_verbose
+from utils.metrics import metrics, span
+from chat_workflow.config import speculative_candidates, speculative_temperatures
+
+speculative_turns = metrics.counter("speculative_turns_total", "Speculative rounds by outcome")
+candidate_results = metrics.counter("speculative_candidates_total", "Speculative candidates by result")
+attempts_saved = metrics.counter("speculative_attempts_saved_total",
+                                 "Sequential retries avoided: the default candidate failed and another one won")
+extra_compute = metrics.counter("speculative_extra_compute_seconds_total",
+                                "Generation and execution time spent on candidates that did not win")
+
+
+@dataclass
+class Candidate:
+    index: int
+    temperature: float
+    sandbox_id: str
+    code: str = ""
+    shell_result: Optional[str] = None
+    ran_python: bool = False
+    success: bool = False
+    output: str = "No Python code was executed."
+    artifacts: list = field(default_factory=list)
+    limit: Optional[str] = None
+    outputs: list = field(default_factory=list)
+    finished: bool = False
+    elapsed: float = 0.0
+
+
+class SpeculativeExecutor:
+    """Generates candidate programs concurrently and runs each in its own sandbox; the first success wins.
+
+    Candidate 0 uses the first configured temperature and is what the sequential loop would have
+    tried first. The winner's sandbox becomes the conversation's state and the rest are cancelled.
+    """
+
+    def __init__(self, chat_manager, candidates: int = speculative_candidates,
+                 temperatures: List[float] = speculative_temperatures):
+        self.chat_manager = chat_manager
+        self.candidates = candidates
+        self.temperatures = temperatures
+
+    @property
+    def enabled(self) -> bool:
+        return self.candidates > 1
+
+    async def applicable(self, conversation_id: str) -> bool:
+        # Sandboxes start empty, so a conversation with live variables is left to the sequential loop
+        namespace = await self.chat_manager.execution_agent.describe_namespace(conversation_id)
+        return not (namespace and namespace['variables'])
+
+    async def run(self, prompt: str, conversation_id: str, user_id: str) -> Tuple[Optional[Candidate], List[Candidate]]:
+        candidates = [
+            Candidate(i, self.temperatures[i % len(self.temperatures)], f"{conversation_id}-candidate-{uuid.uuid4().hex[:8]}")
+            for i in range(self.candidates)
+        ]
+        tasks = {asyncio.create_task(self._attempt(candidate, prompt, user_id)): candidate for candidate in candidates}
+        winner = None
+        pending = set(tasks)
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        print_verbose(f"Speculation: Candidate {tasks[task].index} raised {task.exception()!r}")
+                    elif tasks[task].success and winner is None:
+                        winner = tasks[task]
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            execution_agent = self.chat_manager.execution_agent
+            await asyncio.gather(*(execution_agent.discard_sandbox(c.sandbox_id) for c in candidates if c is not winner))
+
+        if winner is not None and winner.ran_python:
+            # A winner that answered without Python code never had a sandbox to adopt
+            await self.chat_manager.execution_agent.adopt_sandbox(winner.sandbox_id, conversation_id)
+        self._record(winner, candidates)
+        return winner, candidates
+
+    async def _attempt(self, candidate: Candidate, prompt: str, user_id: str):
+        chat_manager = self.chat_manager
+        start = time.monotonic()
+        try:
+            with span("speculative_candidate"):
+                candidate.code = await chat_manager.coding_agent.generate_code(prompt, temperature=candidate.temperature)
+                shell_commands = chat_manager.extract_code_blocks(candidate.code, 'shell')
+                python_code = chat_manager.extract_code_blocks(candidate.code, 'python')
+                if shell_commands:
+                    candidate.shell_result = await chat_manager.execution_agent.execute_shell_commands(shell_commands, user_id)
+                if python_code:
+                    candidate.ran_python = True
+                    # Extra candidates queue behind other work of the same user
+                    result = await chat_manager.execution_agent.execute_in_sandbox(
+                        python_code, candidate.sandbox_id, user_id, priority=min(candidate.index, 1))
+                    candidate.success, candidate.output, candidate.artifacts, candidate.limit, candidate.outputs = (
+                        result.success, result.output, result.artifacts, result.limit, result.outputs)
+                else:
+                    candidate.success = True  # as in the sequential loop, an answer without Python code ends the turn
+                candidate.finished = True
+        finally:
+            candidate.elapsed = time.monotonic() - start
+
+    def _record(self, winner: Optional[Candidate], candidates: List[Candidate]):
+        for candidate in candidates:
+            if candidate is winner:
+                candidate_results.inc(result="won")
+                continue
+            candidate_results.inc(result="failed" if candidate.finished else "cancelled")
+            extra_compute.inc(candidate.elapsed)
+        speculative_turns.inc(outcome="won" if winner else "all_failed")
+        baseline = candidates[0]
+        if winner is not None and winner is not baseline and baseline.finished and not baseline.success:
+            attempts_saved.inc()
+        print_verbose(f"Speculation: {'candidate ' + str(winner.index) if winner else 'no candidate'} succeeded; "
+                      + ", ".join(f"#{c.index} t={c.temperature} {'ok' if c.success else 'failed' if c.finished else 'cancelled'}"
+                                  f" {c.elapsed:.2f}s" for c in candidates))
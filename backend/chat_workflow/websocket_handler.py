@@ -1,21 +1,22 @@
 import asyncio
 import uuid
-from fastapi import WebSocket, WebSocketDisconnect, Depends
-from sqlmodel import Session
-from database.ConversationMemory import get_session
-from chat_workflow.chat_manager import ChatManager
+from fastapi import WebSocket, WebSocketDisconnect
 from utils.connection_manager import WebSocketConnectionManager, connection_manager
-from database.ConversationMemory import ConversationMemory
+from database.ConversationMemory import ConversationMemory, conversation_item
+from chat_workflow.config import history_page_size, chat_jobs_distributed
+from chat_workflow.jobs import execute_chat_job, submit_chat_job, cancel_chat
 
-async def websocket_endpoint(websocket: WebSocket, session: Session = Depends(get_session)):
+async def websocket_endpoint(websocket: WebSocket):
     client_id = str(uuid.uuid4())
-    await connection_manager.connect(websocket, client_id)
+    # Clients may opt into binary msgpack frames with ?encoding=msgpack
+    message_queue = await connection_manager.connect(websocket, client_id, websocket.query_params.get('encoding', 'json'))
     
     user_id = "test_user"
+    # Every socket is served as the same placeholder user, so until real users exist execution quotas
+    # are kept per connection; keyed on the user, all clients together would share one user's quota
+    quota_key = client_id
 
-
-    message_queue = asyncio.Queue()
-    asyncio.create_task(process_queue(message_queue, websocket))    
+    chat_tasks = set()
                     
     try:
         while True:
@@ -25,25 +26,51 @@ async def websocket_endpoint(websocket: WebSocket, session: Session = Depends(ge
             if data['type'] == 'message':
                 instructions = data['message']
                 conversation_id = data['conversation_id']
-                history = ConversationMemory.get_conversation_history(session, conversation_id, user_id)
 
-                chat_manager = ChatManager(message_queue)
-                                
-                await chat_manager.chat(instructions, history, conversation_id, user_id, session)
+                if chat_jobs_distributed:
+                    # Any worker may pick the job up; its messages are routed back to this socket
+                    await submit_chat_job(client_id, user_id, instructions, conversation_id, quota_key)
+                else:
+                    # Run the turn in the background so this loop keeps serving meta actions such as cancel
+                    task = asyncio.create_task(execute_chat_job({
+                        'client_id': client_id,
+                        'instructions': instructions,
+                        'conversation_id': conversation_id,
+                        'user_id': user_id,
+                        'quota_key': quota_key
+                    }, message_queue))
+                    chat_tasks.add(task)
+                    task.add_done_callback(chat_tasks.discard)
                 
             elif data['type'] == 'meta':
-                if data['action'] == 'get_conversations':
-                    print("Fetching conversations")
-                    conversations = ConversationMemory.get_all_conversations(session, user_id)
-                    if not conversations:
+                if data['action'] == 'cancel':
+                    await cancel_chat(client_id, data.get('conversation_id'))
+
+                elif data['action'] == 'get_conversations':
+                    # One page, newest first; `cursor` continues a listing and `search` filters by summary
+                    cursor, search = data.get('cursor'), (data.get('search') or '').strip()
+                    try:
+                        conversations, next_cursor = await ConversationMemory.list_conversations(user_id, cursor, search)
+                    except ValueError as e:
+                        # A mangled cursor starts the listing over rather than closing the socket
+                        print(f"Error: {e}; sending the first page instead")
+                        cursor = None
+                        conversations, next_cursor = await ConversationMemory.list_conversations(user_id, cursor, search)
+                    if not conversations and not cursor and not search:
                         new_conversation_id = str(uuid.uuid4())
-                        ConversationMemory.create_new_conversation(session, user_id, new_conversation_id)
-                        conversations = ConversationMemory.get_all_conversations(session, user_id)
+                        await ConversationMemory.create_new_conversation(user_id, new_conversation_id)
+                        conversations, next_cursor = await ConversationMemory.list_conversations(user_id)
                     print(f"Found {len(conversations)} conversations")
                     await message_queue.put({
                         'type': 'meta',
                         'action': 'conversations',
-                        'data': conversations
+                        'data': {
+                            'conversations': conversations,
+                            'cursor': next_cursor,
+                            'has_more': next_cursor is not None,
+                            'search': search,
+                            'append': cursor is not None
+                        }
                     })
 
                 elif data['action'] == 'load_conversation':
@@ -52,11 +79,11 @@ async def websocket_endpoint(websocket: WebSocket, session: Session = Depends(ge
                         print("Received data structure:", data)
                         return
                     conversation_id = data['conversation_id']
-                    history = ConversationMemory.get_conversation_history(session, conversation_id, user_id)
-                    summary = ConversationMemory.get_summary(session, conversation_id, user_id)
+                    history, has_more = await ConversationMemory.get_history_page(conversation_id, user_id, limit=history_page_size)
+                    summary = await ConversationMemory.get_summary(conversation_id, user_id)
                     
                     print(f"Loading conversation: {conversation_id}")
-                    print(f"History length: {len(history)}")
+                    print(f"Page length: {len(history)}, more available: {has_more}")
                     
                     await message_queue.put({
                         'type': 'meta',
@@ -66,51 +93,72 @@ async def websocket_endpoint(websocket: WebSocket, session: Session = Depends(ge
                             'summary': summary
                         }
                     })
-                    
-                    for msg_number, msg_data in history:
-                        try:
-                            parsed_msg = msg_data
-                            message_content = parsed_msg['message']['content']
-
-                            await message_queue.put({
-                                'type': 'chat_message',
-                                'message': {
-                                    'role': parsed_msg['message']['role'],
-                                    'content': message_content
-                                }
-                            })
-                            print(f"  Queued message {msg_number}: Role: {parsed_msg['message']['role']}, Content: {message_content[:50]}...")
-                        except Exception as e:
-                            print(f"  Error queueing message {msg_number}: {e}")
-                            print(f"  Raw message data: {msg_data}")
-                    
+                    await message_queue.put(history_page(conversation_id, history, has_more, prepend=False))
                     await message_queue.put({
                         'type': 'meta',
                         'action': 'conversation_loaded'
                     })
+
+                elif data['action'] == 'load_more':
+                    conversation_id = data['conversation_id']
+                    try:
+                        history, has_more = await ConversationMemory.get_history_page(
+                            conversation_id, user_id, before=data.get('cursor'), limit=history_page_size)
+                        prepend = True
+                    except ValueError as e:
+                        # Likewise the history starts over from the newest page, replacing what the client shows
+                        print(f"Error: {e}; sending the newest page instead")
+                        history, has_more = await ConversationMemory.get_history_page(conversation_id, user_id, limit=history_page_size)
+                        prepend = False
+                    await message_queue.put(history_page(conversation_id, history, has_more, prepend=prepend))
                     
                 elif data['action'] == 'new_conversation':
                     new_conversation_id = str(uuid.uuid4())
-                    ConversationMemory.create_new_conversation(session, user_id, new_conversation_id)
-                    
-                    # Fetch updated conversation list
-                    conversations = ConversationMemory.get_all_conversations(session, user_id)
+                    conversation = await ConversationMemory.create_new_conversation(user_id, new_conversation_id)
                     
-                    # Send new conversation info and updated conversation list
+                    # Only the new entry is sent; the client puts it at the top of the list it holds
                     await message_queue.put({
                         'type': 'meta',
                         'action': 'new_conversation',
                         'data': {
                             'conversation_id': new_conversation_id,
-                            'conversations': conversations
+                            'conversation': conversation_item(new_conversation_id, None, conversation.updated_at)
                         }
                     })
 
     except WebSocketDisconnect:
-        await connection_manager.disconnect(websocket)
+        pass
+    finally:
+        # However the loop ended, the socket's turns, on whichever worker runs them, and its send path go with it
+        try:
+            await cancel_chat(client_id)
+        finally:
+            await connection_manager.disconnect(websocket)
 
-async def process_queue(queue: asyncio.Queue, websocket: WebSocket):
-    while True:
-        message = await queue.get()
-        await connection_manager.send_message(message, websocket)
-        queue.task_done()
+def history_page(conversation_id: str, history: list, has_more: bool, prepend: bool):
+    # One frame per page; the cursor is the oldest message number the client holds
+    messages = []
+    for msg_number, msg_data in history:
+        try:
+            message = {
+                'role': msg_data['message']['role'],
+                'content': msg_data['message']['content']
+            }
+            for key in ('artifacts', 'outputs'):
+                if msg_data['message'].get(key):
+                    message[key] = msg_data['message'][key]
+            messages.append(message)
+        except (KeyError, TypeError) as e:
+            print(f"  Error reading message {msg_number}: {e}")
+            print(f"  Raw message data: {msg_data}")
+    return {
+        'type': 'meta',
+        'action': 'history_page',
+        'data': {
+            'conversation_id': conversation_id,
+            'messages': messages,
+            'cursor': history[0][0] if history else None,
+            'has_more': has_more,
+            'prepend': prepend
+        }
+    }
@@ -1,77 +1,311 @@
+import asyncio
 import json
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, nullcontext
 from datetime import datetime
-from sqlmodel import Session, select, create_engine, SQLModel
-from sqlalchemy import and_  # Add this import
+from sqlmodel import select, SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import and_, event, insert, inspect, or_, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from .models import Message, Conversation
 from utils.helpers import print_verbose
+from utils.metrics import span
+from chat_workflow.config import (db_pool_size, db_max_overflow, db_pool_timeout, db_busy_timeout,
+                                  conversation_page_size, conversation_cache_users, conversation_cache_ttl)
 import os
 
 DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./sql_app.db")
-engine = create_engine(DATABASE_URL)
+# Async drivers for the plain URLs DATABASE_URL has always taken; URLs naming a driver are used as given
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg', 'postgres': 'postgresql+asyncpg'}
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+def async_url(url: str):
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
 
-def get_session():
-    with Session(engine) as session:
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers carry on while a turn's messages are written; NORMAL sync is safe under WAL
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+def create_engine(url: str = DATABASE_URL):
+    url = async_url(url)
+    options = dict(pool_size=db_pool_size, max_overflow=db_max_overflow, pool_timeout=db_pool_timeout)
+    if url.get_backend_name() != "sqlite":
+        return create_async_engine(url, pool_pre_ping=True, **options)
+    # SQLite has one writer at a time; the others wait up to the busy timeout instead of failing
+    sqlite_engine = create_async_engine(url, connect_args={'timeout': db_busy_timeout}, **options)
+    event.listen(sqlite_engine.sync_engine, "connect", _sqlite_pragmas)
+    return sqlite_engine
+
+engine = create_engine()
+# Each operation opens its own short-lived session, so no connection is held between queries
+async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+# INSERT ... ON CONFLICT DO NOTHING, which both supported backends spell the same way
+_insert_or_ignore = sqlite.insert if engine.url.get_backend_name() == "sqlite" else postgresql.insert
+# SQLite takes one writer at a time: queueing this process's writers here is much faster than
+# contending for the lock, where SQLite's busy handler backs off in sleeps of up to 100ms
+_sqlite_writes = asyncio.Lock() if engine.url.get_backend_name() == "sqlite" else None
+
+@asynccontextmanager
+async def write_session():
+    async with _sqlite_writes or nullcontext():
+        async with async_session() as session:
+            yield session
+
+# Columns added to existing tables after their first release: (table, column, DDL type, optional backfill)
+ADDED_COLUMNS = [
+    ('conversation', 'message_count', 'INTEGER NOT NULL DEFAULT 0',
+     "UPDATE conversation SET message_count = "
+     "(SELECT COALESCE(MAX(message_number), 0) FROM message WHERE message.conversation_id = conversation.conversation_id)"),
+    ('conversation', 'context_summary', 'TEXT', None),
+    ('conversation', 'context_summary_upto', 'INTEGER NOT NULL DEFAULT 0', None),
+]
+
+async def create_db_and_tables():
+    async with engine.begin() as connection:
+        await connection.run_sync(SQLModel.metadata.create_all)
+        await connection.run_sync(migrate_added_columns)
+
+def migrate_added_columns(connection):
+    # create_all does not alter existing tables, so add missing columns and indexes by hand
+    inspector = inspect(connection)
+    columns = {table: {column['name'] for column in inspector.get_columns(table)} for table in ('conversation', 'message')}
+    for table, column, ddl, backfill in ADDED_COLUMNS:
+        if column not in columns[table]:
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+            if backfill:
+                connection.execute(text(backfill))
+    for model in (Conversation, Message):
+        for index in model.__table__.indexes:
+            index.create(connection, checkfirst=True)
+
+async def get_session():
+    # Request-scoped session for HTTP routes; websocket handlers go through ConversationMemory instead
+    async with async_session() as session:
         yield session
 
+class ConversationListCache:
+    """First page of each user's conversation list, dropped whenever one of their conversations changes.
+
+    Entries also expire after a TTL, since other workers write to the same database.
+    """
+
+    def __init__(self, max_users: int = conversation_cache_users, ttl: float = conversation_cache_ttl):
+        self.max_users = max_users
+        self.ttl = ttl
+        self.pages: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, user_id: str):
+        entry = self.pages.get(user_id)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return None
+        self.pages.move_to_end(user_id)
+        return entry[1]
+
+    def put(self, user_id: str, page):
+        self.pages[user_id] = (time.monotonic(), page)
+        self.pages.move_to_end(user_id)
+        while len(self.pages) > self.max_users:
+            self.pages.popitem(last=False)
+
+    def invalidate(self, user_id: str):
+        self.pages.pop(user_id, None)
+
+conversation_list_cache = ConversationListCache()
+
+def conversation_item(conversation_id: str, summary: str, updated_at: datetime):
+    return {'conversation_id': conversation_id, 'summary': summary or 'No summary available', 'updated_at': updated_at.isoformat()}
+
+def _encode_cursor(item: dict):
+    return f"{item['updated_at']}|{item['conversation_id']}"
+
+def _decode_cursor(cursor: str):
+    # Cursors come back from the client, so anything that is not one of ours is a ValueError
+    try:
+        updated_at, separator, conversation_id = cursor.partition("|")
+        if not separator or not conversation_id:
+            raise ValueError
+        return datetime.fromisoformat(updated_at), conversation_id
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError(f"Invalid conversations cursor: {cursor!r}") from None
+
+class MessageBatch:
+    """Collects the messages of one chat turn so they are written in a single transaction."""
+
+    def __init__(self, user_id: str, conversation_id: str):
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        self.pending = []
+
+    def add(self, message_data: dict):
+        self.pending.append(message_data)
+
+    async def flush(self):
+        if not self.pending:
+            return []
+        pending, self.pending = self.pending, []
+        return await ConversationMemory.add_messages(self.user_id, self.conversation_id, pending)
+
 class ConversationMemory:
     @staticmethod
-    def add_message(session: Session, user_id: str, conversation_id: str, message_data: dict):
-        conversation = session.exec(select(Conversation).where(Conversation.conversation_id == conversation_id)).first()
-        if not conversation:
-            conversation = Conversation(conversation_id=conversation_id, user_id=user_id)
-            session.add(conversation)
-            session.commit()
-            session.refresh(conversation)
-        
-        # Get the current message count for this conversation
-        message_count = session.exec(select(Message.message_number).where(Message.conversation_id == conversation_id).order_by(Message.message_number.desc())).first()
-        message_number = (message_count or 0) + 1
-        
-        message = Message(
-            conversation_id=conversation_id,
-            user_id=user_id,
-            message_number=message_number,
-            message_data=json.dumps(message_data)
-        )
-        session.add(message)
-        session.commit()
-        return message_number
+    async def add_message(user_id: str, conversation_id: str, message_data: dict):
+        return (await ConversationMemory.add_messages(user_id, conversation_id, [message_data]))[0]
+
+    @staticmethod
+    async def add_messages(user_id: str, conversation_id: str, messages: list):
+        async with write_session() as session:
+            # Reserve a block of message numbers by bumping the counter; the row lock serialises concurrent writers
+            now = datetime.utcnow()
+            reserve = (
+                update(Conversation)
+                .where(Conversation.conversation_id == conversation_id)
+                .values(message_count=Conversation.message_count + len(messages), updated_at=now)
+                .returning(Conversation.message_count)
+            )
+            last_number = (await session.execute(reserve)).scalar()
+            if last_number is None:
+                # First write: concurrent first writers may all get here, so the row is created unless one of them
+                # already did (a plain INSERT fails for the others on Postgres), and the block reserved as usual
+                await session.execute(_insert_or_ignore(Conversation).values(
+                    conversation_id=conversation_id, user_id=user_id, created_at=now, updated_at=now,
+                    message_count=0, context_summary_upto=0
+                ).on_conflict_do_nothing(index_elements=[Conversation.conversation_id]))
+                last_number = (await session.execute(reserve)).scalar()
+
+            first_number = last_number - len(messages) + 1
+            # One multi-row INSERT rather than the unit of work, which is most of the CPU time of a write
+            await session.execute(insert(Message), [
+                {
+                    'conversation_id': conversation_id,
+                    'user_id': user_id,
+                    'message_number': first_number + i,
+                    'message_data': json.dumps(message_data)
+                }
+                for i, message_data in enumerate(messages)
+            ])
+            with span("db_commit"):
+                await session.commit()
+        conversation_list_cache.invalidate(user_id)  # updated_at moved the conversation to the top
+        return list(range(first_number, last_number + 1))
 
     @staticmethod
-    def get_conversation_history(session: Session, conversation_id: str, user_id: str):
-        messages = session.exec(select(Message).where(Message.conversation_id == conversation_id).order_by(Message.message_number)).all()
+    async def get_conversation_history(conversation_id: str, user_id: str):
+        async with async_session() as session:
+            messages = (await session.exec(
+                select(Message).where(Message.conversation_id == conversation_id).order_by(Message.message_number)
+            )).all()
         return [(message.message_number, json.loads(message.message_data)) for message in messages]
 
     @staticmethod
-    def update_summary(session: Session, conversation_id: str, user_id: str, summary: str):
-        conversation = session.exec(select(Conversation).where(
-            and_(Conversation.conversation_id == conversation_id, Conversation.user_id == user_id)
-        )).first()
-        if conversation:
-            conversation.summary = summary
-            conversation.updated_at = datetime.utcnow()
-            session.commit()
-        else:
+    async def get_history_page(conversation_id: str, user_id: str, before: int = None, limit: int = 50):
+        # Keyset page of the latest `limit` messages numbered below `before`, returned oldest first
+        # Plain rows rather than Message objects, which cost more to build than the query takes
+        query = select(Message.message_number, Message.message_data).where(Message.conversation_id == conversation_id)
+        if before is not None:
+            if isinstance(before, bool) or not isinstance(before, int):
+                raise ValueError(f"Invalid history cursor: {before!r}")
+            query = query.where(Message.message_number < before)
+        async with async_session() as session:
+            rows = (await session.exec(query.order_by(Message.message_number.desc()).limit(limit + 1))).all()
+        has_more = len(rows) > limit
+        page = [(message_number, json.loads(message_data)) for message_number, message_data in reversed(rows[:limit])]
+        return page, has_more
+
+    @staticmethod
+    async def get_messages_after(conversation_id: str, user_id: str, after: int = 0, limit: int = 50):
+        # The first `limit` messages numbered above `after`, oldest first
+        query = (select(Message.message_number, Message.message_data)
+                 .where(Message.conversation_id == conversation_id, Message.message_number > after)
+                 .order_by(Message.message_number).limit(limit))
+        async with async_session() as session:
+            rows = (await session.exec(query)).all()
+        return [(message_number, json.loads(message_data)) for message_number, message_data in rows]
+
+    @staticmethod
+    async def _update_conversation(conversation_id: str, user_id: str, **values):
+        # A single UPDATE, so an SQLite writer takes the write lock up front instead of upgrading a read
+        async with write_session() as session:
+            result = await session.execute(
+                update(Conversation)
+                .where(and_(Conversation.conversation_id == conversation_id, Conversation.user_id == user_id))
+                .values(**values)
+            )
+            with span("db_commit"):
+                await session.commit()
+        if result.rowcount == 0:
             print_verbose(f"Conversation not found for conversation_id: {conversation_id} and user_id: {user_id}")
+        elif 'summary' in values:
+            conversation_list_cache.invalidate(user_id)
 
     @staticmethod
-    def get_summary(session: Session, conversation_id: str, user_id: str):
-        conversation = session.exec(select(Conversation).where(
-            and_(Conversation.conversation_id == conversation_id, Conversation.user_id == user_id)
-        )).first()
-        return conversation.summary if conversation else None
+    async def update_summary(conversation_id: str, user_id: str, summary: str):
+        await ConversationMemory._update_conversation(conversation_id, user_id, summary=summary, updated_at=datetime.utcnow())
 
     @staticmethod
-    def get_all_conversations(session: Session, user_id: str):
-        conversations = session.exec(select(Conversation).where(Conversation.user_id == user_id)).all()
-        return [{'conversation_id': conv.conversation_id, 'summary': conv.summary or 'No summary available'} for conv in conversations]
+    async def get_summary(conversation_id: str, user_id: str):
+        async with async_session() as session:
+            return (await session.exec(select(Conversation.summary).where(
+                and_(Conversation.conversation_id == conversation_id, Conversation.user_id == user_id)
+            ))).first()
 
     @staticmethod
-    def create_new_conversation(session: Session, user_id: str, conversation_id: str):
+    async def get_context_summary(conversation_id: str, user_id: str):
+        async with async_session() as session:
+            row = (await session.exec(select(Conversation.context_summary, Conversation.context_summary_upto).where(
+                and_(Conversation.conversation_id == conversation_id, Conversation.user_id == user_id)
+            ))).first()
+        if not row:
+            return None, 0
+        return row[0], row[1]
+
+    @staticmethod
+    async def update_context_summary(conversation_id: str, user_id: str, summary: str, upto: int):
+        await ConversationMemory._update_conversation(conversation_id, user_id, context_summary=summary, context_summary_upto=upto)
+
+    @staticmethod
+    async def list_conversations(user_id: str, cursor: str = None, search: str = None, limit: int = conversation_page_size):
+        """A page of the user's conversations, most recently updated first, and the cursor of the next page.
+
+        Keyset-paginated over (updated_at, conversation_id), which the (user_id, updated_at) index serves.
+        The unfiltered first page is cached per user. Raises ValueError for a cursor this method did not return.
+        """
+        cacheable = cursor is None and not search and limit == conversation_page_size
+        if cacheable:
+            page = conversation_list_cache.get(user_id)
+            if page is not None:
+                return page
+
+        query = select(Conversation.conversation_id, Conversation.summary, Conversation.updated_at).where(Conversation.user_id == user_id)
+        if cursor:
+            updated_at, conversation_id = _decode_cursor(cursor)
+            query = query.where(or_(
+                Conversation.updated_at < updated_at,
+                and_(Conversation.updated_at == updated_at, Conversation.conversation_id < conversation_id)
+            ))
+        if search:
+            pattern = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            query = query.where(Conversation.summary.ilike(f"%{pattern}%", escape="\\"))
+        query = query.order_by(Conversation.updated_at.desc(), Conversation.conversation_id.desc()).limit(limit + 1)
+        async with async_session() as session:
+            rows = (await session.exec(query)).all()
+
+        items = [conversation_item(*row) for row in rows[:limit]]
+        page = (items, _encode_cursor(items[-1]) if len(rows) > limit else None)
+        if cacheable:
+            conversation_list_cache.put(user_id, page)
+        return page
+
+    @staticmethod
+    async def create_new_conversation(user_id: str, conversation_id: str):
         conversation = Conversation(conversation_id=conversation_id, user_id=user_id)
-        session.add(conversation)
-        session.commit()
+        async with write_session() as session:
+            session.add(conversation)
+            with span("db_commit"):
+                await session.commit()
+        conversation_list_cache.invalidate(user_id)
         return conversation
@@ -1,4 +1,4 @@
-from sqlmodel import Field, SQLModel, UniqueConstraint, Relationship
+from sqlmodel import Field, SQLModel, UniqueConstraint, Relationship, Index
 from typing import Optional, List
 from datetime import datetime
 
@@ -8,9 +8,16 @@ class Conversation(SQLModel, table=True):
     summary: Optional[str] = Field(default=None)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    message_count: int = Field(default=0)
+    context_summary: Optional[str] = Field(default=None)
+    context_summary_upto: int = Field(default=0)
     messages: List["Message"] = Relationship(back_populates="conversation")
 
-    __table_args__ = (UniqueConstraint('conversation_id', 'user_id', name='uix_conversation_id_user_id'),)
+    __table_args__ = (
+        UniqueConstraint('conversation_id', 'user_id', name='uix_conversation_id_user_id'),
+        # Serves the sidebar listing: a user's conversations, most recently updated first (id breaks ties)
+        Index('ix_conversation_user_id_updated_at', 'user_id', 'updated_at', 'conversation_id'),
+    )
 
 class Message(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -19,3 +26,5 @@ class Message(SQLModel, table=True):
     message_number: int
     message_data: str
     conversation: Conversation = Relationship(back_populates="messages")
+
+    __table_args__ = (Index('ix_message_conversation_id_message_number', 'conversation_id', 'message_number'),)
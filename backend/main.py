@@ -2,14 +2,48 @@ from fastapi import FastAPI
 from chat_workflow.config import setup_app
 from chat_workflow.websocket_handler import websocket_endpoint
 from database.ConversationMemory import create_db_and_tables
+from utils.kernel_pool import shutdown_kernel_pools
+from utils.cache import cache_stats
+from utils.scheduler import execution_scheduler
+from utils.llm_registry import llm_registry
+from utils.metrics import metrics_endpoint
+from utils.artifacts import artifact_endpoint, artifact_store
+from utils.rich_output import table_page_endpoint
+from utils.environment import environment_manager
+from utils.connection_manager import connection_manager
+from chat_workflow.config import chat_jobs_distributed, ws_per_message_deflate
+from chat_workflow.jobs import start_job_workers, stop_job_workers
 
 app = FastAPI()
 
 setup_app(app)
 
 app.add_api_websocket_route("/ws", websocket_endpoint)
+app.add_api_route("/cache/stats", cache_stats, methods=["GET"])
+app.add_api_route("/scheduler/stats", execution_scheduler.stats, methods=["GET"])
+app.add_api_route("/llm/stats", llm_registry.stats, methods=["GET"])
+app.add_api_route("/metrics", metrics_endpoint, methods=["GET"])
+app.add_api_route("/artifacts/{artifact_id}", artifact_endpoint, methods=["GET"])
+app.add_api_route("/artifacts/{artifact_id}/pages/{page}", table_page_endpoint, methods=["GET"])
+
+@app.on_event("startup")
+async def startup():
+    await create_db_and_tables()
+    await environment_manager.ensure()
+    await connection_manager.start()
+    artifact_store.start()
+    if chat_jobs_distributed:
+        start_job_workers()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await stop_job_workers()
+    await connection_manager.stop()
+    await artifact_store.stop()
+    await shutdown_kernel_pools()
+    await llm_registry.close()
 
 if __name__ == "__main__":
-    create_db_and_tables()
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # permessage-deflate compresses large frames such as history pages and execution output
+    uvicorn.run(app, host="0.0.0.0", port=8000, ws_per_message_deflate=ws_per_message_deflate)
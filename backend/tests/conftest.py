@@ -0,0 +1,52 @@
+import os
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+import pytest
+
+# Like the benchmarks, run in a throwaway directory: the backend keeps its database, venv and
+# scratch files relative to the cwd. This has to happen before the backend is imported.
+_workdir = Path(tempfile.mkdtemp(prefix="backend_tests_"))
+os.chdir(_workdir)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_workdir / 'test.db'}")
+os.environ.setdefault("GROQ_API_KEY", "offline")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402,F401  (imported first to avoid the utils <-> chat_workflow import cycle)
+
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+def redis_url():
+    # A fakeredis server on a real socket, so the redis client behaves as it does against Redis
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.TcpFakeServer(("127.0.0.1", 0))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"redis://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=["memory", "redis"])
+async def broker(request):
+    from utils.broker import InMemoryBroker, RedisBroker
+    if request.param == "memory":
+        yield InMemoryBroker()
+        return
+    broker = RedisBroker.from_url(request.getfixturevalue("redis_url"))
+    await broker.client.flushall()
+    yield broker
+    await broker.close()
+
+
+@pytest.fixture(scope="session")
+async def database():
+    # Session-scoped, which also keeps one event loop running across the database tests
+    from database.ConversationMemory import create_db_and_tables
+    await create_db_and_tables()
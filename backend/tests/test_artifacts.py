@@ -0,0 +1,15 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from utils.artifacts import artifact_endpoint, artifact_store
+
+
+def test_any_file_name_makes_a_valid_content_disposition():
+    app = FastAPI()
+    app.add_api_route("/artifacts/{artifact_id}", artifact_endpoint, methods=["GET"])
+    reference = artifact_store.put_sync(b"a,b\n1,2\n", 'résumé "final".csv')
+
+    response = TestClient(app).get(f"/artifacts/{reference['id']}")
+    assert response.status_code == 200
+    assert response.headers['content-disposition'] == (
+        "inline; filename=\"r_sum_ _final_.csv\"; filename*=UTF-8''r%C3%A9sum%C3%A9%20%22final%22.csv")
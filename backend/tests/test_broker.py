@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_queue_is_fifo(broker):
+    for i in range(3):
+        await broker.enqueue("jobs", {'n': i})
+    assert [(await broker.dequeue("jobs"))['n'] for _ in range(3)] == [0, 1, 2]
+
+
+async def test_dequeue_prefers_earlier_queues(broker):
+    await broker.enqueue("shared", {'n': 'shared'})
+    await broker.enqueue("own", {'n': 'own'})
+    assert (await broker.dequeue(["own", "shared"]))['n'] == 'own'
+    assert (await broker.dequeue(["own", "shared"]))['n'] == 'shared'
+
+
+async def test_dequeue_times_out_empty(broker):
+    assert await broker.dequeue("jobs", timeout=0.1) is None
+
+
+async def test_set_if_absent_and_expire(broker):
+    assert await broker.set_if_absent("owner", "a", ttl=0.2)
+    assert not await broker.set_if_absent("owner", "b", ttl=0.2)
+    assert await broker.get("owner") == "a"
+    assert await broker.expire("owner", 0.2)
+    await asyncio.sleep(0.3)
+    assert await broker.get("owner") is None
+    assert not await broker.expire("owner", 0.2)
+    assert await broker.set_if_absent("owner", "b", ttl=1)
+    await broker.delete("owner")
+    assert await broker.get("owner") is None
+
+
+async def test_publish_reaches_subscriber(broker):
+    messages = broker.subscribe("channel")
+    received = asyncio.ensure_future(messages.__anext__())
+    # The subscription is in place once the generator has started waiting
+    for _ in range(50):
+        await asyncio.sleep(0.01)
+        await broker.publish("channel", {'hello': 'world'})
+        if received.done():
+            break
+    assert await received == {'hello': 'world'}
+    await messages.aclose()
+
+
+async def test_set_with_ttl_expires(broker):
+    await broker.set("client", "worker-a", ttl=0.2)
+    assert await broker.get("client") == "worker-a"
+    await asyncio.sleep(0.3)
+    assert await broker.get("client") is None
+    await broker.set("client", "worker-b")
+    await asyncio.sleep(0.3)
+    assert await broker.get("client") == "worker-b"
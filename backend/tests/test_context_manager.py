@@ -0,0 +1,45 @@
+import pytest
+
+from chat_workflow.context_manager import ContextManager
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeLLM:
+    """Answers every summary request with the numbers of the messages it was given."""
+
+    def __init__(self):
+        self.folded = []
+
+    async def ainvoke(self, messages):
+        numbers = [int(line.split()[-1]) for line in messages[-1].content.splitlines() if line.startswith("[")]
+        self.folded.append(numbers)
+        return type("Response", (), {'content': f"summary up to {numbers[-1]}"})()
+
+
+def conversation(count):
+    # A turn is a human message followed by the assistant's answer
+    return [(number, {'message': {'role': 'human' if number % 2 else 'assistant', 'content': f"message {number}"}})
+            for number in range(1, count + 1)]
+
+
+async def test_messages_before_the_history_window_are_folded_in_chunks():
+    messages = conversation(100)
+
+    async def load_messages(after, limit):
+        return [(number, message_data) for number, message_data in messages if number > after][:limit]
+
+    llm = FakeLLM()
+    context_manager = ContextManager(llm, recent_turns=3, fold_messages=20)
+    # Only the latest 50 messages are in the history, and the summary covers the first 10
+    summary, upto = await context_manager.fold_summary(messages[-50:], "summary up to 10", 10, load_messages)
+    assert [chunk[0] for chunk in llm.folded] == [11, 31, 51, 71, 91]
+    assert [number for chunk in llm.folded for number in chunk] == list(range(11, 95))
+    assert (summary, upto) == ("summary up to 94", 94)
+
+
+async def test_nothing_to_fold_within_the_recent_turns():
+    llm = FakeLLM()
+    context_manager = ContextManager(llm, recent_turns=3)
+    assert await context_manager.fold_summary(conversation(6)) is None
+    assert llm.folded == []
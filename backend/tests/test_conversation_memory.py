@@ -0,0 +1,127 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from database.ConversationMemory import ConversationMemory, MessageBatch
+
+pytestmark = [pytest.mark.anyio, pytest.mark.usefixtures("database")]
+
+
+def new_id():
+    return str(uuid.uuid4())
+
+
+async def make_conversations(user_id, count, summary=lambda i: f"conversation {i}"):
+    # In every group of three the last two share an updated_at, so the conversation id has to break ties
+    base = datetime(2024, 1, 1)
+    for i in range(count):
+        conversation_id = new_id()
+        await ConversationMemory.create_new_conversation(user_id, conversation_id)
+        await ConversationMemory._update_conversation(conversation_id, user_id, summary=summary(i),
+                                                      updated_at=base + timedelta(minutes=i - i % 3 // 2))
+
+
+async def all_pages(user_id, limit, search=None):
+    pages, cursor = [], None
+    while True:
+        items, cursor = await ConversationMemory.list_conversations(user_id, cursor, search, limit=limit)
+        pages.append(items)
+        if cursor is None:
+            return pages
+
+
+async def test_conversation_pages_cover_the_list_once_in_order():
+    user_id = new_id()
+    await make_conversations(user_id, 23)
+    everything, _ = await ConversationMemory.list_conversations(user_id, limit=100)
+    assert len(everything) == 23
+    assert everything == sorted(everything, key=lambda c: (c['updated_at'], c['conversation_id']), reverse=True)
+
+    pages = await all_pages(user_id, limit=5)
+    assert [len(page) for page in pages] == [5, 5, 5, 5, 3]
+    assert [c for page in pages for c in page] == everything
+
+
+async def test_search_pages_only_matching_conversations():
+    user_id = new_id()
+    await make_conversations(user_id, 12, summary=lambda i: f"survival plot {i}" if i % 2 else f"other_{i}")
+    pages = await all_pages(user_id, limit=4, search="survival")
+    summaries = [c['summary'] for page in pages for c in page]
+    assert len(summaries) == 6 and all(s.startswith("survival plot") for s in summaries)
+    # The LIKE wildcards in a search are taken literally
+    assert await ConversationMemory.list_conversations(user_id, search="%", limit=4) == ([], None)
+    items, _ = await ConversationMemory.list_conversations(user_id, search="other_", limit=100)
+    assert len(items) == 6
+
+
+@pytest.mark.parametrize("cursor", ["garbage", "2024-01-01T00:00:00|", "|abc", "not a date|abc", 17, {'a': 1}])
+async def test_malformed_conversation_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        await ConversationMemory.list_conversations(new_id(), cursor)
+
+
+async def test_history_pages_back_to_the_first_message():
+    user_id, conversation_id = new_id(), new_id()
+    await ConversationMemory.add_messages(user_id, conversation_id, [
+        {'type': 'chat_message', 'message': {'role': 'human', 'content': str(i)}} for i in range(1, 24)
+    ])
+    page, has_more = await ConversationMemory.get_history_page(conversation_id, user_id, limit=5)
+    pages = [page]
+    while has_more:
+        # The cursor the client sends back is the oldest message number it holds
+        page, has_more = await ConversationMemory.get_history_page(conversation_id, user_id, before=pages[-1][0][0], limit=5)
+        pages.append(page)
+    numbers = [number for page in reversed(pages) for number, _ in page]
+    assert numbers == list(range(1, 24))
+    assert [data['message']['content'] for page in reversed(pages) for _, data in page] == [str(i) for i in range(1, 24)]
+
+
+@pytest.mark.parametrize("before", ["5", 1.5, True, [1]])
+async def test_malformed_history_cursor_is_rejected(before):
+    with pytest.raises(ValueError):
+        await ConversationMemory.get_history_page(new_id(), new_id(), before=before)
+
+
+async def stored_numbers(conversation_id, user_id):
+    return [number for number, _ in await ConversationMemory.get_conversation_history(conversation_id, user_id)]
+
+
+@pytest.mark.parametrize("existing", [False, True], ids=["first-write", "existing"])
+async def test_concurrent_writers_get_disjoint_contiguous_numbers(existing):
+    user_id, conversation_id = new_id(), new_id()
+    if existing:
+        await ConversationMemory.create_new_conversation(user_id, conversation_id)
+
+    async def write(writer):
+        batch = MessageBatch(user_id, conversation_id)
+        for i in range(3):
+            batch.add({'type': 'chat_message', 'message': {'role': 'system', 'content': f"{writer}-{i}"}})
+        return await batch.flush()
+
+    reserved = await asyncio.gather(*(write(writer) for writer in range(20)))
+    for numbers in reserved:
+        assert numbers == list(range(numbers[0], numbers[0] + 3))
+    assert sorted(n for numbers in reserved for n in numbers) == list(range(1, 61))
+    assert await stored_numbers(conversation_id, user_id) == list(range(1, 61))
+
+    # A batch's messages keep their order and the counter carries on after the concurrent writes
+    history = dict(await ConversationMemory.get_conversation_history(conversation_id, user_id))
+    for writer, numbers in enumerate(reserved):
+        assert [history[n]['message']['content'] for n in numbers] == [f"{writer}-{i}" for i in range(3)]
+    assert await ConversationMemory.add_message(user_id, conversation_id, {'type': 'meta'}) == 61
+
+
+async def test_empty_batch_writes_nothing():
+    user_id, conversation_id = new_id(), new_id()
+    assert await MessageBatch(user_id, conversation_id).flush() == []
+    assert await stored_numbers(conversation_id, user_id) == []
+
+
+async def test_messages_after_a_number_come_oldest_first():
+    user_id, conversation_id = new_id(), new_id()
+    await ConversationMemory.add_messages(user_id, conversation_id, [{'message': {'content': str(i)}} for i in range(12)])
+    chunk = await ConversationMemory.get_messages_after(conversation_id, user_id, after=3, limit=5)
+    assert [number for number, _ in chunk] == [4, 5, 6, 7, 8]
+    assert await ConversationMemory.get_messages_after(conversation_id, user_id, after=12) == []
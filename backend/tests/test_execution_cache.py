@@ -0,0 +1,43 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+from agents.execution_agent import ExecutionAgent
+from utils import helpers
+from utils.cache import ResultCache
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def execution_agent(tmp_path, monkeypatch):
+    # Scripts run in the interpreter running the tests, with a cache of their own
+    monkeypatch.setattr(helpers, "venv_path", Path(sys.prefix))
+    execution_agent = ExecutionAgent()
+    monkeypatch.setattr(execution_agent, "kernel_pool", None)
+    monkeypatch.setattr(execution_agent, "cache", ResultCache("execution", tmp_path / "cache.db"))
+    monkeypatch.setattr(execution_agent, "coding_agent_dir", tmp_path / "coding_agent")
+    return execution_agent
+
+
+async def test_result_is_not_shared_between_conversations_with_different_files(execution_agent):
+    code = "print(open('data.csv').read())"
+    first = await execution_agent._execute_python_code(code, "without-data", None)
+    assert not first.success and "FileNotFoundError" in first.output
+
+    working_dir = execution_agent.conversation_dir("with-data")
+    working_dir.mkdir(parents=True)
+    (working_dir / "data.csv").write_text("a,b\n")
+    second = await execution_agent._execute_python_code(code, "with-data", None)
+    assert second.success and second.output == "a,b\n\n"
+
+
+async def test_run_that_writes_files_runs_again(execution_agent):
+    code = "open('out.txt', 'w').write('hi')"
+    working_dir = execution_agent.conversation_dir("c1")
+    await execution_agent._execute_python_code(code, "c1", None)
+    (working_dir / "out.txt").unlink()
+
+    await execution_agent._execute_python_code(code, "c1", None)
+    assert (working_dir / "out.txt").read_text() == "hi"
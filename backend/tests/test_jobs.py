@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from chat_workflow import jobs
+from utils.connection_manager import connection_manager
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def job_broker(broker, monkeypatch):
+    monkeypatch.setattr(jobs, "broker", broker)
+    monkeypatch.setattr(jobs, "owned_conversations", set())
+
+
+async def test_first_claim_wins(broker):
+    assert await jobs.claim_conversation("c1", "worker-a") == "worker-a"
+    assert await jobs.claim_conversation("c1", "worker-b") == "worker-a"
+    assert await jobs.claim_conversation("c2", "worker-b") == "worker-b"
+
+
+async def test_jobs_of_an_owned_conversation_go_to_its_worker(broker):
+    await jobs.submit_chat_job("client", "user", "first", "c1")
+    assert (await broker.dequeue(jobs.CHAT_JOB_QUEUE, timeout=0.1))['instructions'] == "first"
+
+    await jobs.claim_conversation("c1", "worker-a")
+    await jobs.submit_chat_job("client", "user", "second", "c1", quota_key="client")
+    assert await broker.dequeue(jobs.CHAT_JOB_QUEUE, timeout=0.1) is None
+    job = await broker.dequeue(jobs.worker_queue("worker-a"), timeout=0.1)
+    assert job['instructions'] == "second" and job['quota_key'] == "client"
+
+
+async def test_worker_forwards_a_job_claimed_elsewhere(broker, monkeypatch):
+    monkeypatch.setattr(connection_manager, "worker_id", "worker-b")
+    await jobs.claim_conversation("c1", "worker-a")
+    # Submitted to the shared queue before worker-a claimed the conversation
+    await broker.enqueue(jobs.CHAT_JOB_QUEUE, {'client_id': "client", 'user_id': "user", 'instructions': "late",
+                                               'conversation_id': "c1"})
+    worker = asyncio.create_task(jobs.job_worker(0))
+    try:
+        job = await broker.dequeue(jobs.worker_queue("worker-a"), timeout=2)
+    finally:
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+    assert job['instructions'] == "late"
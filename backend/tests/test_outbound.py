@@ -0,0 +1,126 @@
+import asyncio
+import json
+
+import pytest
+
+from utils.outbound import OutboundQueue
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeWebSocket:
+    """Records frames; while `blocked` is clear, sends hang like a client that stopped reading."""
+
+    def __init__(self):
+        self.frames = []
+        self.blocked = asyncio.Event()
+        self.blocked.set()
+
+    async def send_text(self, text):
+        await self.blocked.wait()
+        self.frames.append(json.loads(text))
+
+    def messages(self):
+        return [m for frame in self.frames for m in (frame['messages'] if frame.get('type') == 'batch' else [frame])]
+
+
+def outbound(websocket, **options):
+    closed = []
+
+    async def on_closed():
+        closed.append(True)
+
+    options = dict(dict(max_messages=10, send_timeout=0.2, batch_delay=0, batch_max_messages=5), **options)
+    return OutboundQueue(websocket, on_closed=on_closed, **options), closed
+
+
+async def wait_until(condition, timeout=2.0):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(poll(), timeout)
+
+
+async def test_deltas_merge_in_order_without_crossing_other_messages():
+    websocket = FakeWebSocket()
+    queue, _ = outbound(websocket)
+    sent = [
+        {'type': 'chat_delta', 'conversation_id': 'c1', 'delta': 'Hel'},
+        {'type': 'chat_delta', 'conversation_id': 'c1', 'delta': 'lo'},
+        {'type': 'chat_delta', 'conversation_id': 'c2', 'delta': 'other'},
+        {'type': 'exec_stream', 'conversation_id': 'c1', 'stream': 'stdout', 'text': 'a'},
+        {'type': 'exec_stream', 'conversation_id': 'c1', 'stream': 'stderr', 'text': 'b'},
+        {'type': 'exec_stream', 'conversation_id': 'c1', 'stream': 'stderr', 'text': 'c'},
+        {'type': 'chat_message', 'conversation_id': 'c1', 'message': {'role': 'system', 'content': 'done'}},
+        {'type': 'chat_delta', 'conversation_id': 'c1', 'delta': '!'},
+    ]
+    for message in sent:
+        assert await queue.put(message)
+    # Nothing was sent yet, so the producer's dicts must be untouched by merging
+    assert sent[0]['delta'] == 'Hel'
+
+    queue.start()
+    await wait_until(lambda: queue.qsize() == 0 and websocket.frames)
+    await queue.close()
+    assert websocket.messages() == [
+        {'type': 'chat_delta', 'conversation_id': 'c1', 'delta': 'Hello'},
+        {'type': 'chat_delta', 'conversation_id': 'c2', 'delta': 'other'},
+        {'type': 'exec_stream', 'conversation_id': 'c1', 'stream': 'stdout', 'text': 'a'},
+        {'type': 'exec_stream', 'conversation_id': 'c1', 'stream': 'stderr', 'text': 'bc'},
+        {'type': 'chat_message', 'conversation_id': 'c1', 'message': {'role': 'system', 'content': 'done'}},
+        {'type': 'chat_delta', 'conversation_id': 'c1', 'delta': '!'},
+    ]
+
+
+async def test_queued_messages_go_out_as_batches():
+    websocket = FakeWebSocket()
+    queue, _ = outbound(websocket)
+    for i in range(7):
+        await queue.put({'type': 'meta', 'n': i})
+    queue.start()
+    await wait_until(lambda: len(websocket.messages()) == 7)
+    await queue.close()
+    assert [len(frame['messages']) for frame in websocket.frames] == [5, 2]
+    assert [m['n'] for m in websocket.messages()] == list(range(7))
+
+
+async def test_frame_being_sent_counts_against_the_bound():
+    websocket = FakeWebSocket()
+    websocket.blocked.clear()
+    queue, _ = outbound(websocket, send_timeout=5)
+    queue.start()
+    for i in range(5):
+        await queue.put({'type': 'meta', 'n': i})
+    await wait_until(lambda: queue.in_flight == 5)
+    for i in range(5, 10):
+        assert await queue.put({'type': 'meta', 'n': i})
+    assert queue.qsize() == 10
+    assert not await queue.put({'type': 'meta', 'n': 10}, block=False)
+
+    websocket.blocked.set()
+    await wait_until(lambda: len(websocket.messages()) == 10)
+    await queue.close()
+
+
+async def test_producer_facing_a_full_queue_disconnects_stalled_client():
+    websocket = FakeWebSocket()
+    websocket.blocked.clear()
+    queue, closed = outbound(websocket, send_timeout=0.2)
+    queue.start()
+    results = [await queue.put({'type': 'meta', 'n': i}) for i in range(11)]
+    assert results == [True] * 10 + [False]
+    assert queue.closed and closed == [True]
+    assert queue.qsize() == 0
+    assert not await queue.put({'type': 'meta', 'n': 11})
+
+
+async def test_send_that_never_completes_times_out():
+    websocket = FakeWebSocket()
+    websocket.blocked.clear()
+    queue, closed = outbound(websocket, send_timeout=0.2)
+    queue.start()
+    await queue.put({'type': 'meta', 'n': 0})
+    # No producer is waiting, so only the send's own timeout can notice the stall
+    await wait_until(lambda: queue.closed, timeout=1.0)
+    assert closed == [True]
+    assert websocket.frames == []
@@ -0,0 +1,48 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+from utils import kernel_pool
+from utils.helpers import run_process
+from utils.kernel_pool import PythonKernel
+from utils.sandbox import ExecutionLimits
+
+pytestmark = pytest.mark.anyio
+
+LONG_LINE = "print('x' * 200000); print('done')"
+
+
+async def test_line_longer_than_a_read_comes_through_whole():
+    result = await run_process([sys.executable, "-c", LONG_LINE], limits=ExecutionLimits(timeout=30))
+    assert result.returncode == 0
+    assert result.stdout == "x" * 200000 + "\ndone\n"
+
+
+async def test_failing_output_callback_kills_the_process(tmp_path):
+    pid_file = tmp_path / "pid"
+    script = f"import os, time; open({str(pid_file)!r}, 'w').write(str(os.getpid())); print('hi', flush=True); time.sleep(60)"
+
+    async def on_output(stream, text):
+        raise RuntimeError("client went away")
+
+    with pytest.raises(RuntimeError):
+        await asyncio.wait_for(run_process([sys.executable, "-c", script], on_output=on_output,
+                                           limits=ExecutionLimits(timeout=30)), 10)
+    pid = int(pid_file.read_text())
+    assert not Path(f"/proc/{pid}").exists() or "zombie" in Path(f"/proc/{pid}/status").read_text()
+
+
+async def test_kernel_record_past_the_stream_limit_restarts_the_kernel(tmp_path, monkeypatch):
+    monkeypatch.setattr(kernel_pool, "venv_path", Path(sys.prefix))
+    monkeypatch.setattr(kernel_pool, "STREAM_LIMIT", 64 * 1024)
+    kernel = PythonKernel(tmp_path, ExecutionLimits(timeout=30))
+    await kernel.start()
+    try:
+        result = await kernel.execute(LONG_LINE)
+        assert not result.success
+        assert "longer than" in result.stderr
+        assert not kernel.alive
+    finally:
+        await kernel.shutdown()
@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+from utils.scheduler import ExecutionScheduler
+
+pytestmark = pytest.mark.anyio
+
+
+class Jobs:
+    """Jobs that record when they start and run until released."""
+
+    def __init__(self):
+        self.started = []
+        self.release = asyncio.Event()
+
+    def job(self, name):
+        async def run():
+            self.started.append(name)
+            await self.release.wait()
+            return name
+        return run
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def test_user_quota_leaves_slots_for_others():
+    scheduler = ExecutionScheduler(max_concurrent=4, user_quota=2)
+    jobs = Jobs()
+    busy = [asyncio.create_task(scheduler.submit("a", jobs.job(f"a{i}"))) for i in range(6)]
+    await settle()
+    assert jobs.started == ["a0", "a1"]
+    assert scheduler.queue_depth == 4
+
+    # A second user starts at once although the first one queued earlier
+    other = [asyncio.create_task(scheduler.submit("b", jobs.job(f"b{i}"))) for i in range(2)]
+    await settle()
+    assert jobs.started == ["a0", "a1", "b0", "b1"]
+
+    jobs.release.set()
+    assert sorted(await asyncio.gather(*busy, *other)) == sorted(f"a{i}" for i in range(6)) + ["b0", "b1"]
+    assert scheduler.running_count == 0 and scheduler.queue_depth == 0
+
+
+async def test_fewest_running_goes_first_in_rotation():
+    scheduler = ExecutionScheduler(max_concurrent=1, user_quota=1)
+    jobs = Jobs()
+    first = asyncio.create_task(scheduler.submit("a", jobs.job("a0")))
+    await settle()
+    queued = [asyncio.create_task(scheduler.submit(user, jobs.job(f"{user}{i}")))
+              for i in range(1, 3) for user in ("a", "b")]
+    await settle()
+    jobs.release.set()
+    await asyncio.gather(first, *queued)
+    # Interleaved rather than all of the first user's jobs before the second user's
+    assert jobs.started == ["a0", "a1", "b1", "a2", "b2"]
+
+
+async def test_priority_orders_a_users_jobs():
+    scheduler = ExecutionScheduler(max_concurrent=1, user_quota=1)
+    jobs = Jobs()
+    first = asyncio.create_task(scheduler.submit("a", jobs.job("running")))
+    await settle()
+    later = asyncio.create_task(scheduler.submit("a", jobs.job("low"), priority=5))
+    sooner = asyncio.create_task(scheduler.submit("a", jobs.job("high"), priority=0))
+    await settle()
+    jobs.release.set()
+    await asyncio.gather(first, later, sooner)
+    assert jobs.started == ["running", "high", "low"]
+
+
+async def test_cancel_while_queued_never_runs_and_frees_nothing():
+    scheduler = ExecutionScheduler(max_concurrent=1, user_quota=1)
+    jobs = Jobs()
+    running = asyncio.create_task(scheduler.submit("a", jobs.job("running")))
+    await settle()
+    cancelled = asyncio.create_task(scheduler.submit("a", jobs.job("cancelled")))
+    waiting = asyncio.create_task(scheduler.submit("a", jobs.job("waiting")))
+    await settle()
+    assert scheduler.queue_depth == 2
+
+    cancelled.cancel()
+    await asyncio.gather(cancelled, return_exceptions=True)
+    assert scheduler.queue_depth == 1
+    assert scheduler.running_count == 1
+
+    jobs.release.set()
+    await asyncio.gather(running, waiting)
+    assert jobs.started == ["running", "waiting"]
+    assert scheduler.running_count == 0 and scheduler.stats()['cancelled'] == 1
+
+
+async def test_cancel_after_dispatch_releases_the_slot():
+    scheduler = ExecutionScheduler(max_concurrent=1, user_quota=1)
+    jobs = Jobs()
+    running = asyncio.create_task(scheduler.submit("a", jobs.job("running")))
+    await settle()
+    next_up = asyncio.create_task(scheduler.submit("b", jobs.job("next")))
+    after = asyncio.create_task(scheduler.submit("c", jobs.job("after")))
+    await settle()
+
+    # The slot is handed to "next", and its task is cancelled before it resumes to run the job
+    dispatch = scheduler._dispatch
+
+    def dispatch_then_cancel():
+        dispatch()
+        if scheduler.running.get("b"):
+            next_up.cancel()
+    scheduler._dispatch = dispatch_then_cancel
+
+    jobs.release.set()
+    await running
+    await asyncio.gather(next_up, return_exceptions=True)
+    await after
+    assert jobs.started == ["running", "after"]
+    assert scheduler.running_count == 0
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from chat_workflow.chat_manager import ChatManager
+from chat_workflow.speculation import SpeculativeExecutor
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def chat_manager(monkeypatch):
+    chat_manager = ChatManager(asyncio.Queue(), "c1")
+
+    async def generate_code(prompt, temperature=None, on_token=None):
+        return "There is nothing to run for this; the answer is 42."
+    monkeypatch.setattr(chat_manager.coding_agent, "generate_code", generate_code)
+    return chat_manager
+
+
+async def test_winner_without_code_is_not_adopted(chat_manager, monkeypatch):
+    adopted = []
+
+    async def adopt_sandbox(sandbox_id, conversation_id):
+        adopted.append(sandbox_id)
+    monkeypatch.setattr(chat_manager.execution_agent, "adopt_sandbox", adopt_sandbox)
+
+    speculative = SpeculativeExecutor(chat_manager, candidates=3, temperatures=[0.0, 0.5, 1.0])
+    winner, candidates = await speculative.run("answer", "c1", "client")
+    assert winner is not None and winner.success and not winner.ran_python
+    assert adopted == []
+
+
+@pytest.mark.parametrize("kernel_pool", [True, False], ids=["kernel-pool", "scripts"])
+async def test_adopting_a_sandbox_that_never_ran_leaves_the_conversation_alone(chat_manager, monkeypatch, kernel_pool):
+    execution_agent = chat_manager.execution_agent
+    if not kernel_pool:
+        monkeypatch.setattr(execution_agent, "kernel_pool", None)
+    working_dir = execution_agent.conversation_dir("c1")
+    working_dir.mkdir(parents=True, exist_ok=True)
+    (working_dir / "data.csv").write_text("a,b\n")
+
+    await execution_agent.adopt_sandbox("c1-candidate-never-ran", "c1")
+    assert (working_dir / "data.csv").read_text() == "a,b\n"
+    if execution_agent.kernel_pool is not None:
+        assert "c1-candidate-never-ran" not in execution_agent.kernel_pool.kernels
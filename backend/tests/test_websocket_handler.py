@@ -0,0 +1,19 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from chat_workflow import websocket_handler
+
+
+def test_disconnect_cancels_turns_on_every_worker(monkeypatch):
+    cancelled = []
+
+    async def cancel_chat(client_id, conversation_id=None):
+        cancelled.append((client_id, conversation_id))
+    monkeypatch.setattr(websocket_handler, "cancel_chat", cancel_chat)
+    app = FastAPI()
+    app.add_api_websocket_route("/ws", websocket_handler.websocket_endpoint)
+
+    with TestClient(app).websocket_connect("/ws"):
+        pass
+    # Without a conversation id, so every turn of the client is cancelled wherever it runs
+    assert len(cancelled) == 1 and cancelled[0][1] is None
@@ -1,2 +1,11 @@
 from .helpers import print_verbose, install_packages, run_in_venv
 from .connection_manager import WebSocketConnectionManager, connection_manager
+from .kernel_pool import KernelPool, get_kernel_pool, shutdown_kernel_pools
+from .cache import ResultCache, get_cache, cache_stats
+from .environment import EnvironmentManager, environment_manager
+from .broker import Broker, InMemoryBroker, RedisBroker, broker
+from .scheduler import ExecutionScheduler, execution_scheduler
+from .llm_registry import LLMRegistry, llm_registry, get_llm
+from .metrics import metrics, span
+from .artifacts import ArtifactStore, artifact_store
+from .sandbox import ExecutionLimits, ExecutionResult
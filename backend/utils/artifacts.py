@@ -0,0 +1,274 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import time
+import uuid
+from pathlib import Path
+from urllib.parse import quote
+from typing import Dict, List, Optional, Tuple
+from fastapi import Request, Response
+from utils.helpers import print_verbose, run_blocking, truncate_middle
+from chat_workflow.config import artifact_dir, artifact_inline_limit, artifact_max_file_bytes, artifact_ttl, artifact_max_bytes
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ARTIFACT_ID = re.compile(r"^[0-9a-f]{64}$")
+RANGE_HEADER = re.compile(r"^bytes=(\d*)-(\d*)$")
+# Formats that are compressed already; storing them as-is also lets ranges be read straight from disk.
+# Arrow files compress their record batches themselves and are memory-mapped to serve table pages
+PRECOMPRESSED_TYPES = ("image/png", "image/jpeg", "image/gif", "image/webp", "application/zip",
+                       "application/gzip", "application/pdf", "application/vnd.apache.arrow.file", "video/", "audio/")
+GC_INTERVAL = 3600
+
+
+def _compress(data: bytes) -> Tuple[bytes, str]:
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).compress(data), "zstd"
+    return gzip.compress(data, compresslevel=6), "gzip"
+
+
+def _decompress(data: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Artifact is zstd-compressed but the 'zstandard' package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    return data
+
+
+class ArtifactStore:
+    """Content-addressed files on disk, compressed unless their format already is.
+
+    An artifact's id is the SHA-256 of its content, so identical outputs are stored once and
+    a URL never changes meaning. Messages keep a small reference instead of the content.
+    Artifacts are not kept forever: a background sweep removes those unused for longer than the TTL,
+    then the least recently used ones until the store fits its size cap. A message may therefore
+    outlive the artifacts it references, whose URLs then answer 404.
+    """
+
+    def __init__(self, root: str = artifact_dir, inline_limit: int = artifact_inline_limit,
+                 max_file_bytes: int = artifact_max_file_bytes, ttl: float = artifact_ttl,
+                 max_bytes: int = artifact_max_bytes):
+        self.root = Path(root).absolute()
+        self.inline_limit = inline_limit
+        self.max_file_bytes = max_file_bytes
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.gc_task: Optional[asyncio.Task] = None
+
+    def _paths(self, artifact_id: str) -> Tuple[Path, Path]:
+        directory = self.root / artifact_id[:2]
+        return directory / artifact_id, directory / f"{artifact_id}.json"
+
+    def metadata(self, artifact_id: str) -> Optional[Dict]:
+        if not ARTIFACT_ID.match(artifact_id):
+            return None
+        _, meta_path = self._paths(artifact_id)
+        try:
+            meta = json.loads(meta_path.read_text())
+            # The metadata file's mtime is the artifact's last use, which the garbage collector goes by
+            os.utime(meta_path)
+            return meta
+        except FileNotFoundError:
+            return None
+
+    def put_sync(self, data: bytes, name: str, media_type: str = None) -> Dict:
+        artifact_id = hashlib.sha256(data).hexdigest()
+        media_type = media_type or mimetypes.guess_type(name)[0] or "application/octet-stream"
+        reference = {'id': artifact_id, 'name': name, 'media_type': media_type, 'size': len(data)}
+        if self.metadata(artifact_id) is not None:
+            return reference
+
+        if media_type.startswith(PRECOMPRESSED_TYPES):
+            stored, encoding = data, "identity"
+        else:
+            stored, encoding = _compress(data)
+        data_path, meta_path = self._paths(artifact_id)
+        data_path.parent.mkdir(parents=True, exist_ok=True)
+        # Written under temporary names and renamed, so a reader never sees a partial artifact
+        for path, content in ((data_path, stored), (meta_path, json.dumps({**reference, 'encoding': encoding}).encode())):
+            temporary = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+            temporary.write_bytes(content)
+            os.replace(temporary, path)
+        print_verbose(f"ArtifactStore: Stored {name} ({len(data)} bytes, {len(stored)} on disk, {encoding})")
+        return reference
+
+    def file_path(self, artifact_id: str) -> Optional[Path]:
+        """Where an artifact stored uncompressed is on disk, for readers that map the file; None otherwise."""
+        meta = self.metadata(artifact_id)
+        if meta is None or meta['encoding'] != "identity":
+            return None
+        return self._paths(artifact_id)[0]
+
+    def read_sync(self, artifact_id: str, start: int = 0, end: int = None) -> bytes:
+        # end is inclusive, as in HTTP ranges
+        meta = self.metadata(artifact_id)
+        data_path, _ = self._paths(artifact_id)
+        end = meta['size'] - 1 if end is None else end
+        if meta['encoding'] == "identity":
+            with open(data_path, "rb") as f:
+                f.seek(start)
+                return f.read(end - start + 1)
+        return _decompress(data_path.read_bytes(), meta['encoding'])[start:end + 1]
+
+    async def put(self, data: bytes, name: str, media_type: str = None) -> Dict:
+        return await run_blocking(self.put_sync, data, name, media_type)
+
+    async def externalize(self, text: str, name: str) -> Tuple[str, List[Dict]]:
+        """Returns the text to keep inline and, when it was too long, a reference to the full text."""
+        if len(text) <= self.inline_limit:
+            return text, []
+        reference = await self.put(text.encode("utf-8"), name, "text/plain")
+        return truncate_middle(text, self.inline_limit), [reference]
+
+    def snapshot_sync(self, directory: Path) -> Dict[str, Tuple[int, int]]:
+        files = {}
+        for root, dirs, names in os.walk(directory):
+            dirs[:] = [d for d in dirs if not d.startswith(".") and d != "__pycache__"]
+            for name in names:
+                if name.startswith(".") or (name.startswith("script_") and name.endswith(".py")):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files[path] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def collect_sync(self, directory: Path, before: Dict[str, Tuple[int, int]]) -> List[Dict]:
+        """Stores the files created or modified since `before` was taken."""
+        references = []
+        for path, (mtime, size) in sorted(self.snapshot_sync(directory).items()):
+            if before.get(path) == (mtime, size):
+                continue
+            name = os.path.relpath(path, directory)
+            if size > self.max_file_bytes:
+                print_verbose(f"ArtifactStore: Skipping {name}, {size} bytes is over the limit")
+                continue
+            try:
+                references.append(self.put_sync(Path(path).read_bytes(), name))
+            except OSError as e:
+                print_verbose(f"ArtifactStore: Could not capture {name}: {e}")
+        return references
+
+    async def snapshot(self, directory: Path) -> Dict[str, Tuple[int, int]]:
+        return await run_blocking(self.snapshot_sync, directory)
+
+    async def collect(self, directory: Path, before: Dict[str, Tuple[int, int]]) -> List[Dict]:
+        return await run_blocking(self.collect_sync, directory, before)
+
+    def collect_garbage_sync(self) -> int:
+        """Removes expired artifacts, then the least recently used until the store fits; returns how many went."""
+        now = time.time()
+        entries = []
+        for meta_path in self.root.glob("*/*"):
+            try:
+                stat = meta_path.stat()
+                if meta_path.name.startswith("."):
+                    if now - stat.st_mtime > GC_INTERVAL:
+                        meta_path.unlink()  # left behind by a write that never finished
+                    continue
+                if meta_path.suffix != ".json":
+                    continue
+                size = meta_path.with_suffix("").stat().st_size
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, size, meta_path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for used, size, meta_path in entries:
+            expired = self.ttl and now - used > self.ttl
+            if not expired and not (self.max_bytes and total > self.max_bytes):
+                break
+            try:
+                if meta_path.stat().st_mtime != used:
+                    continue  # used again since the sweep started
+                # Metadata first, so readers see the artifact as missing rather than half removed
+                meta_path.unlink()
+                meta_path.with_suffix("").unlink(missing_ok=True)
+            except FileNotFoundError:
+                continue
+            total -= size
+            removed += 1
+        if removed:
+            print_verbose(f"ArtifactStore: Removed {removed} artifacts, {total} bytes kept")
+        return removed
+
+    async def _collect_garbage(self):
+        while True:
+            try:
+                await run_blocking(self.collect_garbage_sync)
+            except OSError as e:
+                print(f"Error collecting artifacts: {e}")
+            await asyncio.sleep(GC_INTERVAL)
+
+    def start(self):
+        if self.gc_task is None or self.gc_task.done():
+            self.gc_task = asyncio.create_task(self._collect_garbage())
+
+    async def stop(self):
+        if self.gc_task is not None:
+            self.gc_task.cancel()
+            await asyncio.gather(self.gc_task, return_exceptions=True)
+            self.gc_task = None
+
+
+artifact_store = ArtifactStore()
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    # Single byte ranges only; anything else is answered with the whole artifact
+    match = RANGE_HEADER.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        return max(0, size - int(last)), size - 1
+    return int(first), min(int(last), size - 1) if last else size - 1
+
+
+def _content_disposition(name: str) -> str:
+    # File names come from generated code: the quoted form gets an ASCII stand-in without quotes or
+    # backslashes, and clients that read filename* get the real name, percent-encoded UTF-8
+    name = os.path.basename(name)
+    fallback = re.sub(r'[^\x20-\x7e]|["\\]', "_", name)
+    return f"inline; filename=\"{fallback}\"; filename*=UTF-8''{quote(name, safe='')}"
+
+
+async def artifact_endpoint(artifact_id: str, request: Request):
+    meta = await run_blocking(artifact_store.metadata, artifact_id)
+    if meta is None:
+        return Response(status_code=404)
+
+    size = meta['size']
+    headers = {
+        'ETag': f'"{artifact_id}"',
+        # Content-addressed, so a response can be cached forever
+        'Cache-Control': "public, max-age=31536000, immutable",
+        'Accept-Ranges': "bytes",
+        'Content-Disposition': _content_disposition(meta['name']),
+    }
+    if request.headers.get("if-none-match") == headers['ETag']:
+        return Response(status_code=304, headers=headers)
+
+    byte_range = _parse_range(request.headers["range"], size) if "range" in request.headers else None
+    if byte_range is None:
+        body = await run_blocking(artifact_store.read_sync, artifact_id)
+        return Response(body, media_type=meta['media_type'], headers=headers)
+
+    start, end = byte_range
+    if start > end or start >= size:
+        return Response(status_code=416, headers={**headers, 'Content-Range': f"bytes */{size}"})
+    body = await run_blocking(artifact_store.read_sync, artifact_id, start, end)
+    headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+    return Response(body, status_code=206, media_type=meta['media_type'], headers=headers)
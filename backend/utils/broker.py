@@ -0,0 +1,189 @@
+import asyncio
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+from typing import AsyncIterator, Deque, Dict, Optional, Sequence, Set, Union
+from chat_workflow.config import broker_url
+
+
+class Broker(ABC):
+    """Pub/sub, job queues and a small key/value store shared by all workers."""
+
+    @abstractmethod
+    async def publish(self, channel: str, message: dict):
+        ...
+
+    @abstractmethod
+    def subscribe(self, channel: str) -> AsyncIterator[dict]:
+        ...
+
+    @abstractmethod
+    async def enqueue(self, queue: str, item: dict):
+        ...
+
+    @abstractmethod
+    async def dequeue(self, queue: Union[str, Sequence[str]], timeout: float = 1.0) -> Optional[dict]:
+        """The next item of the queue, or of the first non-empty one of several; None after the timeout."""
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        """Sets a key, which expires after ttl seconds when one is given."""
+
+    @abstractmethod
+    async def set_if_absent(self, key: str, value: str, ttl: float) -> bool:
+        """Sets a key that expires after ttl seconds unless it exists; True if it was set."""
+
+    @abstractmethod
+    async def expire(self, key: str, ttl: float) -> bool:
+        """Makes an existing key expire ttl seconds from now; False if there is no such key."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str):
+        ...
+
+    async def close(self):
+        pass
+
+
+class InMemoryBroker(Broker):
+    """Single-process broker; also the stand-in used for local testing."""
+
+    def __init__(self):
+        self.subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self.queues: Dict[str, Deque[dict]] = defaultdict(deque)
+        self.queued = asyncio.Condition()
+        self.values: Dict[str, str] = {}
+        self.expires: Dict[str, float] = {}
+
+    async def publish(self, channel: str, message: dict):
+        for subscriber in list(self.subscribers.get(channel, ())):
+            subscriber.put_nowait(message)
+
+    async def subscribe(self, channel: str) -> AsyncIterator[dict]:
+        queue = asyncio.Queue()
+        self.subscribers[channel].add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.subscribers[channel].discard(queue)
+
+    async def enqueue(self, queue: str, item: dict):
+        async with self.queued:
+            self.queues[queue].appendleft(item)
+            self.queued.notify_all()
+
+    async def dequeue(self, queue: Union[str, Sequence[str]], timeout: float = 1.0) -> Optional[dict]:
+        names = [queue] if isinstance(queue, str) else list(queue)
+        async with self.queued:
+            try:
+                await asyncio.wait_for(self.queued.wait_for(lambda: any(self.queues[name] for name in names)), timeout)
+            except asyncio.TimeoutError:
+                return None
+            return self.queues[next(name for name in names if self.queues[name])].pop()
+
+    def _expire_stale(self, key: str):
+        if key in self.expires and self.expires[key] <= time.monotonic():
+            del self.values[key], self.expires[key]
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        self.values[key] = value
+        if ttl:
+            self.expires[key] = time.monotonic() + ttl
+        else:
+            self.expires.pop(key, None)
+
+    async def set_if_absent(self, key: str, value: str, ttl: float) -> bool:
+        self._expire_stale(key)
+        if key in self.values:
+            return False
+        self.values[key] = value
+        self.expires[key] = time.monotonic() + ttl
+        return True
+
+    async def expire(self, key: str, ttl: float) -> bool:
+        self._expire_stale(key)
+        if key not in self.values:
+            return False
+        self.expires[key] = time.monotonic() + ttl
+        return True
+
+    async def get(self, key: str) -> Optional[str]:
+        self._expire_stale(key)
+        return self.values.get(key)
+
+    async def delete(self, key: str):
+        self.values.pop(key, None)
+        self.expires.pop(key, None)
+
+
+class RedisBroker(Broker):
+    """Broker on any client speaking the redis.asyncio API (Redis, Valkey, or fakeredis for tests)."""
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("BROKER_URL points to Redis but the 'redis' package is not installed")
+        return cls(redis.from_url(url))
+
+    async def publish(self, channel: str, message: dict):
+        await self.client.publish(channel, json.dumps(message))
+
+    async def subscribe(self, channel: str) -> AsyncIterator[dict]:
+        pubsub = self.client.pubsub()
+        await pubsub.subscribe(channel)
+        try:
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is not None:
+                    yield json.loads(message['data'])
+        finally:
+            await pubsub.unsubscribe(channel)
+            await pubsub.aclose()
+
+    async def enqueue(self, queue: str, item: dict):
+        await self.client.lpush(queue, json.dumps(item))
+
+    async def dequeue(self, queue: Union[str, Sequence[str]], timeout: float = 1.0) -> Optional[dict]:
+        result = await self.client.brpop([queue] if isinstance(queue, str) else list(queue), timeout=timeout)
+        return json.loads(result[1]) if result else None
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        await self.client.set(key, value, px=int(ttl * 1000) if ttl else None)
+
+    async def set_if_absent(self, key: str, value: str, ttl: float) -> bool:
+        return bool(await self.client.set(key, value, nx=True, px=int(ttl * 1000)))
+
+    async def expire(self, key: str, ttl: float) -> bool:
+        return bool(await self.client.pexpire(key, int(ttl * 1000)))
+
+    async def get(self, key: str) -> Optional[str]:
+        value = await self.client.get(key)
+        return value.decode() if isinstance(value, bytes) else value
+
+    async def delete(self, key: str):
+        await self.client.delete(key)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def create_broker(url: str = broker_url) -> Broker:
+    if url.startswith("memory://"):
+        return InMemoryBroker()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBroker.from_url(url)
+    raise ValueError(f"Unsupported BROKER_URL: {url}")
+
+
+broker = create_broker()
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+from utils.helpers import print_verbose, run_blocking
+from chat_workflow.config import cache_enabled, cache_path, cache_max_entries, cache_max_bytes, cache_ttl
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def content_hash(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """SQLite-backed key/value cache with TTL expiry, LRU eviction and entry/byte caps.
+
+    Namespaces share one file so all caches survive restarts together.
+    """
+
+    def __init__(self, namespace: str, path: Path, max_entries: int = cache_max_entries,
+                 max_bytes: int = cache_max_bytes, ttl: float = cache_ttl):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entry ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS ix_cache_entry_accessed ON cache_entry (namespace, accessed_at)")
+
+    def get_sync(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, created_at FROM cache_entry WHERE namespace = ? AND key = ?", (self.namespace, key)
+            ).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                self.connection.execute("DELETE FROM cache_entry WHERE namespace = ? AND key = ?", (self.namespace, key))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.connection.execute(
+                "UPDATE cache_entry SET accessed_at = ? WHERE namespace = ? AND key = ?", (now, self.namespace, key)
+            )
+            self.hits += 1
+            return row[0]
+
+    def set_sync(self, key: str, value: str):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO cache_entry (namespace, key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.namespace, key, value, size, now, now)
+            )
+            self._evict()
+
+    def _evict(self):
+        self.connection.execute("DELETE FROM cache_entry WHERE namespace = ? AND created_at < ?", (self.namespace, time.time() - self.ttl))
+        count, total = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entry WHERE namespace = ?", (self.namespace,)
+        ).fetchone()
+        while count > self.max_entries or total > self.max_bytes:
+            key, size = self.connection.execute(
+                "SELECT key, size FROM cache_entry WHERE namespace = ? ORDER BY accessed_at LIMIT 1", (self.namespace,)
+            ).fetchone()
+            self.connection.execute("DELETE FROM cache_entry WHERE namespace = ? AND key = ?", (self.namespace, key))
+            count, total = count - 1, total - size
+            self.evictions += 1
+
+    async def get(self, key: str) -> Optional[str]:
+        return await run_blocking(self.get_sync, key)
+
+    async def set(self, key: str, value: str):
+        await run_blocking(self.set_sync, key, value)
+
+    async def get_json(self, key: str):
+        value = await self.get(key)
+        return json.loads(value) if value is not None else None
+
+    async def set_json(self, key: str, value):
+        await self.set(key, json.dumps(value))
+
+    def stats(self) -> Dict:
+        with self.lock:
+            entries, total = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entry WHERE namespace = ?", (self.namespace,)
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': total,
+        }
+
+
+_caches: Dict[str, ResultCache] = {}
+
+
+def get_cache(namespace: str) -> Optional[ResultCache]:
+    """Returns the named cache, or None when caching is disabled."""
+    if not cache_enabled:
+        return None
+    if namespace not in _caches:
+        _caches[namespace] = ResultCache(namespace, Path(cache_path).absolute())
+        print_verbose(f"Cache: Opened '{namespace}' cache at {cache_path}")
+    return _caches[namespace]
+
+
+def cache_stats() -> Dict:
+    return {namespace: cache.stats() for namespace, cache in _caches.items()}
@@ -1,41 +1,132 @@
 import asyncio
-from fastapi import WebSocket, WebSocketDisconnect
-from typing import List, Tuple, Dict
+import uuid
+from fastapi import WebSocket
+from typing import Dict, Set
+from utils.broker import Broker, broker as default_broker
+from utils.metrics import metrics
+from utils.outbound import OutboundQueue
+
+BROADCAST_CHANNEL = "broadcast"
+# Seconds a client's route outlives the worker holding its socket, if that worker dies without disconnecting it
+CLIENT_TTL = 30
 
 class WebSocketConnectionManager:
-    def __init__(self):
-        self.active_connections: List[Tuple[WebSocket, str]] = []
+    """Registry of this worker's websockets, indexed by client_id.
+
+    Which worker owns a client is recorded in the broker, so any worker can route a
+    message to any client through the owner's channel.
+    """
+
+    def __init__(self, broker: Broker = default_broker, worker_id: str = None):
+        self.broker = broker
+        self.worker_id = worker_id or str(uuid.uuid4())
+        self.active_connections: Dict[str, WebSocket] = {}
+        self.client_ids: Dict[int, str] = {}
+        # Per-socket send paths; everything sent to a client goes through its queue, in order
+        self.outbound_queues: Dict[str, OutboundQueue] = {}
         self.active_connections_lock = asyncio.Lock()
+        self.listener_tasks = []
+        # Close handshakes with stalled clients, which nothing waits for
+        self.closing_tasks: Set[asyncio.Task] = set()
+
+    @property
+    def worker_channel(self) -> str:
+        return f"worker:{self.worker_id}"
+
+    async def start(self):
+        if not self.listener_tasks:
+            self.listener_tasks = [
+                asyncio.create_task(self._listen(self.worker_channel)),
+                asyncio.create_task(self._listen(BROADCAST_CHANNEL)),
+                asyncio.create_task(self._renew_clients()),
+            ]
+            # Give the listeners a chance to subscribe before anything is published
+            await asyncio.sleep(0)
+
+    async def stop(self):
+        for task in self.listener_tasks:
+            task.cancel()
+        await asyncio.gather(*self.listener_tasks, return_exceptions=True)
+        self.listener_tasks = []
 
-    async def connect(self, websocket: WebSocket, client_id: str):
+    async def _listen(self, channel: str):
+        async for envelope in self.broker.subscribe(channel):
+            if channel == BROADCAST_CHANNEL:
+                await self._broadcast_local(envelope['message'])
+            else:
+                queue = self.outbound_queues.get(envelope['client_id'])
+                if queue is not None:
+                    await queue.put(envelope['message'])
+
+    async def _renew_clients(self):
+        while True:
+            await asyncio.sleep(CLIENT_TTL / 3)
+            for client_id in list(self.active_connections):
+                # Unless the socket closed while an earlier renewal was being sent
+                if client_id in self.active_connections:
+                    await self.broker.set(f"client:{client_id}", self.worker_id, CLIENT_TTL)
+
+    async def connect(self, websocket: WebSocket, client_id: str, encoding: str = "json") -> OutboundQueue:
+        """Accepts the socket and starts its send path, which is stopped again by disconnect."""
         await websocket.accept()
+        queue = OutboundQueue(websocket, encoding, on_closed=lambda: self._close_stalled(websocket)).start()
         async with self.active_connections_lock:
-            self.active_connections.append((websocket, client_id))
+            self.active_connections[client_id] = websocket
+            self.client_ids[id(websocket)] = client_id
+            self.outbound_queues[client_id] = queue
             print(f"New Connection: {client_id}, Total: {len(self.active_connections)}")
+        await self.broker.set(f"client:{client_id}", self.worker_id, CLIENT_TTL)
+        return queue
 
     async def disconnect(self, websocket: WebSocket):
         async with self.active_connections_lock:
-            self.active_connections = [conn for conn in self.active_connections if conn[0] != websocket]
+            client_id = self.client_ids.pop(id(websocket), None)
+            if client_id is None:
+                return
+            self.active_connections.pop(client_id, None)
+            queue = self.outbound_queues.pop(client_id, None)
             print(f"Connection Closed. Total: {len(self.active_connections)}")
+        if queue is not None:
+            await queue.close()
+        await self.broker.delete(f"client:{client_id}")
+
+    async def _close_stalled(self, websocket: WebSocket):
+        # The send path gave up on the socket; closing it also ends the endpoint's receive loop.
+        # The close frame queues behind the data the client is not reading, so the handshake can
+        # take the server's close timeouts; the producer that gave up does not wait for it.
+        await self.disconnect(websocket)
+        task = asyncio.create_task(self._close(websocket, 1013))
+        self.closing_tasks.add(task)
+        task.add_done_callback(self.closing_tasks.discard)
 
-    async def send_message(self, message: Dict, websocket: WebSocket):
+    @staticmethod
+    async def _close(websocket: WebSocket, code: int):
         try:
-            await websocket.send_json(message)
-        except WebSocketDisconnect:
-            print("Error: Tried to send a message to a closed WebSocket")
-            await self.disconnect(websocket)
-        except Exception as e:
-            print(f"Error in sending message: {str(e)}")
-            await self.disconnect(websocket)
+            await websocket.close(code=code)
+        except Exception:
+            pass  # already closed by the client
+
+    async def _broadcast_local(self, message: Dict):
+        # Never waits on a slow client, which would hold up everyone else's copy
+        for queue in list(self.outbound_queues.values()):
+            await queue.put(message, block=False)
 
     async def broadcast(self, message: Dict):
-        for connection, _ in self.active_connections[:]:
-            await self.send_message(message, connection)
+        await self.broker.publish(BROADCAST_CHANNEL, {'message': message})
 
     async def send_message_to_client(self, message: Dict, client_id: str):
-        for connection, conn_client_id in self.active_connections:
-            if conn_client_id == client_id:
-                await self.send_message(message, connection)
-                break
+        queue = self.outbound_queues.get(client_id)
+        if queue is not None:
+            await queue.put(message)
+            return
+        owner = await self.broker.get(f"client:{client_id}")
+        if owner is not None:
+            await self.broker.publish(f"worker:{owner}", {'client_id': client_id, 'message': message})
+
+    def owns(self, client_id: str) -> bool:
+        return client_id in self.active_connections
 
 connection_manager = WebSocketConnectionManager()
+metrics.gauge("websocket_connections", "Open websockets on this worker", lambda: len(connection_manager.active_connections))
+metrics.gauge("websocket_outbound_queue_depth", "Messages waiting to be sent, across all sockets",
+              lambda: sum(queue.qsize() for queue in connection_manager.outbound_queues.values()))
@@ -0,0 +1,120 @@
+import asyncio
+import hashlib
+import re
+import shutil
+import venv
+from pathlib import Path
+from typing import Dict, List
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.utils import canonicalize_name
+from utils.helpers import print_verbose, run_blocking, install_packages, venv_path
+from chat_workflow.config import base_requirements, venv_snapshot_dir
+
+KEY_FILE = ".snapshot-key"
+PIP_INSTALL_PATTERN = re.compile(r"^\s*(?:!|%)?(?:pip3?|python3? -m pip) install\s+(.*)$")
+
+
+def parse_pip_install(shell_commands: str) -> List[str]:
+    """Collects the requirement arguments of every `pip install` line, dropping pip options."""
+    requirements = []
+    for line in shell_commands.split('\n'):
+        match = PIP_INSTALL_PATTERN.match(line)
+        if match:
+            requirements.extend(arg for arg in match.group(1).split() if not arg.startswith('-'))
+    return requirements
+
+
+def requirements_key(requirements: List[str]) -> str:
+    normalized = sorted({str(Requirement(r)).lower() for r in requirements})
+    return hashlib.sha256("\n".join(normalized).encode()).hexdigest()[:16]
+
+
+class EnvironmentManager:
+    """Owns the execution venv: builds it from cached snapshots and installs only what is missing."""
+
+    def __init__(self, path: Path, snapshot_dir: Path, base: List[str]):
+        self.path = path
+        self.snapshot_dir = snapshot_dir
+        self.base = base
+        self.ready = False
+        self.lock = asyncio.Lock()
+        # pip must not run twice at once against the same venv
+        self.install_lock = asyncio.Lock()
+
+    def installed_distributions(self, path: Path = None) -> Dict[str, str]:
+        distributions = {}
+        for dist_info in (path or self.path).glob("lib/python*/site-packages/*.dist-info"):
+            name, _, version = dist_info.name[:-len(".dist-info")].rpartition("-")
+            distributions[canonicalize_name(name)] = version
+        return distributions
+
+    def missing(self, requirements: List[str], path: Path = None) -> List[str]:
+        installed = self.installed_distributions(path)
+        missing = []
+        for raw in dict.fromkeys(requirements):
+            try:
+                requirement = Requirement(raw)
+            except InvalidRequirement:
+                missing.append(raw)
+                continue
+            version = installed.get(canonicalize_name(requirement.name))
+            if version is None or (requirement.specifier and not requirement.specifier.contains(version, prereleases=True)):
+                missing.append(raw)
+        return missing
+
+    async def install(self, requirements: List[str], path: Path = None) -> str:
+        async with self.install_lock:
+            missing = self.missing(requirements, path)
+            satisfied = [r for r in dict.fromkeys(requirements) if r not in missing]
+            results = []
+            if satisfied:
+                results.append(f"Already installed: {' '.join(satisfied)}")
+            if missing:
+                # One resolver call for everything the turn asked for
+                results.append(await install_packages(missing, path or self.path))
+            return "\n".join(results)
+
+    async def ensure(self):
+        if self.ready:
+            return
+        async with self.lock:
+            if self.ready:
+                return
+            key = requirements_key(self.base)
+            key_file = self.path / KEY_FILE
+            current = await run_blocking(lambda: key_file.read_text() if key_file.exists() else None)
+            if current is None and await run_blocking(self.path.exists):
+                # Not built from a snapshot, so possibly a venv someone else relies on (even the server's own)
+                raise RuntimeError(
+                    f"{self.path} exists but was not created by the environment manager; "
+                    f"set EXEC_VENV_PATH to a new directory or remove it yourself"
+                )
+            if current != key:
+                snapshot = await self.snapshot(key)
+                print_verbose(f"Environment: Cloning snapshot {key} into {self.path}")
+                await run_blocking(self._replace_venv, snapshot)
+            self.ready = True
+
+    async def snapshot(self, key: str) -> Path:
+        snapshot = self.snapshot_dir / key
+        if (snapshot / KEY_FILE).exists():
+            return snapshot
+        print_verbose(f"Environment: Building snapshot {key} for {self.base or 'an empty requirement set'}")
+        await run_blocking(shutil.rmtree, snapshot, ignore_errors=True)
+        await run_blocking(venv.create, snapshot, with_pip=True)
+        if self.base:
+            result = await self.install(self.base, snapshot)
+            print_verbose(f"Environment: {result}")
+        await run_blocking((snapshot / KEY_FILE).write_text, key)
+        return snapshot
+
+    def _replace_venv(self, snapshot: Path):
+        # Only reached for a missing venv or one holding an older snapshot key
+        staging = self.path.with_name(self.path.name + ".staging")
+        shutil.rmtree(staging, ignore_errors=True)
+        shutil.copytree(snapshot, staging, symlinks=True)
+        shutil.rmtree(self.path, ignore_errors=True)
+        staging.rename(self.path)
+
+
+environment_manager = EnvironmentManager(venv_path, Path(venv_snapshot_dir).absolute(), base_requirements)
@@ -1,28 +1,156 @@
-import subprocess
-import venv
+import asyncio
+import codecs
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 import os
+import re
+import signal
 from colorama import Fore, Style
-from chat_workflow.config import verbose
+from chat_workflow.config import verbose, blocking_executor_workers, pip_wheelhouse, exec_venv_path
+from utils.sandbox import OutputBudget
 
-# Create a virtual environment
-venv_path = Path("venv").absolute()
-venv.create(venv_path, with_pip=True)
+# The execution virtual environment; utils.environment builds it from a cached snapshot.
+# It is kept apart from the venv the server itself runs in, which the README places at backend/venv
+venv_path = Path(exec_venv_path).absolute()
+
+# Bounded pool for sync work that cannot be made async, so it never runs on the event loop
+blocking_executor = ThreadPoolExecutor(max_workers=blocking_executor_workers, thread_name_prefix="blocking")
+
+# Bytes taken from a process pipe per read
+READ_CHUNK = 64 * 1024
 
 def print_verbose(message):
     if verbose:
         print(f"{Fore.CYAN}{message}{Style.RESET_ALL}")
 
-def install_packages(packages):
+_venv_fingerprint = (None, None)
+
+def venv_fingerprint():
+    # Hash of the installed distributions; recomputed only when site-packages changes
+    global _venv_fingerprint
+    site_packages = sorted(venv_path.glob("lib/python*/site-packages"))
+    mtime = tuple(path.stat().st_mtime_ns for path in site_packages)
+    if _venv_fingerprint[0] != mtime:
+        distributions = sorted(dist.name for path in site_packages for dist in path.glob("*.dist-info"))
+        _venv_fingerprint = (mtime, hashlib.sha256("\n".join(distributions).encode()).hexdigest())
+    return _venv_fingerprint[1]
+
+def safe_path_name(name):
+    # Ids from the client become file names as-is only when harmless; anything else is hashed
+    if re.fullmatch(r"[\w-]{1,100}", name):
+        return name
+    return hashlib.sha256(name.encode("utf-8")).hexdigest()
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text and code
+    return len(text) // 4 + 1
+
+def truncate_middle(text, limit):
+    if len(text) <= limit:
+        return text
+    head = limit // 2
+    tail = limit - head
+    return f"{text[:head]}\n... [{len(text) - limit} characters truncated] ...\n{text[-tail:]}"
+
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_executor, partial(func, *args, **kwargs))
+
+class ProcessResult:
+    def __init__(self, returncode, stdout, stderr, limit=None):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        # The sandbox limit that stopped the process, if any (see utils.sandbox.LIMIT_HINTS)
+        self.limit = limit
+
+async def _read_stream(stream, name, chunks, on_output, budget=None):
+    # Fixed-size reads rather than readline, which fails on a line past the reader's limit; whole
+    # lines are passed on as they arrive, and a line longer than one read goes out in pieces
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    while True:
+        data = await stream.read(READ_CHUNK)
+        pending += decoder.decode(data, final=not data)
+        if data:
+            cut = pending.rfind("\n") + 1 or (len(pending) if len(pending) >= READ_CHUNK else 0)
+            text, pending = pending[:cut], pending[cut:]
+        else:
+            text, pending = pending, ""
+        # Past the budget, keep draining so the process is not blocked on a full pipe before it is killed
+        if text and (budget is None or budget.take(text)):
+            chunks.append(text)
+            if on_output is not None:
+                await on_output(name, text)
+        if not data:
+            return
+
+def _kill(process, group):
+    if process.returncode is not None:
+        return
+    try:
+        if group:
+            os.killpg(process.pid, signal.SIGKILL)  # also ends anything the process started
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+async def run_process(args, cwd=None, on_output=None, limits=None, env=None):
+    # on_output(stream_name, text) is awaited for every line as soon as the process writes it.
+    # With limits (utils.sandbox.ExecutionLimits) the process runs in its own session under rlimits,
+    # and the whole session is killed on timeout or once the output passes the byte limit
+    process = await asyncio.create_subprocess_exec(
+        *args, cwd=cwd, env=env, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        preexec_fn=limits.apply_rlimits if limits else None, start_new_session=limits is not None
+    )
+    stdout, stderr = [], []
+    budget = OutputBudget(limits.max_output_bytes if limits else 0, lambda: _kill(process, True))
+    limit = None
+    readers = [
+        asyncio.ensure_future(_read_stream(process.stdout, "stdout", stdout, on_output, budget)),
+        asyncio.ensure_future(_read_stream(process.stderr, "stderr", stderr, on_output, budget)),
+    ]
+    try:
+        try:
+            await asyncio.wait_for(asyncio.gather(*readers), limits.timeout if limits and limits.timeout else None)
+        except asyncio.TimeoutError:
+            limit = "timeout"
+            _kill(process, True)
+        await process.wait()
+    except BaseException:
+        # Cancelled, or a reader or on_output failed: nothing is left running behind the caller
+        for reader in readers:
+            reader.cancel()
+        _kill(process, limits is not None)
+        await asyncio.shield(process.wait())
+        raise
+    if budget.exceeded:
+        limit = "output"
+    elif limit is None and limits is not None:
+        limit = limits.classify(process.returncode, "".join(stderr))
+    return ProcessResult(process.returncode, "".join(stdout), "".join(stderr), limit)
+
+async def install_packages(packages, target_venv=None):
+    # Installs from the local wheelhouse when possible; otherwise builds the wheels into it first,
+    # so later installs of the same packages (e.g. new snapshots) work offline
     print_verbose(f"Installing packages: {packages}")
-    venv_path = Path("venv").absolute()
-    result = subprocess.run([f"{venv_path}/bin/pip", "install"] + packages, capture_output=True, text=True)
+    python_executable = f"{target_venv or venv_path}/bin/python"
+    wheelhouse = Path(pip_wheelhouse).absolute()
+    wheelhouse.mkdir(exist_ok=True)
+    offline = [python_executable, "-m", "pip", "install", "--no-index", "--find-links", str(wheelhouse)] + packages
+    result = await run_process(offline)
+    if result.returncode != 0:
+        download = await run_process([python_executable, "-m", "pip", "wheel", "--wheel-dir", str(wheelhouse)] + packages)
+        result = await run_process(offline) if download.returncode == 0 else download
     return f"Installation {'succeeded' if result.returncode == 0 else 'failed'}: {result.stdout or result.stderr}"
 
-def run_in_venv(script_path, working_dir):
+async def run_in_venv(script_path, working_dir, on_output=None, limits=None, scratch_dir=None):
+    # scratch_dir receives the script's temporary files, so removing it cleans up after the run
     print_verbose(f"Running script: {script_path}")
     python_executable = f"{venv_path}/bin/python"
-    result = subprocess.run([python_executable, script_path], cwd=working_dir, capture_output=True, text=True)
-    return result
-
-
+    env = dict(os.environ, TMPDIR=str(scratch_dir)) if scratch_dir is not None else None
+    return await run_process([python_executable, "-u", script_path], cwd=working_dir, on_output=on_output,
+                             limits=limits, env=env)
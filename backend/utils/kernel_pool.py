@@ -0,0 +1,449 @@
+import asyncio
+import json
+import os
+import signal
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+from utils.helpers import print_verbose, venv_path, run_blocking, safe_path_name
+from utils.metrics import metrics
+from utils.sandbox import ExecutionLimits, OutputBudget, default_limits
+from chat_workflow.config import (kernel_max_kernels, kernel_idle_timeout, kernel_warm_spares, kernel_preimports,
+                                  kernel_checkpoint_mode, kernel_checkpoint_dir, rich_output_table_rows)
+
+WORKER_SCRIPT = Path(__file__).with_name("kernel_worker.py")
+RECORD_PREFIX = "\x1e"
+STREAM_LIMIT = 16 * 1024 * 1024
+
+
+@dataclass
+class KernelResult:
+    success: bool
+    stdout: str
+    stderr: str
+    limit: Optional[str] = None
+    # One {MIME type: file name} per rich output, the files being in the display_dir the cell was given
+    displays: List[Dict[str, str]] = field(default_factory=list)
+
+
+class KernelDiedError(RuntimeError):
+    pass
+
+
+# Receives (stream_name, text) for each chunk of output as it is produced
+OutputCallback = Callable[[str, str], Awaitable[None]]
+
+
+class PythonKernel:
+    """A long-lived venv interpreter that executes code cells in a persistent namespace."""
+
+    def __init__(self, working_dir: Path, limits: ExecutionLimits = default_limits):
+        self.working_dir = working_dir
+        self.limits = limits
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.lock = asyncio.Lock()
+        # Requests the pool has handed this kernel to that are not finished with it yet
+        self.leases = 0
+        self.last_used = time.monotonic()
+        # Checkpoint to load into the namespace, and directory to move into, before the next request runs
+        self.restore_from: Optional[Path] = None
+        self.move_to: Optional[Path] = None
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    @property
+    def busy(self) -> bool:
+        return self.lock.locked() or self.leases > 0
+
+    async def start(self):
+        env = dict(os.environ, KERNEL_PREIMPORTS=kernel_preimports, KERNEL_TABLE_ROWS=str(rich_output_table_rows),
+                   PYTHONUNBUFFERED="1", **self.limits.kernel_env())
+        self.process = await asyncio.create_subprocess_exec(
+            f"{venv_path}/bin/python", str(WORKER_SCRIPT),
+            cwd=self.working_dir,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            env=env,
+            limit=STREAM_LIMIT,
+        )
+        record = await self._read_until(lambda r: r.get("type") == "ready", [])
+        print_verbose(f"KernelPool: Kernel ready (pid {record['pid']})")
+        return self
+
+    async def _read_until(self, done, stdout: List[str], stderr: Optional[List[str]] = None,
+                          on_output: Optional[OutputCallback] = None, budget: Optional[OutputBudget] = None,
+                          displays: Optional[List[Dict[str, str]]] = None):
+        while True:
+            try:
+                line = await self.process.stdout.readline()
+            except ValueError:
+                # A line past STREAM_LIMIT; the rest of it would be misread as records, so the kernel goes
+                self.process.kill()
+                await self.process.wait()
+                raise KernelDiedError(f"Kernel wrote a line longer than {STREAM_LIMIT} bytes and was restarted")
+            if not line:
+                await self.process.wait()
+                raise KernelDiedError(f"Kernel exited with code {self.process.returncode}")
+            text = line.decode("utf-8", errors="replace")
+            if not text.startswith(RECORD_PREFIX):
+                if budget is not None and not budget.take(text):
+                    continue
+                stdout.append(text)
+                if on_output is not None:
+                    await on_output("stdout", text)
+                continue
+            record = json.loads(text[len(RECORD_PREFIX):])
+            if record.get("type") == "stream":
+                if budget is not None and not budget.take(record["text"]):
+                    continue
+                (stderr if record["name"] == "stderr" and stderr is not None else stdout).append(record["text"])
+                if on_output is not None:
+                    await on_output(record["name"], record["text"])
+            elif record.get("type") == "display":
+                if displays is not None:
+                    displays.append(record["files"])
+            elif done(record):
+                return record
+
+    async def _send(self, request: dict):
+        self.process.stdin.write((json.dumps(request) + "\n").encode("utf-8"))
+        await self.process.stdin.drain()
+
+    async def _request(self, op: str, **fields) -> Optional[dict]:
+        # Caller holds self.lock
+        await self._send({"op": op, **fields})
+        reply = await self._read_until(lambda r: r.get("type") == "reply", [])
+        if reply["status"] != "ok":
+            print_verbose(f"KernelPool: {op} failed: {reply.get('error')}")
+            return None
+        return reply
+
+    async def _restore_pending(self):
+        if self.move_to is not None:
+            path, self.move_to = self.move_to, None
+            await self._request("chdir", path=str(path))
+        if self.restore_from is not None:
+            path, self.restore_from = self.restore_from, None
+            reply = await self._request("restore", path=str(path))
+            if reply:
+                print_verbose(f"KernelPool: Restored {len(reply['restored'])} variables from {path}"
+                              + (f", failed: {', '.join(reply['failed'])}" if reply['failed'] else ""))
+
+    async def request(self, op: str, **fields) -> Optional[dict]:
+        """Runs a non-cell operation (inspect, checkpoint, restore); None if it failed or the kernel is gone."""
+        async with self.lock:
+            if not self.alive:
+                return None
+            try:
+                await self._restore_pending()
+                return await self._request(op, **fields)
+            except (KernelDiedError, ConnectionResetError, BrokenPipeError) as e:
+                print_verbose(f"KernelPool: {op} failed: {e}")
+                return None
+
+    async def execute(self, code: str, on_output: Optional[OutputCallback] = None,
+                      display_dir: Optional[Path] = None) -> KernelResult:
+        """Runs a cell; with a display_dir, its rich outputs are written there and listed in the result."""
+        async with self.lock:
+            self.last_used = time.monotonic()
+            stdout, stderr, displays = [], [], []
+            # Too much output interrupts the cell; the worker enforces the CPU and memory limits itself
+            budget = OutputBudget(self.limits.max_output_bytes, lambda: self.process.send_signal(signal.SIGINT))
+            try:
+                await self._restore_pending()
+                await self._send({"code": code, "display_dir": str(display_dir) if display_dir else None})
+                reading = self._read_until(lambda r: r.get("type") == "result", stdout, stderr, on_output, budget, displays)
+                record = await asyncio.wait_for(reading, self.limits.timeout or None)
+            except asyncio.TimeoutError:
+                await self.interrupt()
+                return KernelResult(False, "".join(stdout), "".join(stderr), limit="timeout", displays=displays)
+            except (KernelDiedError, ConnectionResetError, BrokenPipeError) as e:
+                return KernelResult(False, "".join(stdout), "".join(stderr) + f"\n{e}", displays=displays)
+            except asyncio.CancelledError:
+                await asyncio.shield(self.interrupt())
+                raise
+            finally:
+                self.last_used = time.monotonic()
+
+            if record["status"] == "ok" and not budget.exceeded:
+                return KernelResult(True, "".join(stdout), "".join(stderr), displays=displays)
+            limit = "output" if budget.exceeded else record.get("limit")
+            return KernelResult(False, "".join(stdout), "".join(stderr) + record.get("error", ""), limit, displays)
+
+    async def interrupt(self, timeout: float = 5):
+        # Raise KeyboardInterrupt in the running cell and wait for its result so the
+        # protocol stays in sync; kill the kernel if it does not come back in time
+        if not self.alive:
+            return
+        self.process.send_signal(signal.SIGINT)
+        try:
+            await asyncio.wait_for(self._read_until(lambda r: r.get("type") == "result", []), timeout)
+        except (asyncio.TimeoutError, KernelDiedError):
+            self.process.kill()
+            await self.process.wait()
+
+    async def shutdown(self):
+        if not self.alive:
+            return
+        self.process.stdin.close()
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout=2)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+
+
+class KernelPool:
+    """Keeps one warm kernel per conversation, bounded in size and evicted when idle.
+
+    An evicted conversation's namespace is checkpointed to disk and restored into the next
+    kernel it gets, so variables survive eviction and restarts.
+    """
+
+    def __init__(self, working_dir: Path, max_kernels: int = kernel_max_kernels,
+                 idle_timeout: float = kernel_idle_timeout, warm_spares: int = kernel_warm_spares,
+                 checkpoint_mode: str = kernel_checkpoint_mode, checkpoint_dir: str = kernel_checkpoint_dir,
+                 limits: ExecutionLimits = default_limits):
+        self.working_dir = working_dir
+        self.limits = limits
+        self.max_kernels = max_kernels
+        self.idle_timeout = idle_timeout
+        self.warm_spares = warm_spares
+        self.checkpoint_mode = checkpoint_mode
+        self.checkpoint_dir = Path(checkpoint_dir).absolute()
+        self.kernels: "OrderedDict[str, PythonKernel]" = OrderedDict()
+        self.spares: List[PythonKernel] = []
+        # Slots reserved for kernels being started: conversations waiting for theirs, and spares
+        self.starting: Set[str] = set()
+        self.spares_starting = 0
+        # Evicted kernels still being checkpointed and shut down, which keep their slots until then
+        self.retiring = 0
+        self.evicting: Set[str] = set()
+        self.retire_tasks: Set[asyncio.Task] = set()
+        self.condition = asyncio.Condition()
+        self.reaper_task: Optional[asyncio.Task] = None
+        self.spare_task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self.kernels) + len(self.spares) + len(self.starting) + self.spares_starting + self.retiring
+
+    async def get(self, conversation_id: str, working_dir: Optional[Path] = None) -> PythonKernel:
+        """The conversation's kernel; a kernel newly handed to it runs its cells in working_dir when given.
+
+        The kernel counts as busy, and so is never evicted, until it is handed back with put_back().
+        """
+        self._ensure_background_tasks()
+        async with self.condition:
+            while True:
+                kernel = self.kernels.get(conversation_id)
+                if kernel is not None and kernel.alive:
+                    self.kernels.move_to_end(conversation_id)
+                    kernel.leases += 1
+                    return kernel
+                if conversation_id in self.starting or conversation_id in self.evicting:
+                    # Its kernel is being started, or checkpointed before it goes; either way, wait for it
+                    await self.condition.wait()
+                    continue
+                self.kernels.pop(conversation_id, None)
+
+                kernel = None
+                while self.spares and kernel is None:
+                    spare = self.spares.pop(0)
+                    kernel = spare if spare.alive else None
+                if kernel is not None:
+                    break
+                if len(self) < self.max_kernels:
+                    # The slot is reserved here and the kernel started outside the lock, since a cold
+                    # start with its pre-imports takes seconds that other conversations must not wait for
+                    self.starting.add(conversation_id)
+                    break
+                if not self.retiring:
+                    self._evict_one()
+                await self.condition.wait()
+        if kernel is None:
+            try:
+                kernel = await PythonKernel(self.working_dir, self.limits).start()
+            finally:
+                if kernel is None:
+                    async with self.condition:
+                        self.starting.discard(conversation_id)
+                        self.condition.notify_all()
+        async with self.condition:
+            self.starting.discard(conversation_id)
+            kernel.move_to = working_dir
+            if (self.checkpoint_path(conversation_id) / "manifest.json").exists():
+                kernel.restore_from = self.checkpoint_path(conversation_id)
+            kernel.leases += 1
+            self.kernels[conversation_id] = kernel
+            self.condition.notify_all()
+        self._refill_spares()
+        return kernel
+
+    async def put_back(self, conversation_id: str, kernel: PythonKernel):
+        """Ends a get(): the kernel may be evicted again, and leaves the pool if it died."""
+        async with self.condition:
+            kernel.leases -= 1
+            if not kernel.alive and not kernel.leases and self.kernels.get(conversation_id) is kernel:
+                del self.kernels[conversation_id]
+            self.condition.notify_all()
+
+    def checkpoint_path(self, conversation_id: str) -> Path:
+        return self.checkpoint_dir / safe_path_name(conversation_id)
+
+    async def checkpoint(self, conversation_id: str, kernel: PythonKernel, full: bool = True):
+        if self.checkpoint_mode == "off" or kernel.restore_from is not None:
+            return  # nothing ran since the restore, so the checkpoint on disk is current
+        reply = await kernel.request("checkpoint", path=str(self.checkpoint_path(conversation_id)), full=full)
+        if reply:
+            print_verbose(f"KernelPool: Checkpointed {len(reply['saved'])} variables for conversation {conversation_id}"
+                          + (f", skipped: {', '.join(reply['skipped'])}" if reply['skipped'] else ""))
+
+    async def describe(self, conversation_id: str) -> Optional[dict]:
+        """Live variables and modules of the conversation's namespace, from its kernel or its last checkpoint."""
+        kernel = self.kernels.get(conversation_id)
+        if kernel is not None and kernel.alive:
+            return await kernel.request("inspect")
+        manifest = self.checkpoint_path(conversation_id) / "manifest.json"
+        if manifest.exists():
+            return json.loads(await run_blocking(manifest.read_text))["summary"]
+        return None
+
+    async def execute(self, conversation_id: str, code: str, on_output: Optional[OutputCallback] = None,
+                      display_dir: Optional[Path] = None, working_dir: Optional[Path] = None) -> KernelResult:
+        kernel = await self.get(conversation_id, working_dir)
+        try:
+            result = await kernel.execute(code, on_output, display_dir)
+            if result.success and self.checkpoint_mode == "cell":
+                await self.checkpoint(conversation_id, kernel, full=False)
+            return result
+        finally:
+            await self.put_back(conversation_id, kernel)
+
+    async def adopt(self, key: str, conversation_id: str, working_dir: Path):
+        """Hands the kernel held under `key` to `conversation_id`, replacing any kernel it had.
+
+        Without a kernel under `key` there is nothing to hand over and the conversation keeps its own.
+        """
+        async with self.condition:
+            kernel = self.kernels.pop(key, None)
+            if kernel is None:
+                return
+            previous = self.kernels.pop(conversation_id, None)
+            self.kernels[conversation_id] = kernel
+            self.condition.notify_all()
+        if previous is not None:
+            await previous.shutdown()
+        await kernel.request("chdir", path=str(working_dir))
+
+    async def release(self, conversation_id: str):
+        async with self.condition:
+            kernel = self.kernels.pop(conversation_id, None)
+            self.condition.notify_all()
+        if kernel is not None:
+            await kernel.shutdown()
+
+    def _evict_one(self) -> bool:
+        # Caller holds self.condition; evicts a spare first, then the least recently used idle kernel
+        if self.spares:
+            self._retire(None, self.spares.pop())
+            return True
+        for conversation_id, kernel in self.kernels.items():
+            if not kernel.busy:
+                self._retire(conversation_id, self.kernels.pop(conversation_id))
+                return True
+        return False
+
+    def _retire(self, conversation_id: Optional[str], kernel: PythonKernel):
+        # Caller holds self.condition. Checkpointing a large namespace can take long, so it happens in
+        # the background; the kernel keeps its slot, and its conversation waits, until it is done
+        self.retiring += 1
+        if conversation_id is not None:
+            self.evicting.add(conversation_id)
+        task = asyncio.create_task(self._checkpoint_and_shutdown(conversation_id, kernel))
+        self.retire_tasks.add(task)
+        task.add_done_callback(self.retire_tasks.discard)
+
+    async def _checkpoint_and_shutdown(self, conversation_id: Optional[str], kernel: PythonKernel):
+        try:
+            if conversation_id is not None:
+                await self.checkpoint(conversation_id, kernel)
+                print_verbose(f"KernelPool: Evicted kernel for conversation {conversation_id}")
+            await kernel.shutdown()
+        finally:
+            async with self.condition:
+                self.retiring -= 1
+                self.evicting.discard(conversation_id)
+                self.condition.notify_all()
+
+    async def evict_idle(self):
+        now = time.monotonic()
+        async with self.condition:
+            expired = [cid for cid, k in self.kernels.items()
+                       if not k.busy and (now - k.last_used > self.idle_timeout or not k.alive)]
+            for conversation_id in expired:
+                self._retire(conversation_id, self.kernels.pop(conversation_id))
+        if expired:
+            print_verbose(f"KernelPool: Evicting {len(expired)} idle kernels")
+
+    async def shutdown(self):
+        for task in (self.reaper_task, self.spare_task):
+            if task is not None:
+                task.cancel()
+        async with self.condition:
+            conversations = list(self.kernels.items())
+            kernels = list(self.kernels.values()) + self.spares
+            self.kernels.clear()
+            self.spares.clear()
+        await asyncio.gather(*(self.checkpoint(cid, k) for cid, k in conversations), return_exceptions=True)
+        await asyncio.gather(*(k.shutdown() for k in kernels), *self.retire_tasks, return_exceptions=True)
+
+    def _ensure_background_tasks(self):
+        if self.reaper_task is None or self.reaper_task.done():
+            self.reaper_task = asyncio.create_task(self._reap())
+
+    def _refill_spares(self):
+        if self.warm_spares > 0 and (self.spare_task is None or self.spare_task.done()):
+            self.spare_task = asyncio.create_task(self._fill_spares())
+
+    async def _fill_spares(self):
+        while True:
+            async with self.condition:
+                if len(self.spares) >= self.warm_spares or len(self) >= self.max_kernels:
+                    return
+                self.spares_starting += 1
+            spare = None
+            try:
+                spare = await PythonKernel(self.working_dir, self.limits).start()
+            finally:
+                async with self.condition:
+                    self.spares_starting -= 1
+                    if spare is not None:
+                        self.spares.append(spare)
+                    self.condition.notify_all()
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(max(self.idle_timeout / 4, 1))
+            await self.evict_idle()
+
+
+_pools: Dict[Path, KernelPool] = {}
+
+
+def get_kernel_pool(working_dir: Path) -> KernelPool:
+    if working_dir not in _pools:
+        _pools[working_dir] = KernelPool(working_dir)
+    return _pools[working_dir]
+
+
+metrics.gauge("kernel_pool_kernels", "Live kernels, including warm spares", lambda: sum(len(pool) for pool in _pools.values()))
+
+
+async def shutdown_kernel_pools():
+    await asyncio.gather(*(pool.shutdown() for pool in _pools.values()))
+    _pools.clear()
@@ -0,0 +1,509 @@
+# Standalone worker executed by the venv interpreter. It must not import anything
+# from the backend package, since it runs inside the sandboxed venv.
+import ast
+import hashlib
+import importlib
+import importlib.abc
+import importlib.machinery
+import inspect
+import io
+import json
+import math
+import os
+import pickle
+import resource
+import signal
+import sys
+import traceback
+import types
+
+RECORD_PREFIX = "\x1e"
+# Sandbox limits from the parent; 0 disables
+CPU_SECONDS = int(os.environ.get("KERNEL_CPU_SECONDS", "0"))
+MEMORY_BYTES = int(os.environ.get("KERNEL_MEMORY_BYTES", "0"))
+# Rows in a table preview, and in each page of the Arrow file written for longer tables
+TABLE_ROWS = int(os.environ.get("KERNEL_TABLE_ROWS", "50"))
+# A cell that plots in a loop stops displaying after this many outputs
+MAX_DISPLAYS = 50
+
+PLOTLY_MIME = "application/vnd.plotly.v1+json"
+TABLE_MIME = "application/vnd.dataframe+json"
+ARROW_MIME = "application/vnd.apache.arrow.file"
+EXTENSIONS = {"image/png": "png", "image/svg+xml": "svg", PLOTLY_MIME: "plotly.json", TABLE_MIME: "table.json", ARROW_MIME: "arrow"}
+
+_protocol = os.fdopen(os.dup(sys.stdout.fileno()), "w", buffering=1, encoding="utf-8")
+
+
+def emit(record):
+    _protocol.write(RECORD_PREFIX + json.dumps(record) + "\n")
+    _protocol.flush()
+
+
+class StreamForwarder:
+    # Line-buffered so the parent receives whole lines as soon as they are printed
+    def __init__(self, name):
+        self.name = name
+        self.encoding = "utf-8"
+        self.buffer = ""
+
+    def write(self, text):
+        self.buffer += text
+        if "\n" in self.buffer:
+            head, _, self.buffer = self.buffer.rpartition("\n")
+            emit({"type": "stream", "name": self.name, "text": head + "\n"})
+        return len(text)
+
+    def flush(self):
+        if self.buffer:
+            emit({"type": "stream", "name": self.name, "text": self.buffer})
+            self.buffer = ""
+
+    def isatty(self):
+        return False
+
+
+# Directory the running cell writes its rich outputs to; None outside a cell or when the parent did not ask for them
+_display_dir = None
+_displayed = 0
+
+
+def _figure_png(figure):
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png", bbox_inches="tight")
+    return buffer.getvalue()
+
+
+def _arrow_file(frame):
+    # The whole table, one record batch per page, so the parent can serve any page without loading the rest
+    import pyarrow
+    import pyarrow.ipc
+    table = pyarrow.Table.from_pandas(frame, preserve_index=False).combine_chunks()
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"page_rows": str(TABLE_ROWS).encode()})
+    options = pyarrow.ipc.IpcWriteOptions(compression="zstd" if pyarrow.Codec.is_available("zstd") else None)
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_file(sink, table.schema, options=options) as writer:
+        for batch in table.to_batches(max_chunksize=TABLE_ROWS):
+            writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def _table(value):
+    import pandas
+    frame = value.to_frame() if isinstance(value, pandas.Series) else value
+    if not isinstance(frame.index, pandas.RangeIndex):
+        frame = frame.reset_index()
+    frame = frame.set_axis([str(column) for column in frame.columns], axis=1)
+    preview = json.loads(frame.head(TABLE_ROWS).to_json(orient="split", date_format="iso", default_handler=str))
+    # Columnar, as the Arrow pages are
+    bundle = {TABLE_MIME: json.dumps({
+        "columns": preview["columns"],
+        "dtypes": [str(dtype) for dtype in frame.dtypes],
+        "data": [[row[i] for row in preview["data"]] for i in range(len(preview["columns"]))],
+        "rows": len(frame),
+    })}
+    if len(frame) > TABLE_ROWS:
+        try:
+            bundle[ARROW_MIME] = _arrow_file(frame)
+        except Exception:
+            pass  # no pyarrow, or columns Arrow cannot represent: the preview is all the client gets
+    return bundle
+
+
+def mime_bundle(value):
+    """MIME type -> content (str or bytes) for values with a rich representation, else None."""
+    module, kind = type(value).__module__.split(".")[0], type(value).__name__
+    if module == "plotly" and hasattr(value, "to_json"):
+        return {PLOTLY_MIME: value.to_json()}
+    if module == "matplotlib" and kind == "Figure":
+        return {"image/png": _figure_png(value)}
+    if module == "pandas" and kind in ("DataFrame", "Series"):
+        return _table(value)
+    # IPython's display protocol, which many libraries implement
+    bundle = {}
+    if hasattr(value, "_repr_png_") and not inspect.isclass(value):
+        bundle["image/png"] = value._repr_png_()
+    if hasattr(value, "_repr_svg_") and not inspect.isclass(value):
+        bundle["image/svg+xml"] = value._repr_svg_()
+    return {mime: data for mime, data in bundle.items() if data} or None
+
+
+def _display(value):
+    global _displayed
+    if _display_dir is None or _displayed >= MAX_DISPLAYS:
+        return False
+    try:
+        bundle = mime_bundle(value)
+    except Exception as e:
+        print(f"Could not display {type(value).__name__}: {type(e).__name__}: {e}", file=sys.stderr)
+        return False
+    if not bundle:
+        return False
+    _displayed += 1
+    files = {}
+    for mime, data in bundle.items():
+        file = f"{_displayed}.{EXTENSIONS[mime]}"
+        _write_atomic(os.path.join(_display_dir, file), lambda f: f.write(data), mode="wb" if isinstance(data, bytes) else "w")
+        files[mime] = file
+    emit({"type": "display", "files": files})
+    return True
+
+
+def display(*values):
+    """Shows values in the chat as rich outputs (figures, tables, images), like IPython's display()."""
+    for value in values:
+        if not _display(value):
+            print(repr(value))
+
+
+def _flush_figures(*args, **kwargs):
+    # Open pyplot figures are displayed and closed, as the notebook inline backend does after a cell
+    pyplot = sys.modules.get("matplotlib.pyplot")
+    if pyplot is None or _display_dir is None:
+        return
+    for number in pyplot.get_fignums():
+        _display(pyplot.figure(number))
+    pyplot.close("all")
+
+
+class PostImportHooks(importlib.abc.MetaPathFinder):
+    """Runs a hook right after a module is first imported, e.g. to route plotly's fig.show() to display()."""
+
+    def __init__(self, hooks):
+        self.hooks = hooks
+
+    def find_spec(self, name, path=None, target=None):
+        hook = self.hooks.pop(name, None)
+        if hook is None:
+            return None
+        spec = importlib.machinery.PathFinder.find_spec(name, path)
+        if spec is None or spec.loader is None:
+            return None
+        exec_module = spec.loader.exec_module
+
+        def exec_and_hook(module):
+            exec_module(module)
+            hook(module)
+
+        spec.loader.exec_module = exec_and_hook
+        return spec
+
+
+def _patch_plotly(basedatatypes):
+    basedatatypes.BaseFigure.show = lambda self, *args, **kwargs: display(self)
+
+
+def _patch_pyplot(pyplot):
+    pyplot.show = _flush_figures
+
+
+def install_display_hooks():
+    hooks = {"plotly.basedatatypes": _patch_plotly, "matplotlib.pyplot": _patch_pyplot}
+    for name in list(hooks):
+        if name in sys.modules:
+            hooks.pop(name)(sys.modules[name])
+    sys.meta_path.insert(0, PostImportHooks(hooks))
+
+
+def _compile_cell(code):
+    # As in a notebook, a trailing expression is evaluated on its own so its value can be displayed
+    tree = ast.parse(code, "<cell>")
+    if tree.body and isinstance(tree.body[-1], ast.Expr):
+        last = ast.Expression(tree.body.pop().value)
+        return compile(tree, "<cell>", "exec"), compile(last, "<cell>", "eval")
+    return compile(tree, "<cell>", "exec"), None
+
+
+def preimport(modules):
+    for module in modules:
+        try:
+            if module == "matplotlib":
+                import matplotlib
+                matplotlib.use("Agg")
+            else:
+                __import__(module)
+        except Exception:
+            pass
+
+
+class CpuTimeExceeded(Exception):
+    pass
+
+
+_running = False
+
+
+def _on_sigint(signum, frame):
+    # Only a running cell is interrupted; a late SIGINT must not end the worker between requests
+    if _running:
+        raise KeyboardInterrupt
+
+
+def _on_sigxcpu(signum, frame):
+    raise CpuTimeExceeded(f"CPU time limit of {CPU_SECONDS}s exceeded")
+
+
+def _set_cpu_limit(seconds):
+    # The soft limit is moved per cell, so it bounds the cell rather than the worker's lifetime
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if seconds is None:
+        resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = math.ceil(usage.ru_utime + usage.ru_stime) + seconds
+    resource.setrlimit(resource.RLIMIT_CPU, (soft if hard == resource.RLIM_INFINITY else min(soft, hard), hard))
+
+
+def apply_limits():
+    signal.signal(signal.SIGINT, _on_sigint)
+    if CPU_SECONDS:
+        signal.signal(signal.SIGXCPU, _on_sigxcpu)
+    if MEMORY_BYTES:
+        resource.setrlimit(resource.RLIMIT_AS, (MEMORY_BYTES, MEMORY_BYTES))
+
+
+def limit_of(error):
+    if isinstance(error, CpuTimeExceeded):
+        return "cpu_time"
+    if isinstance(error, MemoryError) and MEMORY_BYTES:
+        return "memory"
+    return None
+
+
+def execute(code, namespace, display_dir=None):
+    global _running, _display_dir, _displayed
+    if display_dir:
+        os.makedirs(display_dir, exist_ok=True)
+    _display_dir, _displayed = display_dir, 0
+    if CPU_SECONDS:
+        _set_cpu_limit(CPU_SECONDS)
+    _running = True
+    try:
+        body, last = _compile_cell(code)
+        exec(body, namespace)
+        if last is not None:
+            value = eval(last, namespace)
+            if value is not None:
+                _display(value)
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            return {"type": "result", "status": "error", "error": f"SystemExit: {e.code}"}
+    except BaseException as e:
+        # Drop the worker's own frame so the traceback starts at the cell
+        error = "".join(traceback.format_exception(type(e), e, e.__traceback__.tb_next))
+        return {"type": "result", "status": "error", "error": error, "limit": limit_of(e)}
+    finally:
+        _running = False
+        if CPU_SECONDS:
+            _set_cpu_limit(None)
+        try:
+            _flush_figures()  # also after an error, like a notebook
+        except Exception:
+            pass
+        _display_dir = None
+    return {"type": "result", "status": "ok"}
+
+
+def user_variables(namespace):
+    for name, value in namespace.items():
+        if not name.startswith("_") and value is not display:
+            yield name, value
+
+
+def describe(value):
+    info = {"type": type(value).__name__}
+    shape = getattr(value, "shape", None)
+    if isinstance(shape, tuple):
+        info["shape"] = list(shape)
+    elif hasattr(value, "__len__") and not isinstance(value, (str, bytes)):
+        try:
+            info["len"] = len(value)
+        except Exception:
+            pass
+    columns = getattr(value, "columns", None)
+    if columns is not None:
+        info["columns"] = [str(column) for column in list(columns)[:20]]
+    elif getattr(value, "dtype", None) is not None:
+        info["dtype"] = str(value.dtype)
+    if value is None or isinstance(value, (bool, int, float, complex, str)):
+        info["value"] = repr(value)[:80]
+    return info
+
+
+def inspect_namespace(namespace):
+    variables, modules = [], []
+    for name, value in user_variables(namespace):
+        if isinstance(value, types.ModuleType):
+            modules.append({"name": name, "module": value.__name__})
+        elif inspect.isfunction(value) or inspect.isclass(value):
+            variables.append({"name": name, "type": "function" if inspect.isfunction(value) else "class"})
+        else:
+            variables.append({"name": name, **describe(value)})
+    return {"variables": variables, "modules": modules}
+
+
+# Checkpoint directory -> {variable name: digest of the value last written}, so cell checkpoints only write
+# what changed, whether it was rebound or modified in place
+_checkpointed = {}
+
+
+def _write_atomic(path, write, mode="wb"):
+    temporary = f"{path}.tmp"
+    with open(temporary, mode) as f:
+        write(f)
+    os.replace(temporary, path)
+
+
+def _is_array(value):
+    # Plain and memory-mapped (e.g. restored) arrays; subclasses such as masked arrays would lose their type in .npy
+    numpy = sys.modules.get("numpy")
+    return numpy is not None and isinstance(value, numpy.ndarray) and type(value) in (numpy.ndarray, numpy.memmap)
+
+
+def fingerprint(value):
+    """Digest of a value's content, or None when it cannot be computed and the value must be saved."""
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        if (type(value).__module__.split(".")[0], type(value).__name__) == ("pandas", "DataFrame"):
+            import pandas
+            digest.update(repr((value.shape, [str(c) for c in value.columns], [str(d) for d in value.dtypes])).encode())
+            digest.update(pandas.util.hash_pandas_object(value, index=True).values.tobytes())
+        elif _is_array(value) and value.dtype != object:
+            import numpy
+            digest.update(repr((value.shape, value.dtype.str)).encode())
+            digest.update(memoryview(numpy.ascontiguousarray(value)).cast("B"))
+        else:
+            digest.update(pickle.dumps(value, protocol=5))
+    except Exception:
+        return None
+    return digest.hexdigest()
+
+
+def save_value(directory, name, value):
+    kind = (type(value).__module__.split(".")[0], type(value).__name__)
+    if kind == ("pandas", "DataFrame"):
+        try:
+            file = f"{name}.parquet"
+            _write_atomic(os.path.join(directory, file), value.to_parquet)
+            return {"format": "parquet", "file": file}
+        except Exception:
+            pass  # no parquet engine, or columns parquet cannot represent
+    if _is_array(value) and value.dtype != object:
+        import numpy
+        file = f"{name}.npy"
+        _write_atomic(os.path.join(directory, file), lambda f: numpy.save(f, value))
+        return {"format": "npy", "file": file}
+    if getattr(value, "__module__", None) == "__main__":
+        raise TypeError("defined in a cell")  # would pickle as a reference to this worker's __main__
+    file = f"{name}.pkl"
+    _write_atomic(os.path.join(directory, file), lambda f: pickle.dump(value, f, protocol=5))
+    return {"format": "pickle", "file": file}
+
+
+def load_value(directory, entry):
+    if entry["format"] == "module":
+        return importlib.import_module(entry["module"])
+    path = os.path.join(directory, entry["file"])
+    if entry["format"] == "parquet":
+        import pandas
+        return pandas.read_parquet(path, memory_map=True)
+    if entry["format"] == "npy":
+        import numpy
+        return numpy.load(path, mmap_mode="c")  # copy-on-write: pages are read lazily and never written back
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def checkpoint(namespace, directory, full):
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, "manifest.json")
+    previous = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            previous = json.load(f)["variables"]
+    written = {} if full else _checkpointed.get(directory, {})
+    entries, saved, skipped = {}, [], []
+    for name, value in user_variables(namespace):
+        if isinstance(value, types.ModuleType):
+            entries[name] = {"format": "module", "module": value.__name__}
+            continue
+        digest = fingerprint(value)
+        if digest is not None and written.get(name) == digest and name in previous:
+            entries[name] = previous[name]
+            continue
+        try:
+            entries[name] = {**save_value(directory, name, value), "digest": digest}
+            written[name] = digest
+            saved.append(name)
+        except Exception as e:
+            skipped.append(f"{name} ({type(e).__name__})")
+    for name, entry in previous.items():
+        if "file" in entry and entries.get(name, {}).get("file") != entry["file"]:
+            try:
+                os.remove(os.path.join(directory, entry["file"]))
+            except FileNotFoundError:
+                pass
+    manifest = {"variables": entries, "skipped": skipped, "summary": inspect_namespace(namespace)}
+    _write_atomic(manifest_path, lambda f: json.dump(manifest, f), mode="w")
+    _checkpointed[directory] = {name: written[name] for name in entries if written.get(name) is not None}
+    return {"saved": saved, "skipped": skipped}
+
+
+def restore(namespace, directory):
+    with open(os.path.join(directory, "manifest.json")) as f:
+        entries = json.load(f)["variables"]
+    restored, failed = [], []
+    for name, entry in entries.items():
+        try:
+            namespace[name] = load_value(directory, entry)
+            restored.append(name)
+        except Exception as e:
+            failed.append(f"{name} ({type(e).__name__})")
+    # The digests saved with the values, so restoring does not read every memory-mapped value to hash it
+    _checkpointed[directory] = {name: entries[name].get("digest") for name in restored if entries[name].get("digest")}
+    return {"restored": restored, "failed": failed}
+
+
+def handle(request, namespace):
+    # Requests without an "op" are code cells; the others answer with a "reply" record
+    op = request.get("op", "execute")
+    if op == "execute":
+        return execute(request["code"], namespace, request.get("display_dir"))
+    try:
+        if op == "inspect":
+            reply = inspect_namespace(namespace)
+        elif op == "checkpoint":
+            reply = checkpoint(namespace, request["path"], request.get("full", False))
+        elif op == "restore":
+            reply = restore(namespace, request["path"])
+        elif op == "chdir":
+            os.makedirs(request["path"], exist_ok=True)
+            os.chdir(request["path"])
+            reply = {}
+        else:
+            raise ValueError(f"Unknown op {op}")
+    except Exception as e:
+        return {"type": "reply", "status": "error", "error": f"{type(e).__name__}: {e}"}
+    return {"type": "reply", "status": "ok", **reply}
+
+
+def main():
+    install_display_hooks()
+    preimport([m for m in os.environ.get("KERNEL_PREIMPORTS", "").split(",") if m])
+    apply_limits()
+    namespace = {"__name__": "__main__", "__builtins__": __builtins__, "display": display}
+    sys.stdout = StreamForwarder("stdout")
+    sys.stderr = StreamForwarder("stderr")
+    emit({"type": "ready", "pid": os.getpid()})
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        result = handle(request, namespace)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        emit(result)
+
+
+if __name__ == "__main__":
+    main()
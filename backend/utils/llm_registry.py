@@ -0,0 +1,213 @@
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Tuple
+import httpx
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from utils.helpers import print_verbose
+from utils.metrics import metrics, span
+from chat_workflow.config import llm_provider, llm_model, llm_roles, llm_max_connections, llm_max_concurrent, llm_max_retries, llm_fake_latency
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+MAX_BACKOFF = 30.0
+FAKE_RESPONSE = "```python\nimport time\ntime.sleep(0.5)\nprint('done')\n```"
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic offline chat model with a fixed response latency.
+
+    `rules` are (marker, response) pairs: the first marker found in the last message picks the
+    response, so scripted prompts can get failing code, large output and so on; others get `response`.
+    """
+
+    response: str = FAKE_RESPONSE
+    latency: float = llm_fake_latency
+    rules: List[Tuple[str, str]] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return self._result(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return self._result(messages)
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        prompt = messages[-1].content if messages else ""
+        content = next((response for marker, response in self.rules if marker in prompt), self.response)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+
+def _groq_model(model: str, http_client: httpx.Client, http_async_client: httpx.AsyncClient, **options) -> BaseChatModel:
+    from langchain_groq import ChatGroq
+    # Retries are handled by LLMClient so they respect the shared concurrency limit
+    return ChatGroq(model=model, temperature=0, max_tokens=None, timeout=None, max_retries=0,
+                    http_client=http_client, http_async_client=http_async_client, **options)
+
+
+def _fake_model(model: str, http_client: httpx.Client, http_async_client: httpx.AsyncClient, **options) -> BaseChatModel:
+    return FakeChatModel(**options)
+
+
+PROVIDERS = {
+    'groq': _groq_model,
+    'fake': _fake_model,
+}
+
+
+class LLMClient:
+    """Chat model bound to a role; calls share the provider's concurrency limit and back off on rate limits."""
+
+    def __init__(self, role: str, provider: str, model_name: str, model: BaseChatModel, registry: "LLMRegistry"):
+        self.role = role
+        self.provider = provider
+        self.model_name = model_name
+        self.model = model
+        self.registry = registry
+
+    @property
+    def temperature(self):
+        return getattr(self.model, 'temperature', None)
+
+    async def ainvoke(self, messages, **kwargs):
+        # kwargs override call parameters such as temperature
+        with span("llm", role=self.role):
+            async with self.registry.slot(self.provider):
+                return await self._ainvoke(messages, **kwargs)
+
+    async def _ainvoke(self, messages, **kwargs):
+        for attempt in range(self.registry.max_retries + 1):
+            try:
+                return await self.model.ainvoke(messages, **kwargs)
+            except Exception as e:
+                await self._backoff(e, attempt)
+
+    async def astream(self, messages, **kwargs):
+        with span("llm", role=self.role):
+            async with self.registry.slot(self.provider):
+                async for chunk in self._astream(messages, **kwargs):
+                    yield chunk
+
+    async def _astream(self, messages, **kwargs):
+        for attempt in range(self.registry.max_retries + 1):
+            started = False
+            try:
+                async for chunk in self.model.astream(messages, **kwargs):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started:
+                    raise  # part of the answer is already out; retrying would duplicate it
+                await self._backoff(e, attempt)
+
+    async def _backoff(self, error: Exception, attempt: int):
+        # Re-raises unless the error is retryable and attempts remain
+        status = getattr(error, 'status_code', None)
+        if status not in RETRY_STATUS_CODES or attempt >= self.registry.max_retries:
+            raise error
+        delay = retry_after(error)
+        if delay is None:
+            delay = min(MAX_BACKOFF, 2 ** attempt) * random.uniform(0.5, 1.0)
+        self.registry.retries[self.provider] = self.registry.retries.get(self.provider, 0) + 1
+        print_verbose(f"LLM: {self.provider} returned {status} for {self.role}, retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, 'response', None)
+    value = response.headers.get('retry-after') if response is not None else None
+    try:
+        return min(MAX_BACKOFF, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+class LLMRegistry:
+    """Process-wide LLM clients, one per role, sharing one keep-alive connection pool per provider."""
+
+    def __init__(self, roles: Dict[str, Dict] = llm_roles, max_connections: int = llm_max_connections,
+                 max_concurrent: int = llm_max_concurrent, max_retries: int = llm_max_retries):
+        self.roles = {role: dict(settings) for role, settings in roles.items()}
+        self.max_connections = max_connections
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.clients: Dict[str, LLMClient] = {}
+        self.http_clients: Dict[str, tuple] = {}
+        self.semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.in_flight: Dict[str, int] = {}
+        self.calls: Dict[str, int] = {}
+        self.retries: Dict[str, int] = {}
+
+    def configure(self, role: str, provider: str = None, model: str = None, **options):
+        settings = self.roles.setdefault(role, {'provider': llm_provider, 'model': llm_model})
+        if provider is not None:
+            settings['provider'] = provider
+        if model is not None:
+            settings['model'] = model
+        settings['options'] = options
+        self.clients.pop(role, None)
+
+    def get(self, role: str) -> LLMClient:
+        client = self.clients.get(role)
+        if client is None:
+            settings = self.roles[role]
+            provider = settings['provider']
+            if provider not in PROVIDERS:
+                raise ValueError(f"Unknown LLM provider '{provider}' for role '{role}'")
+            model = PROVIDERS[provider](settings['model'], *self._http_clients(provider), **settings.get('options', {}))
+            client = self.clients[role] = LLMClient(role, provider, settings['model'], model, self)
+            print_verbose(f"LLM: Created {provider} client for {role} ({settings['model']})")
+        return client
+
+    @asynccontextmanager
+    async def slot(self, provider: str):
+        async with self.semaphore(provider):
+            self.in_flight[provider] = self.in_flight.get(provider, 0) + 1
+            self.calls[provider] = self.calls.get(provider, 0) + 1
+            try:
+                yield
+            finally:
+                self.in_flight[provider] -= 1
+
+    def semaphore(self, provider: str) -> asyncio.Semaphore:
+        if provider not in self.semaphores:
+            self.semaphores[provider] = asyncio.Semaphore(self.max_concurrent)
+        return self.semaphores[provider]
+
+    def _http_clients(self, provider: str):
+        if provider not in self.http_clients:
+            limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+            self.http_clients[provider] = (httpx.Client(limits=limits), httpx.AsyncClient(limits=limits))
+        return self.http_clients[provider]
+
+    def stats(self) -> Dict:
+        return {
+            'roles': {role: {'provider': s['provider'], 'model': s['model']} for role, s in self.roles.items()},
+            'max_concurrent': self.max_concurrent,
+            'in_flight': dict(self.in_flight),
+            'calls': dict(self.calls),
+            'retries': dict(self.retries),
+        }
+
+    async def close(self):
+        for http_client, http_async_client in self.http_clients.values():
+            http_client.close()
+            await http_async_client.aclose()
+        self.http_clients.clear()
+        self.clients.clear()
+
+
+llm_registry = LLMRegistry()
+metrics.gauge("llm_in_flight", "LLM calls in progress", lambda: dict(llm_registry.in_flight), label="provider")
+
+
+def get_llm(role: str) -> LLMClient:
+    return llm_registry.get(role)
@@ -0,0 +1,195 @@
+import bisect
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from fastapi.responses import PlainTextResponse
+from utils.helpers import print_verbose, run_blocking, safe_path_name
+from chat_workflow.config import profiling_enabled, profile_slow_turn_seconds, profile_dir
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _escape_label(value) -> str:
+    # The exposition format's escapes inside a quoted label value
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values: Dict[Labels, float] = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels):
+        self.values[tuple(sorted(labels.items()))] += amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format_labels(labels)} {value}" for labels, value in self.values.items()]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self.series: Dict[Labels, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self.series.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0])
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(labels, (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Read at scrape time; the callback returns a number, or {label value: number} when `label` is set."""
+
+    def __init__(self, name: str, help: str, callback: Callable, label: str = None):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.label = label
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        value = self.callback()
+        if self.label is None:
+            lines.append(f"{self.name} {value}")
+        else:
+            lines += [f"{self.name}{_format_labels(((self.label, key),))} {v}" for key, v in value.items()]
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, help))
+
+    def histogram(self, name: str, help: str, buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, help, buckets))
+
+    def gauge(self, name: str, help: str, callback: Callable, label: str = None) -> Gauge:
+        self.metrics[name] = Gauge(name, help, callback, label)
+        return self.metrics[name]
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            try:
+                lines += metric.render()
+            except Exception as e:
+                print_verbose(f"Metrics: Failed to render {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+stage_latency = metrics.histogram("chat_stage_latency_seconds", "Latency of chat turn stages")
+
+
+class TurnProfile:
+    """Span timings of one chat turn, written as folded stacks (flamegraph.pl / speedscope input)."""
+
+    def __init__(self):
+        self.totals: Dict[Tuple[str, ...], float] = defaultdict(float)
+
+    def record(self, path: Tuple[str, ...], elapsed: float):
+        self.totals[path] += elapsed
+
+    def folded(self) -> List[str]:
+        # Self time of a frame is its total minus the time spent in its direct children
+        child_time: Dict[Tuple[str, ...], float] = defaultdict(float)
+        for path, elapsed in self.totals.items():
+            if len(path) > 1:
+                child_time[path[:-1]] += elapsed
+        lines = []
+        for path, elapsed in self.totals.items():
+            micros = int(max(0.0, elapsed - child_time[path]) * 1e6)
+            if micros:
+                lines.append(f"{';'.join(path)} {micros}")
+        return lines
+
+    def write(self, label: str) -> Path:
+        directory = Path(profile_dir)
+        directory.mkdir(parents=True, exist_ok=True)
+        # The label is the client's conversation id, so it must not pick the directory
+        path = directory / f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{safe_path_name(label)}.folded"
+        path.write_text("\n".join(self.folded()) + "\n")
+        return path
+
+
+_span_path: ContextVar[Tuple[str, ...]] = ContextVar("span_path", default=())
+_turn_profile: ContextVar[Optional[TurnProfile]] = ContextVar("turn_profile", default=None)
+
+
+@contextmanager
+def span(stage: str, **labels):
+    """Times a stage into the latency histogram and, while a turn is profiled, into its flame data."""
+    frame = stage if not labels else f"{stage}:{','.join(str(v) for v in labels.values())}"
+    path = _span_path.get() + (frame,)
+    token = _span_path.set(path)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        try:
+            _span_path.reset(token)
+        except ValueError:
+            pass  # an abandoned async generator is closed from another context
+        stage_latency.observe(elapsed, stage=stage, **labels)
+        profile = _turn_profile.get()
+        if profile is not None:
+            profile.record(path, elapsed)
+
+
+@asynccontextmanager
+async def profile_turn(label: str):
+    profile = TurnProfile() if profiling_enabled else None
+    token = _turn_profile.set(profile)
+    start = time.perf_counter()
+    try:
+        with span("turn"):
+            yield
+    finally:
+        _turn_profile.reset(token)
+        elapsed = time.perf_counter() - start
+        if profile is not None and elapsed >= profile_slow_turn_seconds:
+            # Profiling is diagnostics: failing to write it must not fail the turn it describes
+            try:
+                path = await run_blocking(profile.write, label)
+                print_verbose(f"Metrics: Turn took {elapsed:.2f}s, flame data written to {path}")
+            except Exception as e:
+                print_verbose(f"Metrics: Turn took {elapsed:.2f}s, could not write flame data: {e}")
+
+
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
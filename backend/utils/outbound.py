@@ -0,0 +1,146 @@
+import asyncio
+import json
+from collections import deque
+from typing import Awaitable, Callable, Deque, List, Optional
+from fastapi import WebSocket
+from utils.metrics import metrics, span
+from chat_workflow.config import ws_queue_max_messages, ws_send_timeout, ws_batch_delay, ws_batch_max_messages
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+frames_sent = metrics.counter("websocket_frames_total", "Websocket frames sent, by encoding")
+messages_sent = metrics.counter("websocket_messages_sent_total", "Messages sent over websockets, after stream deltas were merged")
+stalled_clients = metrics.counter("websocket_stalled_disconnects_total", "Clients disconnected because their outbound queue stayed full")
+
+# Streamed messages whose text can be appended to a pending message of the same kind:
+# type -> (text field, fields that must match)
+MERGEABLE = {'chat_delta': ('delta', ('conversation_id',)), 'exec_stream': ('text', ('conversation_id', 'stream'))}
+
+
+def _merge(previous: dict, message: dict) -> bool:
+    spec = MERGEABLE.get(message.get('type'))
+    if spec is None or previous.get('type') != message['type']:
+        return False
+    field, keys = spec
+    if any(previous.get(key) != message.get(key) for key in keys):
+        return False
+    previous[field] += message[field]
+    return True
+
+
+class OutboundQueue:
+    """Bounded send path of one websocket, drained by a single sender task.
+
+    Messages that queue up while a frame is being sent go out together as one {"type": "batch"}
+    frame, and stream deltas are merged into the pending delta, so token streams never fill the
+    queue. The batch being sent still counts against the bound until its send completes. A producer
+    facing a full queue waits up to the send timeout, and so does each send; after that the client
+    is treated as stalled and disconnected rather than buffered without bound.
+    """
+
+    def __init__(self, websocket: WebSocket, encoding: str = "json", max_messages: int = ws_queue_max_messages,
+                 send_timeout: float = ws_send_timeout, batch_delay: float = ws_batch_delay,
+                 batch_max_messages: int = ws_batch_max_messages,
+                 on_closed: Optional[Callable[[], Awaitable[None]]] = None):
+        self.websocket = websocket
+        # msgpack is opt-in per connection and falls back to JSON when the package is not installed
+        self.encoding = "msgpack" if encoding == "msgpack" and msgpack is not None else "json"
+        self.max_messages = max_messages
+        self.send_timeout = send_timeout
+        self.batch_delay = batch_delay
+        self.batch_max_messages = batch_max_messages
+        self.on_closed = on_closed
+        self.pending: Deque[dict] = deque()
+        # Messages of the frame being sent, which hold their place in the queue until the send returns
+        self.in_flight = 0
+        self.has_pending = asyncio.Event()
+        self.has_space = asyncio.Event()
+        self.has_space.set()
+        self.closed = False
+        self.task: Optional[asyncio.Task] = None
+
+    def qsize(self) -> int:
+        return len(self.pending) + self.in_flight
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+        return self
+
+    async def put(self, message: dict, block: bool = True) -> bool:
+        """Queues a message; False if it was dropped because the socket is closed, stalled or (unblocking) full."""
+        if self.closed:
+            return False
+        if self.pending and _merge(self.pending[-1], message):
+            return True
+        while self.qsize() >= self.max_messages:
+            if not block:
+                return False
+            self.has_space.clear()
+            try:
+                await asyncio.wait_for(self.has_space.wait(), self.send_timeout)
+            except asyncio.TimeoutError:
+                stalled_clients.inc()
+                await self._give_up(f"outbound queue stayed full for {self.send_timeout:g}s")
+                return False
+            if self.closed:
+                return False
+        # Copied when it may be merged into later, so the producer's dict is never changed
+        self.pending.append(dict(message) if message.get('type') in MERGEABLE else message)
+        self.has_pending.set()
+        return True
+
+    async def _run(self):
+        try:
+            while True:
+                await self.has_pending.wait()
+                if self.batch_delay:
+                    await asyncio.sleep(self.batch_delay)  # lets a burst gather into one frame
+                batch = [self.pending.popleft() for _ in range(min(len(self.pending), self.batch_max_messages))]
+                if not self.pending:
+                    self.has_pending.clear()
+                self.in_flight = len(batch)
+                try:
+                    await asyncio.wait_for(self._send(batch), self.send_timeout)
+                except asyncio.TimeoutError:
+                    stalled_clients.inc()
+                    await self._give_up(f"sending a frame took longer than {self.send_timeout:g}s")
+                    return
+                finally:
+                    self.in_flight = 0
+                self.has_space.set()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error in sending message: {str(e)}")
+            await self._give_up(None)
+
+    async def _send(self, batch: List[dict]):
+        frame = batch[0] if len(batch) == 1 else {'type': 'batch', 'messages': batch}
+        with span("ws_send"):
+            if self.encoding == "msgpack":
+                await self.websocket.send_bytes(msgpack.packb(frame, use_bin_type=True))
+            else:
+                await self.websocket.send_text(json.dumps(frame, separators=(",", ":"), ensure_ascii=False))
+        frames_sent.inc(encoding=self.encoding)
+        messages_sent.inc(len(batch))
+
+    async def _give_up(self, reason: Optional[str]):
+        if self.closed:
+            return
+        if reason:
+            print(f"Closing websocket: {reason}")
+        await self.close()
+        if self.on_closed is not None:
+            await self.on_closed()
+
+    async def close(self):
+        """Drops what is pending and stops the sender; blocked producers return False."""
+        self.closed = True
+        self.pending.clear()
+        self.has_space.set()
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
@@ -0,0 +1,109 @@
+import json
+import math
+from pathlib import Path
+from typing import Dict, List
+from fastapi import Response
+from utils.artifacts import artifact_store
+from utils.helpers import print_verbose, run_blocking
+from chat_workflow.config import rich_output_inline_bytes
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+PLOTLY_MIME = "application/vnd.plotly.v1+json"
+TABLE_MIME = "application/vnd.dataframe+json"
+ARROW_MIME = "application/vnd.apache.arrow.file"
+IMAGE_NAMES = {"image/png": "figure_{}.png", "image/svg+xml": "figure_{}.svg"}
+# When a display offers several representations, the first of these it has is used
+PREFERENCE = (PLOTLY_MIME, TABLE_MIME, "image/png", "image/svg+xml")
+
+
+def collect_sync(display_dir: Path, displays: List[Dict[str, str]]) -> List[Dict]:
+    """Turns a cell's display files into message outputs.
+
+    Table previews and small Plotly figures travel inside the message; images, large figures and
+    the Arrow file behind a long table are stored as artifacts the client fetches on its own.
+    """
+    outputs = []
+    for index, files in enumerate(displays, 1):
+        mime = next((mime for mime in PREFERENCE if mime in files), None)
+        if mime is None:
+            continue
+        try:
+            data = (display_dir / files[mime]).read_bytes()
+            if mime in IMAGE_NAMES:
+                output = {'mime_type': mime, 'artifact': artifact_store.put_sync(data, IMAGE_NAMES[mime].format(index), mime)}
+            elif mime == PLOTLY_MIME and len(data) > rich_output_inline_bytes:
+                output = {'mime_type': mime, 'artifact': artifact_store.put_sync(data, f"figure_{index}.json", "application/json")}
+            else:
+                output = {'mime_type': mime, 'data': json.loads(data)}
+            if mime == TABLE_MIME and ARROW_MIME in files:
+                arrow = (display_dir / files[ARROW_MIME]).read_bytes()
+                output['artifact'] = artifact_store.put_sync(arrow, f"table_{index}.arrow", ARROW_MIME)
+        except (OSError, ValueError) as e:
+            print_verbose(f"RichOutput: Could not read display {index}: {e}")
+            continue
+        outputs.append(output)
+    return outputs
+
+
+async def collect(display_dir: Path, displays: List[Dict[str, str]]) -> List[Dict]:
+    if not displays:
+        return []
+    return await run_blocking(collect_sync, display_dir, displays)
+
+
+def describe(outputs: List[Dict]) -> str:
+    # What was displayed, in the text the summary and retry prompts see
+    lines = []
+    for output in outputs:
+        if output['mime_type'] == TABLE_MIME:
+            table = output['data']
+            columns = ", ".join(table['columns'][:20]) + (", ..." if len(table['columns']) > 20 else "")
+            lines.append(f"[Displayed table: {table['rows']} rows x {len(table['columns'])} columns ({columns})]")
+        elif output['mime_type'] == PLOTLY_MIME:
+            lines.append("[Displayed Plotly figure]")
+        else:
+            lines.append(f"[Displayed image ({output['mime_type']})]")
+    return "\n".join(lines)
+
+
+def _json_value(value):
+    if isinstance(value, float) and not math.isfinite(value):
+        return None  # JSON has no NaN or infinity
+    return value
+
+
+def read_page_sync(artifact_id: str, page: int) -> bytes:
+    """One record batch of a stored Arrow table as columnar JSON, like the preview in the message."""
+    with pyarrow.memory_map(str(artifact_store.file_path(artifact_id))) as source:
+        reader = pyarrow.ipc.open_file(source)
+        if not 0 <= page < reader.num_record_batches:
+            raise IndexError(page)
+        batch = reader.get_batch(page)
+        page_rows = int((reader.schema.metadata or {}).get(b"page_rows", batch.num_rows))
+        body = {
+            'page': page,
+            'pages': reader.num_record_batches,
+            'offset': page * page_rows,
+            'columns': batch.schema.names,
+            'data': [[_json_value(value) for value in column.to_pylist()] for column in batch.columns],
+        }
+    return json.dumps(body, default=lambda value: value.isoformat() if hasattr(value, "isoformat") else str(value)).encode()
+
+
+async def table_page_endpoint(artifact_id: str, page: int):
+    meta = await run_blocking(artifact_store.metadata, artifact_id)
+    if meta is None or meta['media_type'] != ARROW_MIME or meta['encoding'] != "identity":
+        return Response(status_code=404)
+    if pyarrow is None:
+        return Response("Table pages need the 'pyarrow' package on the server", status_code=501)
+    try:
+        body = await run_blocking(read_page_sync, artifact_id, page)
+    except IndexError:
+        return Response(status_code=404)
+    # Pages of a content-addressed table never change
+    return Response(body, media_type="application/json", headers={'Cache-Control': "public, max-age=31536000, immutable"})
@@ -0,0 +1,95 @@
+import resource
+import signal
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+from chat_workflow.config import sandbox_timeout, sandbox_cpu_seconds, sandbox_memory_mb, sandbox_max_output_bytes
+
+# What the CodingAgent is told when a run hit a limit, keyed by ExecutionResult.limit
+LIMIT_HINTS = {
+    "timeout": "Make the code finish sooner: avoid unbounded loops and blocking calls, and work on a sample of large data.",
+    "cpu_time": "Reduce the computation: vectorise loops, sample the data, or use a cheaper algorithm.",
+    "memory": "Use less memory: load only the columns and rows needed, use smaller dtypes, or process the data in chunks.",
+    "output": "Print less: show summaries such as head(), describe() or value counts instead of whole objects.",
+}
+
+
+@dataclass
+class ExecutionResult:
+    success: bool
+    output: str
+    artifacts: List[Dict] = field(default_factory=list)
+    # Which limit stopped the run (a LIMIT_HINTS key), None when it ended on its own
+    limit: Optional[str] = None
+    # Rich outputs (figures, tables) the code displayed, as built by utils.rich_output
+    outputs: List[Dict] = field(default_factory=list)
+
+
+@dataclass
+class ExecutionLimits:
+    """Limits for one run of generated code; 0 disables a limit."""
+
+    timeout: float = sandbox_timeout
+    cpu_seconds: int = sandbox_cpu_seconds
+    memory_bytes: int = sandbox_memory_mb * 1024 * 1024
+    max_output_bytes: int = sandbox_max_output_bytes
+
+    def apply_rlimits(self):
+        # Runs in the child between fork and exec, so it does no more than the two calls
+        if self.cpu_seconds:
+            # SIGXCPU at the soft limit, SIGKILL a little later if the process handles it
+            resource.setrlimit(resource.RLIMIT_CPU, (self.cpu_seconds, self.cpu_seconds + 5))
+        if self.memory_bytes:
+            resource.setrlimit(resource.RLIMIT_AS, (self.memory_bytes, self.memory_bytes))
+
+    def kernel_env(self) -> Dict[str, str]:
+        # Kernels apply these themselves: the CPU limit is per cell, not per process lifetime
+        return {"KERNEL_CPU_SECONDS": str(self.cpu_seconds), "KERNEL_MEMORY_BYTES": str(self.memory_bytes)}
+
+    def classify(self, returncode: int, stderr: str) -> Optional[str]:
+        """The limit a finished process ran into, judged from how it ended."""
+        if self.cpu_seconds and returncode == -signal.SIGXCPU:
+            return "cpu_time"
+        # An allocation over RLIMIT_AS fails inside the interpreter instead of killing it
+        if self.memory_bytes and returncode != 0 and "MemoryError" in stderr[-4000:]:
+            return "memory"
+        return None
+
+    def describe(self, limit: str) -> str:
+        return {
+            "timeout": f"the run took longer than the {self.timeout:g}s time limit",
+            "cpu_time": f"the run used more than the {self.cpu_seconds}s CPU time limit",
+            "memory": f"the run needed more than the {self.memory_bytes // (1024 * 1024)} MB memory limit",
+            "output": f"the run printed more than the {self.max_output_bytes} byte output limit",
+        }[limit]
+
+    def failure(self, stderr: str, limit: Optional[str]) -> str:
+        # Execution output of a failed run, in the form the retry loop feeds back to the CodingAgent
+        if limit is None:
+            return f"Execution failed. Error: {stderr}"
+        return f"Execution failed. Error: {stderr}\nExecution stopped: {self.describe(limit)}."
+
+
+default_limits = ExecutionLimits()
+
+
+class OutputBudget:
+    """Counts output bytes and calls on_exceeded once when they pass the limit (0 for no limit)."""
+
+    def __init__(self, limit: int, on_exceeded: Callable[[], None]):
+        self.limit = limit
+        self.on_exceeded = on_exceeded
+        self.used = 0
+        self.exceeded = False
+
+    def take(self, text: str) -> bool:
+        """Whether `text` still fits; output after the limit is dropped."""
+        if self.exceeded:
+            return False
+        if not self.limit:
+            return True
+        self.used += len(text.encode("utf-8", errors="replace"))
+        if self.used > self.limit:
+            self.exceeded = True
+            self.on_exceeded()
+            return False
+        return True
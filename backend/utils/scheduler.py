@@ -0,0 +1,124 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List
+from utils.helpers import print_verbose
+from utils.metrics import metrics, span
+from chat_workflow.config import execution_max_concurrent, execution_user_quota
+
+
+class ExecutionScheduler:
+    """Bounded pool of execution slots with per-user quotas and fair queueing.
+
+    Each user has a priority queue (lower value runs first). The user with the fewest running
+    jobs is served next, in rotation among equals, skipping users already at their quota.
+    Cancelling the awaiting task removes a pending job or cancels a running one.
+    """
+
+    def __init__(self, max_concurrent: int = execution_max_concurrent, user_quota: int = execution_user_quota):
+        self.max_concurrent = max_concurrent
+        self.user_quota = user_quota
+        self.pending: "OrderedDict[str, List]" = OrderedDict()
+        self.running: Dict[str, int] = {}
+        self.sequence = itertools.count()
+        self.lock = asyncio.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self.pending.values())
+
+    @property
+    def running_count(self) -> int:
+        return sum(self.running.values())
+
+    async def submit(self, user_id: str, job: Callable[[], Awaitable], priority: int = 0):
+        ready = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self.sequence), ready]
+        async with self.lock:
+            heapq.heappush(self.pending.setdefault(user_id, []), entry)
+            self.submitted += 1
+            self._dispatch()
+
+        queued_at = time.monotonic()
+        try:
+            with span("execution_wait"):
+                await ready
+        except asyncio.CancelledError:
+            async with self.lock:
+                if ready.done() and not ready.cancelled():
+                    self._release(user_id)
+                else:
+                    self._remove(user_id, entry)
+                self.cancelled += 1
+            raise
+        waited = time.monotonic() - queued_at
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        print_verbose(f"Scheduler: Job for {user_id} started after {waited:.3f}s (queue depth {self.queue_depth})")
+
+        try:
+            return await job()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.completed += 1
+            async with self.lock:
+                self._release(user_id)
+
+    def _remove(self, user_id: str, entry):
+        queue = self.pending.get(user_id)
+        if queue and entry in queue:
+            queue.remove(entry)
+            heapq.heapify(queue)
+            if not queue:
+                del self.pending[user_id]
+
+    def _release(self, user_id: str):
+        self.running[user_id] -= 1
+        if not self.running[user_id]:
+            del self.running[user_id]
+        self._dispatch()
+
+    def _dispatch(self):
+        # Caller holds self.lock
+        while self.running_count < self.max_concurrent:
+            eligible = [u for u in self.pending if self.running.get(u, 0) < self.user_quota]
+            if not eligible:
+                return
+            # Fewest running jobs first; ties go to whoever is earliest in the rotation
+            user_id = min(eligible, key=lambda u: self.running.get(u, 0))
+            queue = self.pending.pop(user_id)
+            _, _, ready = heapq.heappop(queue)
+            if queue:
+                self.pending[user_id] = queue  # re-append: the user goes to the back of the rotation
+            if ready.cancelled():
+                continue
+            self.running[user_id] = self.running.get(user_id, 0) + 1
+            ready.set_result(None)
+
+    def stats(self) -> Dict:
+        started = self.submitted - self.queue_depth
+        return {
+            'queue_depth': self.queue_depth,
+            'running': self.running_count,
+            'max_concurrent': self.max_concurrent,
+            'user_quota': self.user_quota,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'cancelled': self.cancelled,
+            'wait_seconds_avg': self.wait_total / started if started else 0.0,
+            'wait_seconds_max': self.wait_max,
+        }
+
+
+execution_scheduler = ExecutionScheduler()
+metrics.gauge("execution_queue_depth", "Executions waiting for a slot", lambda: execution_scheduler.queue_depth)
+metrics.gauge("execution_running", "Executions holding a slot", lambda: execution_scheduler.running_count)
@@ -8,7 +8,18 @@ function App() {
   const [instructions, setInstructions] = useState('create a survival plot for IO vs. Chemo and save it as survival.png');
   const [conversationId, setConversationId] = useState('');
   const [conversations, setConversations] = useState([]);
+  const [hasMoreConversations, setHasMoreConversations] = useState(false);
+  const conversationsCursor = useRef(null);
+  const conversationSearch = useRef('');
+  const currentConversation = useRef('');
   const [chatHistory, setChatHistory] = useState([]);
+  const [hasMoreHistory, setHasMoreHistory] = useState(false);
+  // Turns sent and not yet finished, per conversation, so switching conversations shows the right state
+  const [runningTurns, setRunningTurns] = useState({});
+  const historyCursor = useRef(null);
+  const loadingMore = useRef(false);
+  // Whether the last message shown is one the current turn is still streaming into
+  const streamOpen = useRef(false);
   const ws = useRef(null);
 
   const handleNewConversation = () => {
@@ -20,49 +31,118 @@ function App() {
     }
   };
 
-  const requestConversations = () => {
+  // Pages come newest first; a cursor asks for the page after the ones already shown
+  const requestConversations = (cursor = null) => {
     if (ws.current.readyState === WebSocket.OPEN) {
       ws.current.send(JSON.stringify({ 
         type: 'meta',
-        action: 'get_conversations'
+        action: 'get_conversations',
+        cursor: cursor,
+        search: conversationSearch.current
       }));
     }
   };
 
+  const handleSearchConversations = (search) => {
+    conversationSearch.current = search;
+    requestConversations();
+  };
+
+  const handleLoadMoreConversations = () => {
+    if (conversationsCursor.current !== null) {
+      requestConversations(conversationsCursor.current);
+    }
+  };
+
   useEffect(() => {
     ws.current = new WebSocket('ws://localhost:8000/ws');
     ws.current.onopen = () => {
       console.log('WebSocket Connected');
       requestConversations();
     };
-    ws.current.onmessage = (event) => {
-      const data = JSON.parse(event.data);
+    const handleMessage = (data) => {
       console.log('Received message:', data);
       console.log('Received data type:', data.type, 'Action:', data.action || 'N/A');
-      
+
+      // A turn keeps running when the user switches conversations; its messages must not land in the one on screen
+      const turnMessage = data.type === 'chat_message' || data.type === 'chat_delta' || data.type === 'exec_stream';
+      if (turnMessage && data.conversation_id !== undefined && data.conversation_id !== currentConversation.current) {
+        return;
+      }
+
       if (data.type === 'chat_message') {
-        setChatHistory(prevHistory => [...prevHistory, data.message]);
+        if (data.replace_last && streamOpen.current) {
+          setChatHistory(prevHistory => [...prevHistory.slice(0, -1), data.message]);
+        } else {
+          // Also a final message whose stream started before this conversation was (re)loaded
+          setChatHistory(prevHistory => [...prevHistory, data.message]);
+        }
+        streamOpen.current = !data.replace_last;
+      } else if (data.type === 'chat_delta' || data.type === 'exec_stream') {
+        if (!streamOpen.current) {
+          return;  // the start of this stream was not shown, so its final message will be
+        }
+        const text = data.type === 'chat_delta' ? data.delta : data.text;
+        setChatHistory(prevHistory => {
+          if (prevHistory.length === 0) {
+            return prevHistory;
+          }
+          const last = prevHistory[prevHistory.length - 1];
+          return [...prevHistory.slice(0, -1), { ...last, content: last.content + text }];
+        });
       } else if (data.type === 'meta') {
         switch (data.action) {
           case 'conversations':
-            setConversations(data.data.reverse());
-            if (data.data.length > 0 && !conversationId) {
-              handleLoadConversation(data.data[0].conversation_id);
+            if (data.data.search !== conversationSearch.current) {
+              break;  // an answer to a search the user has typed past
+            }
+            conversationsCursor.current = data.data.cursor;
+            setHasMoreConversations(data.data.has_more);
+            if (data.data.append) {
+              setConversations(prevConversations => [...prevConversations, ...data.data.conversations]);
+            } else {
+              setConversations(data.data.conversations);
+            }
+            if (data.data.conversations.length > 0 && !currentConversation.current) {
+              handleLoadConversation(data.data.conversations[0].conversation_id);
             }
             break;
           case 'conversation_info':
             setConversationId(data.data.id);
+            streamOpen.current = false;
             setChatHistory([]);
             break;
+          case 'history_page':
+            loadingMore.current = false;
+            if (data.data.conversation_id !== currentConversation.current) {
+              break;  // a page of a conversation the user has since left
+            }
+            if (data.data.cursor !== null) {
+              historyCursor.current = data.data.cursor;
+            }
+            setHasMoreHistory(data.data.has_more);
+            if (data.data.prepend) {
+              setChatHistory(prevHistory => [...data.data.messages, ...prevHistory]);
+            } else {
+              streamOpen.current = false;
+              setChatHistory(data.data.messages);
+            }
+            break;
+          case 'turn_complete':
+          case 'turn_cancelled':
+            setRunningTurns(prevTurns => {
+              const { [data.data.conversation_id]: count = 0, ...others } = prevTurns;
+              return count > 1 ? { ...others, [data.data.conversation_id]: count - 1 } : others;
+            });
+            break;
           case 'conversation_loaded':
             console.log('Conversation fully loaded');
             break;
           case 'new_conversation':
+            currentConversation.current = data.data.conversation_id;
             setConversationId(data.data.conversation_id);
-            setConversations(prevConversations => [
-              { conversation_id: data.data.conversation_id, summary: data.data.summary },
-              ...prevConversations
-            ]);
+            setConversations(prevConversations => [data.data.conversation, ...prevConversations]);
+            streamOpen.current = false;
             setChatHistory([]);
             break;
           default:
@@ -72,6 +152,15 @@ function App() {
         console.warn('Unknown message type:', data.type);
       }
     };
+    ws.current.onmessage = (event) => {
+      const data = JSON.parse(event.data);
+      // Messages queued together on the server arrive as one batch frame, in order
+      if (data.type === 'batch') {
+        data.messages.forEach(handleMessage);
+      } else {
+        handleMessage(data);
+      }
+    };
     return () => {
       ws.current.close();
     };
@@ -88,11 +177,42 @@ function App() {
         conversation_id: conversationId
       }));
       setInstructions('');
+      setRunningTurns(prevTurns => ({ ...prevTurns, [conversationId]: (prevTurns[conversationId] || 0) + 1 }));
+    }
+  };
+
+  const handleCancel = () => {
+    if (ws.current.readyState === WebSocket.OPEN) {
+      ws.current.send(JSON.stringify({
+        type: 'meta',
+        action: 'cancel',
+        conversation_id: conversationId
+      }));
+    }
+  };
+
+  const handleLoadMore = () => {
+    if (!hasMoreHistory || loadingMore.current || ws.current.readyState !== WebSocket.OPEN) {
+      return;
+    }
+    loadingMore.current = true;
+    ws.current.send(JSON.stringify({
+      type: 'meta',
+      action: 'load_more',
+      conversation_id: conversationId,
+      cursor: historyCursor.current
+    }));
+  };
+
+  const handleHistoryScroll = (event) => {
+    if (event.target.scrollTop === 0) {
+      handleLoadMore();
     }
   };
 
   const handleLoadConversation = (id) => {
     console.log('Loading conversation:', id);
+    currentConversation.current = id;
     setConversationId(id);
     if (ws.current.readyState === WebSocket.OPEN) {
       ws.current.send(JSON.stringify({ 
@@ -110,12 +230,18 @@ function App() {
         onSelectConversation={handleLoadConversation}
         currentConversationId={conversationId}
         onNewConversation={handleNewConversation}
+        onSearch={handleSearchConversations}
+        onLoadMore={handleLoadMoreConversations}
+        hasMore={hasMoreConversations}
       />
       <div className="main-content">
         <h1>React - FastAPI - Coding Agent</h1>
         <p>Current Conversation ID: {conversationId}</p>
         <div className="chat-container">
-          <div className="chat-history">
+          <div className="chat-history" onScroll={handleHistoryScroll}>
+            {hasMoreHistory && (
+              <button className="load-more" onClick={handleLoadMore}>Load older messages</button>
+            )}
             {chatHistory.length > 0 ? (
               chatHistory.map((msg, index) => (
                 <ChatMessage
@@ -133,6 +259,8 @@ function App() {
             message={instructions}
             setMessage={setInstructions}
             onSend={handleSubmit}
+            onCancel={handleCancel}
+            isRunning={Boolean(runningTurns[conversationId])}
           />
         </div>
       </div>
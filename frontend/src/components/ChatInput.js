@@ -1,7 +1,7 @@
 import React from 'react';
 import './ChatInput.css';
 
-function ChatInput({ message, setMessage, onSend }) {
+function ChatInput({ message, setMessage, onSend, onCancel, isRunning }) {
   const handleKeyDown = (e) => {
     if (e.key === 'Enter' && !e.shiftKey) {
       e.preventDefault();
@@ -19,6 +19,13 @@ function ChatInput({ message, setMessage, onSend }) {
         placeholder="Type your message here..."
         rows={1}
       />
+      {isRunning && (
+        <button className="chat-input-cancel-button" onClick={onCancel} title="Cancel the running request">
+          <svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24" fill="currentColor" width="24" height="24">
+            <path d="M6 6h12v12H6z" />
+          </svg>
+        </button>
+      )}
       <button className="chat-input-send-button" onClick={onSend}>
         <svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24" fill="currentColor" width="24" height="24">
           <path d="M2.01 21L23 12 2.01 3 2 10l15 2-15 2z" />
@@ -2,6 +2,13 @@ import React, { useState } from 'react';
 import ReactMarkdown from 'react-markdown';
 import Plot from 'react-plotly.js';
 import PlotlyComponent from './PlotlyComponent';
+import RichOutput, { ARTIFACT_URL } from './RichOutput';
+
+const formatSize = (bytes) => {
+  if (bytes < 1024) return `${bytes} B`;
+  if (bytes < 1024 * 1024) return `${(bytes / 1024).toFixed(1)} KB`;
+  return `${(bytes / (1024 * 1024)).toFixed(1)} MB`;
+};
 
 function ChatMessage({ message, isLastMessage, isUserMessage }) {
   const [isExpanded, setIsExpanded] = useState(isUserMessage || isLastMessage);
@@ -44,6 +51,25 @@ function ChatMessage({ message, isLastMessage, isUserMessage }) {
           >
             {message.content}
           </ReactMarkdown>
+          {message.outputs && message.outputs.length > 0 && (
+            <div className="message-outputs">
+              {message.outputs.map((output, i) => <RichOutput key={i} output={output} />)}
+            </div>
+          )}
+          {message.artifacts && message.artifacts.length > 0 && (
+            <div className="message-artifacts">
+              {message.artifacts.map((artifact) => {
+                const url = `${ARTIFACT_URL}/${artifact.id}`;
+                return artifact.media_type.startsWith('image/') ? (
+                  <img key={artifact.id} src={url} alt={artifact.name} className="message-artifact-image" />
+                ) : (
+                  <a key={artifact.id} href={url} download={artifact.name} className="message-artifact-link">
+                    {artifact.name} ({formatSize(artifact.size)})
+                  </a>
+                );
+              })}
+            </div>
+          )}
           {message.details && (
             <pre className="message-details"><ReactMarkdown>{message.details}</ReactMarkdown></pre>
           )}
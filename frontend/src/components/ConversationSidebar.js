@@ -1,7 +1,22 @@
-import React from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import './ConversationSidebar.css';
 
-function ConversationSidebar({ conversations, onSelectConversation, currentConversationId, onNewConversation }) {
+const SEARCH_DELAY_MS = 300;
+
+function ConversationSidebar({ conversations, onSelectConversation, currentConversationId, onNewConversation, onSearch, onLoadMore, hasMore }) {
+  const [search, setSearch] = useState('');
+  const searchTimer = useRef(null);
+
+  // Searches once typing pauses rather than on every keystroke
+  useEffect(() => () => clearTimeout(searchTimer.current), []);
+
+  const handleSearchChange = (event) => {
+    const value = event.target.value;
+    setSearch(value);
+    clearTimeout(searchTimer.current);
+    searchTimer.current = setTimeout(() => onSearch(value.trim()), SEARCH_DELAY_MS);
+  };
+
   const truncateSummary = (summary, maxLength = 30) => {
     return summary && summary.length > maxLength ? summary.substring(0, maxLength) + '...' : summary || 'No summary';
   };
@@ -10,6 +25,13 @@ function ConversationSidebar({ conversations, onSelectConversation, currentConve
     <div className="conversation-sidebar">
       <h2>Conversations</h2>
       <button onClick={onNewConversation} className="new-conversation-btn">New Conversation</button>
+      <input
+        type="search"
+        className="conversation-search"
+        placeholder="Search summaries"
+        value={search}
+        onChange={handleSearchChange}
+      />
       <ul>
         {conversations.map((conv) => (
           <li 
@@ -24,6 +46,9 @@ function ConversationSidebar({ conversations, onSelectConversation, currentConve
           </li>
         ))}
       </ul>
+      {hasMore && (
+        <button onClick={onLoadMore} className="load-more-conversations">Load more</button>
+      )}
     </div>
   );
 }
@@ -0,0 +1,111 @@
+import React, { useEffect, useState } from 'react';
+import Plot from 'react-plotly.js';
+
+export const ARTIFACT_URL = 'http://localhost:8000/artifacts';
+
+const PLOTLY_MIME = 'application/vnd.plotly.v1+json';
+const TABLE_MIME = 'application/vnd.dataframe+json';
+
+const formatCell = (value) => (value === null || value === undefined ? '' : String(value));
+
+function PlotlyOutput({ output }) {
+  // Small figures come inside the message, large ones are fetched from the artifact store
+  const [figure, setFigure] = useState(output.data || null);
+
+  useEffect(() => {
+    if (!output.data && output.artifact) {
+      fetch(`${ARTIFACT_URL}/${output.artifact.id}`)
+        .then(response => response.json())
+        .then(setFigure)
+        .catch(error => console.error('Error loading figure:', error));
+    }
+  }, [output]);
+
+  if (!figure) {
+    return <div className="rich-output-loading">Loading figure…</div>;
+  }
+  return (
+    <Plot
+      data={figure.data}
+      layout={{ ...figure.layout, autosize: true }}
+      useResizeHandler
+      style={{ width: '100%' }}
+    />
+  );
+}
+
+function TableOutput({ output }) {
+  // The message carries the first page; further pages are read from the table's Arrow artifact
+  const preview = output.data;
+  const pageRows = preview.data.length > 0 ? preview.data[0].length : 0;
+  const pages = output.artifact && pageRows > 0 ? Math.ceil(preview.rows / pageRows) : 1;
+  const [page, setPage] = useState({ page: 0, offset: 0, data: preview.data });
+  const [loading, setLoading] = useState(false);
+
+  const showPage = (number) => {
+    if (number === 0) {
+      setPage({ page: 0, offset: 0, data: preview.data });
+      return;
+    }
+    setLoading(true);
+    fetch(`${ARTIFACT_URL}/${output.artifact.id}/pages/${number}`)
+      .then(response => response.json())
+      .then(data => setPage({ page: data.page, offset: data.offset, data: data.data }))
+      .catch(error => console.error('Error loading table page:', error))
+      .finally(() => setLoading(false));
+  };
+
+  const rowCount = page.data.length > 0 ? page.data[0].length : 0;
+  const rows = Array.from({ length: rowCount }, (_, row) => page.data.map(column => column[row]));
+
+  return (
+    <div className="rich-table">
+      <div className="rich-table-scroll">
+        <table>
+          <thead>
+            <tr>
+              {preview.columns.map((column, i) => (
+                <th key={i} title={preview.dtypes[i]}>{column}</th>
+              ))}
+            </tr>
+          </thead>
+          <tbody>
+            {rows.map((cells, row) => (
+              <tr key={page.offset + row}>
+                {cells.map((cell, i) => <td key={i}>{formatCell(cell)}</td>)}
+              </tr>
+            ))}
+          </tbody>
+        </table>
+      </div>
+      <div className="rich-table-footer">
+        <span>
+          {rowCount > 0 ? `Rows ${page.offset + 1}–${page.offset + rowCount} of ${preview.rows}` : 'No rows'}
+          {`, ${preview.columns.length} columns`}
+        </span>
+        {pages > 1 && (
+          <span className="rich-table-pager">
+            <button onClick={() => showPage(page.page - 1)} disabled={loading || page.page === 0}>Previous</button>
+            <span>Page {page.page + 1} of {pages}</span>
+            <button onClick={() => showPage(page.page + 1)} disabled={loading || page.page >= pages - 1}>Next</button>
+          </span>
+        )}
+      </div>
+    </div>
+  );
+}
+
+function RichOutput({ output }) {
+  if (output.mime_type === PLOTLY_MIME) {
+    return <PlotlyOutput output={output} />;
+  }
+  if (output.mime_type === TABLE_MIME) {
+    return <TableOutput output={output} />;
+  }
+  if (output.mime_type.startsWith('image/') && output.artifact) {
+    return <img src={`${ARTIFACT_URL}/${output.artifact.id}`} alt={output.artifact.name} className="message-artifact-image" />;
+  }
+  return null;
+}
+
+export default RichOutput;